@@ -0,0 +1,105 @@
+# Per-move latency of the two move paths on one worker: game.service.update,
+# which runs APPLY_MOVE and decodes its reply for every move, and the game's
+# actor (game.actors), which answers from memory and replays the moves to
+# Redis in pipelines behind the replies. The same random games are played on
+# each path, --concurrency games at a time, with the flusher writing SQL.
+# Reports p50/p99 per move and moves/s, then checks both paths left the
+# same boards in Redis.
+#
+#   DB_CONNECTION=sqlite:///./bench.db python -m benchmarks.bench_actors --games 500 --fake-redis
+import argparse
+import asyncio
+import os
+import random
+import time
+
+os.environ.setdefault("DB_CONNECTION", "sqlite:///./bench.db")
+
+from database import DB, AsyncDB
+from redis_database import AsyncRedisDB
+from game.model import UpdateGameModel
+from game.schema import GameSchema
+from game.flusher import GameFlusher
+from game.actors import GameActors
+import game.scripts as gameScripts
+import game.service as gameService
+from benchmarks.bench_async_latency import serialize_sqlite_writers
+
+def percentile(samples: list, fraction: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+async def play(game_id: int, size: int, seed: int, move, latencies: list):
+    rng = random.Random(seed)
+    game = {"turn": "Alice", "is_over": False, "board": [[''] * size for _ in range(size)]}
+    while not game["is_over"]:
+        free = [(row, col) for row in range(size) for col in range(size) if not game["board"][row][col]]
+        data = UpdateGameModel(turn=game["turn"], move=list(rng.choice(free)))
+        start = time.perf_counter()
+        game = await move(data, str(game_id))
+        latencies.append(time.perf_counter() - start)
+
+async def run(name: str, first_id: int, args, move, redis_db) -> list:
+    for game_id in range(first_id, first_id + args.games):
+        await gameService.create_matched(game_id, "Alice", "Bob", redis_db)
+    latencies = []
+    pending = iter(range(args.games))
+    async def player():
+        for index in pending:
+            await play(first_id + index, 3, args.seed + index, move, latencies)
+    start = time.perf_counter()
+    await asyncio.gather(*(player() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(f"{name:<16} p50 {percentile(latencies, 0.5) * 1e6:>7.0f}us  p99 {percentile(latencies, 0.99) * 1e6:>7.0f}us  "
+          f"{len(latencies) / elapsed:>8,.0f} moves/s")
+    return latencies
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--fake-redis', action='store_true')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    db = DB.get_instance()
+    GameSchema.__table__.drop(bind=db.engine, checkfirst=True)
+    db.Base.metadata.create_all(bind=db.engine)
+    serialize_sqlite_writers()
+    if args.fake_redis:
+        import fakeredis
+        redis_db = fakeredis.FakeAsyncRedis()
+    else:
+        redis_db = AsyncRedisDB.get_db()
+        await redis_db.flushdb()
+    await gameScripts.load_all(redis_db)
+    flusher = GameFlusher.get_instance()
+    await flusher.start(redis_db)
+    actors = GameActors(redis_db=redis_db)
+    await actors.start()
+
+    async def by_update(data, game_id):
+        return await gameService.update(data, game_id, None, redis_db)
+    async def by_actor(data, game_id):
+        return await actors.move(data, game_id, None, redis_db)
+
+    update_latencies = await run("service.update", 1, args, by_update, redis_db)
+    actor_latencies = await run("actors", args.games + 1, args, by_actor, redis_db)
+    await actors.stop()
+    await flusher.stop()
+    ratio = percentile(update_latencies, 0.5) / percentile(actor_latencies, 0.5)
+    print(f"actors p50 {ratio:.1f}x faster" if ratio >= 1 else f"actors p50 {1 / ratio:.1f}x slower", end=", ")
+    print(f"{actors.replayed_moves} moves replayed, {actors.diverged} diverged")
+
+    # the same seeds must have left the same games in Redis
+    for index in range(args.games):
+        expected = await gameService.get_game(1 + index, redis_db)
+        actual = await gameService.get_game(args.games + 1 + index, redis_db)
+        assert expected["board"] == actual["board"] and expected["seq"] == actual["seq"], index + 1
+
+    await AsyncDB.close_db_connection()
+    DB.close_db_connection()
+    await redis_db.aclose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
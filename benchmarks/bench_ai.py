@@ -0,0 +1,53 @@
+# Build time, memory footprint and per-move latency of the perfect-play table
+# (game.ai) for each difficulty, over bot turns of random games.
+#
+#   python -m benchmarks.bench_ai --builds 20 --positions 100000
+import argparse
+import random
+import time
+
+from game import ai, engine
+
+def bot_positions(count: int, rng: random.Random) -> list:
+    # positions with player2 (the bot) to move, from random play
+    positions = []
+    while len(positions) < count:
+        player1 = player2 = 0
+        while True:
+            free = [cell for cell in range(ai.CELLS) if not (player1 | player2) >> cell & 1]
+            player1 |= 1 << rng.choice(free)
+            if engine.outcome(player1, player2) != engine.IN_PROGRESS:
+                break
+            positions.append((player1, player2))
+            free = [cell for cell in range(ai.CELLS) if not (player1 | player2) >> cell & 1]
+            player2 |= 1 << rng.choice(free)
+            if engine.outcome(player1, player2) != engine.IN_PROGRESS:
+                break
+    return positions[:count]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--builds', type=int, default=20)
+    parser.add_argument('--positions', type=int, default=100000)
+    args = parser.parse_args()
+
+    timings = []
+    for _ in range(args.builds):
+        started = time.perf_counter()
+        solver = ai.Solver()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    print(f"build   : {len(solver.keys)} canonical positions, median {timings[len(timings) // 2] * 1000:.1f}ms")
+    print(f"memory  : {solver.memory() / 1024:.1f} KiB (keys + entries + symmetry tables)")
+
+    rng = random.Random(1)
+    positions = bot_positions(args.positions, rng)
+    for difficulty in ai.DIFFICULTIES:
+        started = time.perf_counter()
+        for player1, player2 in positions:
+            solver.choose_move(player1, player2, difficulty, rng)
+        elapsed = time.perf_counter() - started
+        print(f"{difficulty:<8}: {elapsed / len(positions) * 1e6:.2f}us per move")
+
+if __name__ == "__main__":
+    main()
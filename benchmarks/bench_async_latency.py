@@ -0,0 +1,76 @@
+# Move latency of the async service path as the number of concurrent games grows.
+# Uses DB_CONNECTION / REDIS_URL like the app; --fake-redis swaps in an in-process fakeredis.
+#
+#   DB_CONNECTION=sqlite:///./bench.db python -m benchmarks.bench_async_latency --fake-redis
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault("DB_CONNECTION", "sqlite:///./bench.db")
+
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from database import DB, AsyncDB
+from redis_database import AsyncRedisDB
+from game.model import CreateGameModel, UpdateGameModel
+from game.schema import GameSchema
+import game.service as gameService
+
+# player1 wins on the fifth move
+MOVES = ([0, 0], [1, 0], [0, 1], [1, 1], [0, 2])
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+def serialize_sqlite_writers():
+    # sqlite has a single writer; queue sessions on one connection instead of
+    # failing with "database is locked"
+    instance = AsyncDB.get_instance()
+    if instance.engine.dialect.name == "sqlite":
+        instance.engine = create_async_engine(instance.engine.url, poolclass=AsyncAdaptedQueuePool, pool_size=1, max_overflow=0, pool_timeout=3600)
+        instance.SessionLocal.configure(bind=instance.engine)
+
+async def play(redis_db, latencies):
+    async with AsyncDB.get_instance().SessionLocal() as db:
+        game = await gameService.create(CreateGameModel(player="player1"), db, redis_db)
+        await gameService.create(CreateGameModel(player="player2"), db, redis_db, game["id"])
+        for i, move in enumerate(MOVES):
+            start = time.perf_counter()
+            await gameService.update(UpdateGameModel(turn="player1" if i % 2 == 0 else "player2", move=move), game["id"], db, redis_db)
+            latencies.append(time.perf_counter() - start)
+
+async def run(scale, redis_db):
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(play(redis_db, latencies) for _ in range(scale)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(f"{scale:>6} games  {len(latencies) / elapsed:>8.0f} moves/s  "
+          f"p50 {percentile(latencies, 0.50) * 1000:7.2f}ms  p99 {percentile(latencies, 0.99) * 1000:7.2f}ms")
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scales', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--fake-redis', action='store_true')
+    args = parser.parse_args()
+
+    db = DB.get_instance()
+    GameSchema.__table__.drop(bind=db.engine, checkfirst=True)
+    db.Base.metadata.create_all(bind=db.engine)
+    serialize_sqlite_writers()
+
+    if args.fake_redis:
+        import fakeredis
+        redis_db = fakeredis.FakeAsyncRedis()
+    else:
+        redis_db = AsyncRedisDB.get_db()
+
+    for scale in args.scales:
+        await run(scale, redis_db)
+
+    await AsyncDB.close_db_connection()
+    await redis_db.aclose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
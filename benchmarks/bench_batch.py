@@ -0,0 +1,156 @@
+# A bot fleet playing many games at once, in process on fakeredis or a local
+# Redis with the flusher writing SQL. The same random games are played two
+# ways: a socket per game on /games/ws/{game_id}, each move sent and its
+# broadcast awaited, --concurrency games at a time, then POST /games/moves
+# carrying the next move of up to --batch-size games per request. Reports
+# moves/s and per request latency, then checks both left the same boards.
+#
+#   DB_CONNECTION=sqlite:///./bench.db python -m benchmarks.bench_batch --games 1000 --batch-size 250 --fake-redis
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+os.environ.setdefault("DB_CONNECTION", "sqlite:///./bench.db")
+
+import httpx
+from fastapi import FastAPI
+from database import DB, AsyncDB
+from redis_database import AsyncRedisDB
+from game.router import router, update_game
+from game.schema import GameSchema
+from game.flusher import GameFlusher
+import game.scripts as gameScripts
+import game.service as gameService
+from websocket_connection_manager import WSConnectionManager
+from benchmarks.bench_async_latency import serialize_sqlite_writers
+
+class QueueWebSocket:
+    # the bot's end of /games/ws/{game_id}, in memory
+    def __init__(self):
+        self.scope = {}
+        self.incoming = asyncio.Queue()
+        self.outgoing = asyncio.Queue()
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def receive_json(self):
+        return await self.incoming.get()
+
+    async def send_text(self, text):
+        self.outgoing.put_nowait(json.loads(text))
+
+    async def close(self, code=1000, reason=None):
+        pass
+
+def percentile(samples: list, fraction: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+def next_move(game: dict, rng: random.Random) -> list:
+    free = [(row, col) for row in range(3) for col in range(3) if not game["board"][row][col]]
+    return list(rng.choice(free))
+
+async def new_games(count: int, redis_db) -> list:
+    games = []
+    for game_id in await gameService.next_game_ids(count, redis_db):
+        games.append(await gameService.create_matched(game_id, "Alice", "Bob", redis_db))
+    return games
+
+async def by_socket(games: list, args, redis_db) -> tuple:
+    latencies = []
+    pending = iter(enumerate(games))
+    async def bot():
+        for index, game in pending:
+            rng = random.Random(args.seed + index)
+            websocket = QueueWebSocket()
+            handler = asyncio.get_running_loop().create_task(update_game(websocket, str(game["id"]), redis_db=redis_db))
+            while not game["is_over"]:
+                start = time.perf_counter()
+                websocket.incoming.put_nowait({"turn": game["turn"], "move": next_move(game, rng)})
+                while True:
+                    reply = await websocket.outgoing.get()
+                    if isinstance(reply, dict) and "board" in reply:
+                        break
+                latencies.append(time.perf_counter() - start)
+                game = reply
+            handler.cancel()
+    start = time.perf_counter()
+    await asyncio.gather(*(bot() for _ in range(args.concurrency)))
+    return latencies, time.perf_counter() - start
+
+async def by_batch(games: list, args, client: httpx.AsyncClient) -> tuple:
+    latencies = []
+    rngs = [random.Random(args.seed + index) for index in range(len(games))]
+    playing = list(range(len(games)))
+    start = time.perf_counter()
+    while playing:
+        for first in range(0, len(playing), args.batch_size):
+            chunk = playing[first:first + args.batch_size]
+            moves = [{"game_id": games[index]["id"], "turn": games[index]["turn"], "move": next_move(games[index], rngs[index])} for index in chunk]
+            sent = time.perf_counter()
+            response = await client.post("/games/moves", json={"moves": moves})
+            latencies.append(time.perf_counter() - sent)
+            for index, result in zip(chunk, response.json()["results"]):
+                assert result["status_code"] == 200, result
+                games[index] = result["game"]
+        playing = [index for index in playing if not games[index]["is_over"]]
+    return latencies, time.perf_counter() - start
+
+def report(name: str, latencies: list, moves: int, elapsed: float, unit: str):
+    latencies.sort()
+    print(f"{name:<22} {moves / elapsed:>9,.0f} moves/s  p50 {percentile(latencies, 0.5) * 1e3:>7.2f}ms  "
+          f"p99 {percentile(latencies, 0.99) * 1e3:>7.2f}ms per {unit}")
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--batch-size', type=int, default=250)
+    parser.add_argument('--fake-redis', action='store_true')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    db = DB.get_instance()
+    GameSchema.__table__.drop(bind=db.engine, checkfirst=True)
+    db.Base.metadata.create_all(bind=db.engine)
+    serialize_sqlite_writers()
+    if args.fake_redis:
+        import fakeredis
+        redis_db = fakeredis.FakeAsyncRedis()
+    else:
+        redis_db = AsyncRedisDB.get_db()
+        await redis_db.flushdb()
+    await gameScripts.load_all(redis_db)
+    flusher = GameFlusher.get_instance()
+    await flusher.start(redis_db)
+    WSConnectionManager.instance = WSConnectionManager(send_queue_size=1024)
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[AsyncRedisDB.get_db] = lambda: redis_db
+
+    socket_games = await new_games(args.games, redis_db)
+    latencies, elapsed = await by_socket(socket_games, args, redis_db)
+    socket_moves = len(latencies)
+    report("socket per game", latencies, socket_moves, elapsed, "move")
+
+    batch_games = await new_games(args.games, redis_db)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None) as client:
+        latencies, elapsed = await by_batch(batch_games, args, client)
+    report(f"batches of {args.batch_size}", latencies, socket_moves, elapsed, "request")
+    await flusher.stop()
+
+    # the same seeds must have left the same games in Redis
+    for socket_game, batch_game in zip(socket_games, batch_games):
+        expected = await gameService.get_game(socket_game["id"], redis_db)
+        actual = await gameService.get_game(batch_game["id"], redis_db)
+        assert expected["board"] == actual["board"] and expected["seq"] == actual["seq"], batch_game["id"]
+
+    await AsyncDB.close_db_connection()
+    DB.close_db_connection()
+    await redis_db.aclose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,119 @@
+# Move cost on k-in-a-row boards of several sizes. First the win check alone:
+# game.engine.wins_at, which only looks at the lines through the last move,
+# against rescanning every line of the board. Then the per-move latency of
+# the move script (game.service.apply_move and decoding the game) on Redis,
+# with the state size stored per game.
+#
+#   python -m benchmarks.bench_boards --games 200 --fake-redis
+import argparse
+import asyncio
+import random
+import time
+
+from redis_database import AsyncRedisDB
+from game import codec, engine
+import game.service as gameService
+
+BOARDS = ((3, 3), (9, 5), (15, 5), (19, 5))
+
+def rescan_wins(mask: int, size: int, win_length: int) -> bool:
+    # every run of win_length cells on the board
+    for row in range(size):
+        for col in range(size):
+            for d_row, d_col in engine.DIRECTIONS:
+                end_row, end_col = row + (win_length - 1) * d_row, col + (win_length - 1) * d_col
+                if not (0 <= end_row < size and 0 <= end_col < size):
+                    continue
+                if all(mask >> ((row + step * d_row) * size + col + step * d_col) & 1 for step in range(win_length)):
+                    return True
+    return False
+
+def random_games(size: int, count: int, rng: random.Random) -> list:
+    games = []
+    for _ in range(count):
+        cells = list(range(size * size))
+        rng.shuffle(cells)
+        games.append(cells)
+    return games
+
+def run_engine(games: list, size: int, win_length: int, incremental: bool) -> int:
+    moves = 0
+    for cells in games:
+        masks = [0, 0]
+        for index, cell in enumerate(cells):
+            player = index % 2
+            masks[player] |= 1 << cell
+            moves += 1
+            if incremental:
+                won = engine.wins_at(masks[player], size, win_length, cell // size, cell % size)
+            else:
+                won = rescan_wins(masks[player], size, win_length)
+            if won:
+                break
+    return moves
+
+def seed(game_id: int, size: int, win_length: int) -> dict:
+    return codec.encode_game({
+        "id": game_id, "board": [[''] * size for _ in range(size)], "board_size": size, "win_length": win_length,
+        "player1": "player1", "player2": "player2", "player1_symbol": "X", "player2_symbol": "O",
+        "turn": "player1", "status": "INIT", "is_over": False, "is_draw": False, "created_by": "player1",
+        "created_at": "2024-05-20 12:00:00", "mode": "PVP",
+    })
+
+async def run_script(redis_db, games: list, size: int, win_length: int, first_id: int) -> tuple:
+    latencies = []
+    state_bytes = 0
+    for offset, cells in enumerate(games):
+        game_id = first_id + offset
+        await redis_db.hset(f"GAME_{game_id}", mapping=seed(game_id, size, win_length))
+        for index, cell in enumerate(cells):
+            start = time.perf_counter()
+            result = await gameService.apply_move(game_id, ("player1", "player2")[index % 2], cell // size, cell % size, None, redis_db)
+            game = codec.decode_game(game_id, dict(zip(codec.HASH_FIELDS, result[1:])))
+            latencies.append(time.perf_counter() - start)
+            if game["is_over"]:
+                break
+        state_bytes = len(result[1])
+    return latencies, state_bytes
+
+def percentile(values: list, fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=200, help="games per board through the move script")
+    parser.add_argument('--engine-games', type=int, default=300, help="games per board for the win check alone")
+    parser.add_argument('--fake-redis', action='store_true')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print("win check per move")
+    for size, win_length in BOARDS:
+        games = random_games(size, args.engine_games, rng)
+        timings = {}
+        for name, incremental in (("rescan", False), ("incremental", True)):
+            start = time.perf_counter()
+            moves = run_engine(games, size, win_length, incremental)
+            timings[name] = (time.perf_counter() - start) / moves
+        print(f"  {size:>2}x{size:<2} k={win_length}: rescan {timings['rescan'] * 1e6:8.2f}us  "
+              f"incremental {timings['incremental'] * 1e6:6.2f}us  ({timings['rescan'] / timings['incremental']:.0f}x)")
+
+    if args.fake_redis:
+        import fakeredis
+        redis_db = fakeredis.FakeAsyncRedis()
+    else:
+        redis_db = AsyncRedisDB.get_db()
+    print("move script per move")
+    first_id = 10_000_000
+    for size, win_length in BOARDS:
+        latencies, state_bytes = await run_script(redis_db, random_games(size, args.games, rng), size, win_length, first_id)
+        first_id += args.games
+        latencies.sort()
+        print(f"  {size:>2}x{size:<2} k={win_length}: mean {sum(latencies) / len(latencies) * 1000:6.3f}ms  "
+              f"p50 {percentile(latencies, 0.5) * 1000:6.3f}ms  p99 {percentile(latencies, 0.99) * 1000:6.3f}ms  "
+              f"state {state_bytes} bytes")
+    await redis_db.aclose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+# Bytes per game and encode/decode cost of the compact game codec against the
+# JSON GameModel blob it replaced, over randomly played games.
+#
+#   python -m benchmarks.bench_codec --games 1000000
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from game import codec, engine
+from game.model import GameModel
+
+def random_game(rng, game_id):
+    player1, player2 = f"player{rng.randrange(10 ** 6)}", f"player{rng.randrange(10 ** 6)}"
+    player1_mask = player2_mask = 0
+    cells = rng.sample(range(9), rng.randrange(10))
+    for i, cell in enumerate(cells):
+        if i % 2 == 0:
+            player1_mask |= 1 << cell
+        else:
+            player2_mask |= 1 << cell
+    created = datetime(2024, 1, 1) + timedelta(seconds=rng.randrange(10 ** 7))
+    return {
+        "id": game_id, "board": engine.masks_to_board(player1_mask, player2_mask, "X", "O"),
+        "winner": None, "is_draw": False, "is_over": False,
+        "player1": player1, "player2": player2, "player1_symbol": "X", "player2_symbol": "O",
+        "move": [cells[-1] // 3, cells[-1] % 3] if cells else None,
+        "turn": player2 if len(cells) % 2 else player1, "status": "IN_PROGRESS" if cells else "INIT",
+        "created_by": player1, "updated_by": player1,
+        "created_at": created.__str__(), "updated_at": (created + timedelta(seconds=30)).__str__(),
+    }
+
+def payload_size(fields):
+    return sum(len(field) + len(value if isinstance(value, bytes) else value.encode()) for field, value in fields.items())
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    games = [random_game(rng, i) for i in range(args.games)]
+
+    start = time.perf_counter()
+    blobs = [json.dumps(game) for game in games]
+    json_encode = time.perf_counter() - start
+    start = time.perf_counter()
+    for blob in blobs:
+        GameModel.model_validate(json.loads(blob.replace("'", '"')))
+    json_decode = time.perf_counter() - start
+    json_bytes = sum(len("data") + len(blob) for blob in blobs)
+    del blobs
+
+    start = time.perf_counter()
+    mappings = [codec.encode_game(game) for game in games]
+    codec_encode = time.perf_counter() - start
+    start = time.perf_counter()
+    states = [codec.encode_state(game) for game in games]
+    state_encode = time.perf_counter() - start
+    raw = [{field.encode(): value if isinstance(value, bytes) else value.encode() for field, value in mapping.items()} for mapping in mappings]
+    start = time.perf_counter()
+    for i, fields in enumerate(raw):
+        codec.decode_game(i, fields)
+    codec_decode = time.perf_counter() - start
+    codec_bytes = sum(payload_size(mapping) for mapping in mappings)
+    hot_bytes = sum(len("state") + len(state) for state in states)
+
+    n = args.games
+    print(f"games: {n}")
+    print(f"json  : {json_bytes / n:6.1f} B/game  {json_bytes / 2 ** 20:8.1f} MiB  "
+          f"encode {json_encode / n * 1e6:5.2f}us  decode+validate {json_decode / n * 1e6:5.2f}us")
+    print(f"codec : {codec_bytes / n:6.1f} B/game  {codec_bytes / 2 ** 20:8.1f} MiB  "
+          f"encode {codec_encode / n * 1e6:5.2f}us  decode {codec_decode / n * 1e6:5.2f}us")
+    print(f"move  : {hot_bytes / n:6.1f} B written per move (state field)  encode {state_encode / n * 1e6:5.2f}us")
+
+if __name__ == "__main__":
+    main()
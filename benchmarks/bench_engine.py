@@ -0,0 +1,93 @@
+# Compares the bitboard outcome table in game.engine with the hand written
+# row/column/diagonal checks game.service.update used before it.
+#
+#   python -m benchmarks.bench_engine --games 2000000
+import argparse
+import random
+import time
+from game import engine
+
+def legacy_outcome(board, move, symbol):
+    isOver = False
+    if board[move[0]][0] == symbol and board[move[0]][1] == symbol and board[move[0]][2] == symbol:
+        isOver = True
+    if board[0][move[1]] == symbol and board[1][move[1]] == symbol and board[2][move[1]] == symbol:
+        isOver = True
+    if board[0][0] == symbol and board[1][1] == symbol and board[2][2] == symbol:
+        isOver = True
+    if board[0][2] == symbol and board[1][1] == symbol and board[2][0] == symbol:
+        isOver = True
+    if isOver:
+        return 'WIN'
+    if board[0][0] != '' and board[0][1] != '' and board[0][2] != '' and board[1][0] != '' and board[1][1] != '' and board[1][2] != '' and board[2][0] != '' and board[2][1] != '' and board[2][2] != '':
+        return 'DRAW'
+    return 'IN_PROGRESS'
+
+def random_sequences(count, seed):
+    rng = random.Random(seed)
+    cells = list(range(9))
+    sequences = []
+    for _ in range(count):
+        rng.shuffle(cells)
+        sequences.append(tuple(cells))
+    return sequences
+
+def run_legacy(sequences):
+    moves = 0
+    for sequence in sequences:
+        board = [['', '', ''], ['', '', ''], ['', '', '']]
+        symbol = 'X'
+        for cell in sequence:
+            move = (cell // 3, cell % 3)
+            board[move[0]][move[1]] = symbol
+            moves += 1
+            if legacy_outcome(board, move, symbol) != 'IN_PROGRESS':
+                break
+            symbol = 'O' if symbol == 'X' else 'X'
+    return moves
+
+def run_bitboard(sequences):
+    moves = 0
+    outcomes = engine.OUTCOMES
+    for sequence in sequences:
+        player1 = player2 = 0
+        first = True
+        for cell in sequence:
+            if first:
+                player1 |= 1 << cell
+            else:
+                player2 |= 1 << cell
+            moves += 1
+            if outcomes[(player1 << 9) | player2] != engine.IN_PROGRESS:
+                break
+            first = not first
+    return moves
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=2_000_000)
+    parser.add_argument('--chunk', type=int, default=200_000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    totals = {'legacy': [0, 0.0], 'bitboard': [0, 0.0]}
+    remaining = args.games
+    seed = args.seed
+    while remaining > 0:
+        sequences = random_sequences(min(args.chunk, remaining), seed)
+        for name, runner in (('legacy', run_legacy), ('bitboard', run_bitboard)):
+            start = time.perf_counter()
+            moves = runner(sequences)
+            totals[name][1] += time.perf_counter() - start
+            totals[name][0] += moves
+        remaining -= len(sequences)
+        seed += 1
+
+    assert totals['legacy'][0] == totals['bitboard'][0], "engines disagree on game length"
+    print(f"games: {args.games}  moves: {totals['legacy'][0]}")
+    for name, (moves, elapsed) in totals.items():
+        print(f"{name:>9}: {elapsed:.3f}s  {elapsed / moves * 1e9:.1f} ns/move  {moves / elapsed / 1e6:.2f}M moves/s")
+    print(f"speedup: {totals['legacy'][1] / totals['bitboard'][1]:.2f}x")
+
+if __name__ == "__main__":
+    main()
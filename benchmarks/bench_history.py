@@ -0,0 +1,115 @@
+# Game history reads on a large games table. Fills the table with N finished
+# games (10 million by default), then:
+#   - exports every row as NDJSON and CSV through game.history.export_games,
+#     reporting rows/s and how much the process RSS grew. The run fails if
+#     it grew past --max-rss-mib.
+#   - times a deep page of GET /games for one player, keyset (id < cursor)
+#     against the OFFSET query it replaces.
+#
+#   DB_CONNECTION=sqlite:///./history.db python -m benchmarks.bench_history --rows 10000000
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("DB_CONNECTION", "sqlite:///./history.db")
+
+from database import DB, AsyncDB
+from game.schema import GameSchema
+from game import history
+
+PLAYERS = 1000
+BOARD = [['X', 'O', 'X'], ['O', 'X', 'O'], ['X', '', '']]
+
+def rss_mib() -> float:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def fill(rows: int, batch_size: int, seed: int):
+    db = DB.get_instance()
+    GameSchema.__table__.drop(bind=db.engine, checkfirst=True)
+    db.Base.metadata.create_all(bind=db.engine)
+    rng = random.Random(seed)
+    started = datetime(2024, 1, 1)
+    table = GameSchema.__table__
+    for first in range(1, rows + 1, batch_size):
+        batch = []
+        for game_id in range(first, min(first + batch_size, rows + 1)):
+            player1, player2 = f"player{rng.randrange(PLAYERS)}", f"player{rng.randrange(PLAYERS)}"
+            batch.append({"id": game_id, "player1": player1, "player2": player2, "player1_symbol": "X", "player2_symbol": "O",
+                          "winner": player1, "is_draw": False, "is_over": True, "status": "FINISH", "turn": player1,
+                          "created_by": player1, "updated_by": player1, "created_at": str(started + timedelta(seconds=game_id)),
+                          "updated_at": str(started + timedelta(seconds=game_id + 60)), "board": BOARD, "mode": "PVP",
+                          "seq": 7, "board_size": 3, "win_length": 3})
+        with db.engine.begin() as connection:
+            connection.execute(table.insert(), batch)
+        if first // batch_size % 100 == 0:
+            print(f"  {min(first + batch_size - 1, rows)} rows", file=sys.stderr)
+
+async def export(format: str, batch_size: int) -> tuple:
+    rows = size = 0
+    peak = rss_mib()
+    start = time.perf_counter()
+    async for chunk in history.export_games(format, batch_size=batch_size):
+        size += len(chunk)
+        rows += chunk.count(b"\n")
+        peak = max(peak, rss_mib())
+    # the CSV header is not a game
+    return rows - (format == "csv"), size, peak, time.perf_counter() - start
+
+async def page_latency(player: str, depth: int, limit: int) -> tuple:
+    table = GameSchema.__table__
+    query = history.games_query(player=player).order_by(table.c.id.desc())
+    async with AsyncDB.get_instance().SessionLocal() as db:
+        start = time.perf_counter()
+        rows = (await db.execute(query.offset(depth).limit(limit))).mappings().all()
+        offset_elapsed = time.perf_counter() - start
+        assert rows, "--depth is past the last game of the player"
+        cursor = rows[0]["id"] + 1
+        start = time.perf_counter()
+        page = await history.list_games(db, cursor, limit, player=player)
+        keyset_elapsed = time.perf_counter() - start
+    assert [game["id"] for game in page["games"]] == [row["id"] for row in rows]
+    return offset_elapsed, keyset_elapsed
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--skip-fill', action='store_true', help="reuse the table of a previous run")
+    parser.add_argument('--fill-batch', type=int, default=10_000)
+    parser.add_argument('--export-batch', type=int, default=1000)
+    parser.add_argument('--depth', type=int, default=1000, help="rows of the player skipped before the timed page")
+    parser.add_argument('--max-rss-mib', type=float, default=256)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if not args.skip_fill:
+        start = time.perf_counter()
+        fill(args.rows, args.fill_batch, args.seed)
+        print(f"filled {args.rows} rows in {time.perf_counter() - start:.1f}s")
+
+    failed = False
+    for format in ("ndjson", "csv"):
+        before = rss_mib()
+        rows, size, peak, elapsed = await export(format, args.export_batch)
+        grown = peak - before
+        failed |= grown > args.max_rss_mib
+        print(f"{format:>6}: {rows} rows  {size / 2 ** 20:.0f} MiB  {elapsed:.1f}s  {rows / elapsed:,.0f} rows/s  "
+              f"rss grew {grown:.1f} MiB (limit {args.max_rss_mib:.0f})")
+
+    offset_elapsed, keyset_elapsed = await page_latency("player1", args.depth, 50)
+    print(f"page after {args.depth} games of one player: offset {offset_elapsed * 1000:.2f}ms  keyset {keyset_elapsed * 1000:.2f}ms")
+
+    await AsyncDB.close_db_connection()
+    DB.close_db_connection()
+    if failed:
+        sys.exit("export memory grew past --max-rss-mib")
+
+if __name__ == "__main__":
+    asyncio.run(main())
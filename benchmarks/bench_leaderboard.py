@@ -0,0 +1,108 @@
+# Player stats and leaderboard reads from the Redis counters (game.stats)
+# against the SQL aggregate they replace, over a games table of N finished
+# games between P players.
+#
+#   DB_CONNECTION=sqlite:///./bench.db python -m benchmarks.bench_leaderboard --games 10000000 --players 100000
+import argparse
+import asyncio
+import os
+import random
+import time
+from collections import Counter
+
+os.environ.setdefault("DB_CONNECTION", "sqlite:///./bench.db")
+
+from sqlalchemy import text
+from database import DB
+from redis_database import AsyncRedisDB
+from game.schema import GameSchema
+from game import stats
+
+PLAYER_STATS_SQL = text("""
+    SELECT sum(winner = :name), sum(is_draw = 0 AND winner != :name), sum(is_draw = 1), count(*)
+    FROM games WHERE player1 = :name OR player2 = :name
+""")
+LEADERBOARD_SQL = text("""
+    SELECT player, sum(won) AS wins FROM (
+        SELECT player1 AS player, winner = player1 AS won FROM games
+        UNION ALL SELECT player2, winner = player2 FROM games
+    ) GROUP BY player ORDER BY wins DESC LIMIT :limit OFFSET :offset
+""")
+
+def seed_sql(games: int, players: int, rng: random.Random) -> dict:
+    # returns the counters the Redis side is loaded with
+    counters = {field: Counter() for field in stats.STAT_FIELDS}
+    db = DB.get_instance()
+    GameSchema.__table__.drop(bind=db.engine, checkfirst=True)
+    db.Base.metadata.create_all(bind=db.engine)
+    insert = GameSchema.__table__.insert()
+    with db.engine.begin() as connection:
+        for start in range(0, games, 50000):
+            rows = []
+            for game_id in range(start + 1, min(games, start + 50000) + 1):
+                player1, player2 = f"p{rng.randrange(players)}", f"p{rng.randrange(players)}"
+                outcome = rng.random()
+                winner = player1 if outcome < 0.45 else player2 if outcome < 0.9 else None
+                rows.append({"id": game_id, "player1": player1, "player2": player2, "winner": winner,
+                             "is_draw": winner is None, "is_over": True, "status": "FINISH",
+                             "created_by": player1, "created_at": "2024-05-20 12:00:00"})
+                for player in (player1, player2):
+                    counters["games"][player] += 1
+                    field = "draws" if winner is None else "wins" if winner == player else "losses"
+                    counters[field][player] += 1
+            connection.execute(insert, rows)
+    return counters
+
+async def seed_redis(counters: dict, redis_db):
+    async with redis_db.pipeline(transaction=False) as pipe:
+        for name, games in counters["games"].items():
+            pipe.hset(stats.PLAYER_STATS_PREFIX + name, mapping={field: counters[field][name] for field in stats.STAT_FIELDS})
+            pipe.zadd(stats.LEADERBOARD, {name: counters["wins"][name]})
+        await pipe.execute()
+
+def timed(function, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - started) / repeat
+
+async def timed_async(function, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await function()
+    return (time.perf_counter() - started) / repeat
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=10000000)
+    parser.add_argument('--players', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--fake-redis', action='store_true')
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    started = time.perf_counter()
+    counters = seed_sql(args.games, args.players, rng)
+    print(f"seeded   : {args.games:,} games, {len(counters['games']):,} players in {time.perf_counter() - started:.0f}s")
+
+    if args.fake_redis:
+        import fakeredis
+        redis_db = fakeredis.FakeAsyncRedis()
+    else:
+        redis_db = AsyncRedisDB.get_db()
+        await redis_db.delete(stats.LEADERBOARD)
+    await seed_redis(counters, redis_db)
+
+    name = "p1"
+    with DB.get_instance().engine.connect() as connection:
+        sql_player = timed(lambda: connection.execute(PLAYER_STATS_SQL, {"name": name}).one(), args.repeat)
+        sql_board = timed(lambda: connection.execute(LEADERBOARD_SQL, {"limit": 20, "offset": 1000}).all(), 1)
+    redis_player = await timed_async(lambda: stats.get_player_stats(name, redis_db), args.repeat * 100)
+    redis_board = await timed_async(lambda: stats.get_leaderboard(1000, 20, redis_db), args.repeat * 100)
+
+    print(f"player   : sql {sql_player * 1000:10.2f}ms   redis {redis_player * 1000:.3f}ms")
+    print(f"page     : sql {sql_board * 1000:10.2f}ms   redis {redis_board * 1000:.3f}ms (20 players at offset 1000)")
+    await redis_db.aclose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+# Soak test of the game lifecycle: games are matched, played to the end (or
+# abandoned part way) and reaped, while Redis keys and memory are sampled.
+# With the reaper both should level off instead of growing with every game.
+#
+#   DB_CONNECTION=sqlite:///./bench.db python -m benchmarks.bench_lifecycle --games 1000000 --abandon 0.2
+import argparse
+import asyncio
+import os
+import random
+import time
+
+os.environ.setdefault("DB_CONNECTION", "sqlite:///./bench.db")
+
+from database import DB, AsyncDB
+from redis_database import AsyncRedisDB
+from game.model import UpdateGameModel
+from game.schema import GameSchema
+from game.flusher import GameFlusher
+from game.lifecycle import GameReaper, GAME_EXPIRY
+import game.scripts as gameScripts
+import game.service as gameService
+from benchmarks.bench_async_latency import serialize_sqlite_writers
+
+# nine moves, ends in a draw
+MOVES = ([0, 0], [0, 1], [0, 2], [1, 1], [1, 0], [1, 2], [2, 1], [2, 0], [2, 2])
+
+async def play(game_id: int, abandon: bool, redis_db, rng: random.Random):
+    game = await gameService.create_matched(game_id, f"a{game_id}", f"b{game_id}", redis_db)
+    players = (game["player1"], game["player2"])
+    for i, move in enumerate(MOVES[:rng.randrange(1, 8)] if abandon else MOVES):
+        await gameService.update(UpdateGameModel(turn=players[i % 2], move=move), game_id, None, redis_db)
+
+async def used_memory(redis_db) -> int:
+    try:
+        return (await redis_db.info("memory"))["used_memory"]
+    except Exception:
+        return 0
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=200000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--abandon', type=float, default=0.2, help="share of games left unfinished")
+    parser.add_argument('--idle-ttl', type=float, default=2.0)
+    parser.add_argument('--finished-ttl', type=float, default=0.5)
+    parser.add_argument('--fake-redis', action='store_true')
+    args = parser.parse_args()
+
+    db = DB.get_instance()
+    GameSchema.__table__.drop(bind=db.engine, checkfirst=True)
+    db.Base.metadata.create_all(bind=db.engine)
+    serialize_sqlite_writers()
+
+    if args.fake_redis:
+        import fakeredis
+        redis_db = fakeredis.FakeAsyncRedis()
+    else:
+        redis_db = AsyncRedisDB.get_db()
+        await redis_db.flushdb()
+    await gameScripts.load_all(redis_db)
+
+    flusher = GameFlusher.get_instance()
+    await flusher.start(redis_db)
+    reaper = GameReaper.instance = GameReaper(args.idle_ttl, args.finished_ttl, interval=0.25)
+    await reaper.start(redis_db)
+
+    samples = []
+    async def sample():
+        while True:
+            samples.append((await redis_db.dbsize(), await redis_db.zcard(GAME_EXPIRY), await used_memory(redis_db)))
+            await asyncio.sleep(1)
+    sampler = asyncio.create_task(sample())
+
+    rng = random.Random(1)
+    limit = asyncio.Semaphore(args.concurrency)
+    async def game(game_id: int):
+        async with limit:
+            await play(game_id, rng.random() < args.abandon, redis_db, rng)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(game(game_id) for game_id in range(1, args.games + 1)))
+    elapsed = time.perf_counter() - started
+    sampler.cancel()
+
+    print(f"games    : {args.games} in {elapsed:.1f}s ({args.games / elapsed:,.0f}/s), {reaper.reaped_games} reaped so far")
+    print("second   keys  scheduled  used_memory")
+    step = max(1, len(samples) // 20)
+    for second, (keys, scheduled, memory) in list(enumerate(samples))[::step]:
+        print(f"{second:>6} {keys:>6} {scheduled:>10} {memory / 1024 / 1024:>10.1f}M")
+
+    await reaper.stop()
+    await flusher.stop()
+    await AsyncDB.close_db_connection()
+    await redis_db.aclose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,60 @@
+# Pairings per second through the Redis matchmaking queue, with several
+# matchmaker workers (one pub/sub listener each) sharing one Redis.
+#
+#   python -m benchmarks.bench_matchmaking --players 20000 --workers 4
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault("DB_CONNECTION", "sqlite:///./bench.db")
+
+from redis_database import AsyncRedisDB
+from game.matchmaking import Matchmaker, QUEUE
+from game.flusher import DIRTY_GAMES
+import game.scripts as gameScripts
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--players', type=int, default=20000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=1000)
+    parser.add_argument('--fake-redis', action='store_true')
+    args = parser.parse_args()
+
+    if args.fake_redis:
+        import fakeredis
+        redis_db = fakeredis.FakeAsyncRedis()
+    else:
+        redis_db = AsyncRedisDB.get_db()
+        await redis_db.delete(QUEUE, DIRTY_GAMES)
+    await gameScripts.load_all(redis_db)
+
+    workers = [Matchmaker(timeout=60) for _ in range(args.workers)]
+    for worker in workers:
+        await worker.start(redis_db)
+
+    latencies = []
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def player(index: int):
+        async with limit:
+            started = time.perf_counter()
+            await workers[index % len(workers)].matchmake(f"player{index}", redis_db)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(player(index) for index in range(args.players)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    pairings = sum(worker.pairings for worker in workers)
+    print(f"pairings : {pairings} in {elapsed:.2f}s ({pairings / elapsed:,.0f}/s, {args.workers} workers)")
+    print(f"wait     : p50 {latencies[len(latencies) // 2] * 1000:.1f}ms  p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms")
+
+    for worker in workers:
+        await worker.stop()
+    await redis_db.aclose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
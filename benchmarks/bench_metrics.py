@@ -0,0 +1,30 @@
+# Cost of a stage timer around an empty block, with metrics on and off.
+#
+#   python -m benchmarks.bench_metrics --iterations 1000000
+import argparse
+import time
+
+from metrics import Metrics
+
+def per_call(metrics: Metrics, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        with metrics.time("update", "apply_move"):
+            pass
+    return (time.perf_counter() - started) / iterations
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=1000000)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    for _ in range(args.iterations):
+        pass
+    baseline = (time.perf_counter() - started) / args.iterations
+    for enabled in (True, False):
+        cost = per_call(Metrics(enabled), args.iterations) - baseline
+        print(f"{'enabled' if enabled else 'disabled':<9}: {cost * 1e9:.0f}ns per timed stage")
+
+if __name__ == "__main__":
+    main()
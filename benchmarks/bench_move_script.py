@@ -0,0 +1,96 @@
+# Per-move latency of the single round trip Lua move (game.service.update)
+# against the previous path: SQL existence check, hexists, hget, Python
+# validation, SQL commit and hset.
+#
+#   DB_CONNECTION=sqlite:///./bench.db python -m benchmarks.bench_move_script --games 500
+import argparse
+import asyncio
+import json
+import os
+import time
+
+os.environ.setdefault("DB_CONNECTION", "sqlite:///./bench.db")
+
+from database import DB, AsyncDB
+from redis_database import AsyncRedisDB
+from game.model import CreateGameModel, GameModel, UpdateGameModel
+from game.schema import GameSchema
+from game import engine
+from game.flusher import GameFlusher
+import game.service as gameService
+
+# player1 wins on the fifth move
+MOVES = ([0, 0], [1, 0], [0, 1], [1, 1], [0, 2])
+
+async def legacy_update(data, game_id, db, redis_db):
+    game_record = await db.get(GameSchema, int(game_id))
+    assert game_record is not None
+    assert await redis_db.hexists(f"GAME_{game_id}", "data")
+    game = GameModel.model_validate(json.loads(await redis_db.hget(f"GAME_{game_id}", "data")))
+    assert game.turn == data.turn and not game.is_over
+    board = game.board
+    assert board[data.move[0]][data.move[1]] == ''
+    board[data.move[0]][data.move[1]] = game.player1_symbol if data.turn == game.player1 else game.player2_symbol
+    outcome = engine.outcome(*engine.board_to_masks(board, game.player1_symbol, game.player2_symbol))
+    if outcome == engine.IN_PROGRESS:
+        game.status = 'IN_PROGRESS'
+        game.turn = game.player2 if data.turn == game.player1 else game.player1
+    else:
+        game.status = 'FINISH'
+        game.is_over = True
+    game.move = data.move
+    for key in GameSchema.__table__.columns.keys():
+        if hasattr(game, key):
+            setattr(game_record, key, getattr(game, key))
+    await db.commit()
+    await redis_db.hset(f"GAME_{game_id}", "data", json.dumps(game.model_dump()))
+    return game.model_dump()
+
+async def play(update, db, redis_db, latencies):
+    game = await gameService.create(CreateGameModel(player="player1"), db, redis_db)
+    await gameService.create(CreateGameModel(player="player2"), db, redis_db, game["id"])
+    if update is legacy_update:
+        # the previous path kept the whole game as one JSON blob
+        game_state = await gameService.get_game(game["id"], redis_db)
+        await redis_db.delete(f"GAME_{game['id']}")
+        await redis_db.hset(f"GAME_{game['id']}", "data", json.dumps(game_state))
+    for i, move in enumerate(MOVES):
+        start = time.perf_counter()
+        await update(UpdateGameModel(turn="player1" if i % 2 == 0 else "player2", move=move), game["id"], db, redis_db)
+        latencies.append(time.perf_counter() - start)
+
+def report(name, latencies):
+    latencies.sort()
+    mean = sum(latencies) / len(latencies)
+    print(f"{name:>7}: mean {mean * 1000:6.3f}ms  p50 {latencies[len(latencies) // 2] * 1000:6.3f}ms  "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:6.3f}ms")
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=500)
+    parser.add_argument('--fake-redis', action='store_true')
+    args = parser.parse_args()
+
+    db = DB.get_instance()
+    GameSchema.__table__.drop(bind=db.engine, checkfirst=True)
+    db.Base.metadata.create_all(bind=db.engine)
+
+    if args.fake_redis:
+        import fakeredis
+        redis_db = fakeredis.FakeAsyncRedis()
+    else:
+        redis_db = AsyncRedisDB.get_db()
+
+    for name, update in (("legacy", legacy_update), ("script", gameService.update)):
+        latencies = []
+        async with AsyncDB.get_instance().SessionLocal() as session:
+            for _ in range(args.games):
+                await play(update, session, redis_db, latencies)
+        report(name, latencies)
+
+    await GameFlusher.get_instance().flush(redis_db)
+    await AsyncDB.close_db_connection()
+    await redis_db.aclose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
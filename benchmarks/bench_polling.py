@@ -0,0 +1,109 @@
+# Clients polling GET /games/{game_id}, in process through the ASGI app on
+# fakeredis or a local Redis. Every game has --pollers clients polling it
+# --polls times, and a move is played on each game every --move-every polls,
+# so most polls find the game unchanged. Runs the same load twice: plain
+# GETs, then GETs that send back the last ETag in If-None-Match. Reports
+# requests/s, 304s and the bytes sent (status line, headers and body).
+#
+#   DB_CONNECTION=sqlite:///./bench.db python -m benchmarks.bench_polling --games 100 --pollers 4 --polls 50 --fake-redis
+import argparse
+import asyncio
+import os
+import random
+import time
+
+os.environ.setdefault("DB_CONNECTION", "sqlite:///./bench.db")
+
+import httpx
+from fastapi import FastAPI
+from database import DB, AsyncDB
+from redis_database import AsyncRedisDB
+from game.router import router
+from game.model import UpdateGameModel
+from game.schema import GameSchema
+from game.flusher import GameFlusher
+import game.scripts as gameScripts
+import game.service as gameService
+from benchmarks.bench_async_latency import serialize_sqlite_writers
+
+def response_bytes(response: httpx.Response) -> int:
+    head = len(f"HTTP/1.1 {response.status_code} {response.reason_phrase}\r\n")
+    head += sum(len(name) + len(value) + 4 for name, value in response.headers.raw)
+    return head + 2 + len(response.content)
+
+async def play_move(game_id: int, rng: random.Random, redis_db):
+    game = await gameService.get_game(game_id, redis_db)
+    if game["is_over"]:
+        return
+    free = [(row, col) for row in range(3) for col in range(3) if not game["board"][row][col]]
+    await gameService.update(UpdateGameModel(turn=game["turn"], move=list(rng.choice(free))), str(game_id), None, redis_db)
+
+async def run(name: str, app: FastAPI, game_ids: list, args, revalidate: bool, redis_db) -> None:
+    rng = random.Random(args.seed)
+    sent, not_modified, requests = 0, 0, 0
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        async def poller(game_id: int):
+            nonlocal sent, not_modified, requests
+            etag = None
+            for _ in range(args.polls):
+                headers = {"If-None-Match": etag} if revalidate and etag else {}
+                response = await client.get(f"/games/{game_id}", headers=headers)
+                etag = response.headers["etag"]
+                sent += response_bytes(response)
+                not_modified += response.status_code == 304
+                requests += 1
+                await asyncio.sleep(0)
+
+        async def mover():
+            for poll in range(args.polls):
+                if poll and poll % args.move_every == 0:
+                    for game_id in game_ids:
+                        await play_move(game_id, rng, redis_db)
+                await asyncio.sleep(0)
+
+        start = time.perf_counter()
+        await asyncio.gather(mover(), *(poller(game_id) for game_id in game_ids for _ in range(args.pollers)))
+        elapsed = time.perf_counter() - start
+    print(f"{name:<14} {requests / elapsed:>8,.0f} req/s  {not_modified:>6} x 304  "
+          f"{sent / 1024:>9,.1f} KiB sent  ({sent / requests:,.0f} bytes/request)")
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--pollers', type=int, default=4)
+    parser.add_argument('--polls', type=int, default=50)
+    parser.add_argument('--move-every', type=int, default=5)
+    parser.add_argument('--fake-redis', action='store_true')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    db = DB.get_instance()
+    GameSchema.__table__.drop(bind=db.engine, checkfirst=True)
+    db.Base.metadata.create_all(bind=db.engine)
+    serialize_sqlite_writers()
+    if args.fake_redis:
+        import fakeredis
+        redis_db = fakeredis.FakeAsyncRedis()
+    else:
+        redis_db = AsyncRedisDB.get_db()
+        await redis_db.flushdb()
+    await gameScripts.load_all(redis_db)
+    flusher = GameFlusher.get_instance()
+    await flusher.start(redis_db)
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[AsyncRedisDB.get_db] = lambda: redis_db
+
+    for name, revalidate in (("plain GET", False), ("If-None-Match", True)):
+        game_ids = list(await gameService.next_game_ids(args.games, redis_db))
+        for game_id in game_ids:
+            await gameService.create_matched(game_id, f"a{game_id}", f"b{game_id}", redis_db)
+        await run(name, app, game_ids, args, revalidate, redis_db)
+    await flusher.stop()
+
+    await AsyncDB.close_db_connection()
+    DB.close_db_connection()
+    await redis_db.aclose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+# Self-play throughput on one core. Plays the same kind of games two ways:
+# a plain loop over game.engine.play with random.choice / ai.choose_move per
+# move, and game.simulate.simulate, which moves every game at once on NumPy
+# arrays. Then the vectorized run through the process pool for each worker
+# count, to see how it scales past one core.
+#
+#   python -m benchmarks.bench_simulate --games 1000000 --workers 1 2 4
+import argparse
+import random
+import time
+
+from game import ai, engine, simulate
+
+def scalar(games: int, player1: str, player2: str, seed: int) -> int:
+    rng = random.Random(seed)
+    solver = ai.Solver.get_instance()
+    policies = (player1, player2)
+    wins = 0
+    for _ in range(games):
+        masks = [0, 0]
+        result = engine.IN_PROGRESS
+        ply = 0
+        while result == engine.IN_PROGRESS:
+            policy = policies[ply % 2]
+            if policy == "RANDOM":
+                taken = masks[0] | masks[1]
+                cell = rng.choice([cell for cell in range(simulate.CELLS) if not taken >> cell & 1])
+            else:
+                row, col = solver.choose_move(masks[0], masks[1], policy, rng)
+                cell = engine.cell_index(row, col)
+            masks[0], masks[1], result = engine.play(masks[0], masks[1], cell)
+            ply += 1
+        wins += result == engine.PLAYER1_WIN
+    return wins
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=1_000_000)
+    parser.add_argument('--scalar-games', type=int, default=50_000)
+    parser.add_argument('--player1', choices=simulate.POLICIES, default="RANDOM")
+    parser.add_argument('--player2', choices=simulate.POLICIES, default="RANDOM")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    scalar(args.scalar_games, args.player1, args.player2, args.seed)
+    scalar_rate = args.scalar_games / (time.perf_counter() - start)
+    print(f"scalar loop:  {scalar_rate:>12,.0f} games/s")
+
+    simulate.score_table()  # built once per process, keep it out of the timings
+    start = time.perf_counter()
+    simulate.simulate(args.games, args.player1, args.player2, args.seed)
+    vector_rate = args.games / (time.perf_counter() - start)
+    print(f"vectorized:   {vector_rate:>12,.0f} games/s  ({vector_rate / scalar_rate:.0f}x)")
+
+    for workers in args.workers:
+        start = time.perf_counter()
+        simulate.run(args.games, args.player1, args.player2, workers, seed=args.seed)
+        rate = args.games / (time.perf_counter() - start)
+        print(f"{workers:>2} workers:   {rate:>12,.0f} games/s  {rate / workers:,.0f} per core")
+
+if __name__ == "__main__":
+    main()
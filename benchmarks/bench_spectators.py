@@ -0,0 +1,97 @@
+# Fan-out of one game's moves to N spectators on one worker, in process with
+# sockets that only record what they are sent. Reports the cost of a publish,
+# how long players wait for their own frame and how long until every
+# spectator has the newest frame, next to encoding the frame per socket.
+#
+#   python -m benchmarks.bench_spectators --spectators 10000 --moves 200
+import argparse
+import asyncio
+import json
+import time
+
+from websocket_connection_manager import WSConnectionManager
+
+GAME = {
+    "id": 1, "board": [['X', '', 'O'], ['', 'X', ''], ['', '', '']], "winner": None, "is_draw": False,
+    "is_over": False, "player1": "player1", "player2": "player2", "player2_symbol": "O", "player1_symbol": "X",
+    "move": [1, 1], "turn": "player2", "status": "IN_PROGRESS", "created_by": "player1", "updated_by": "player1",
+    "created_at": "2024-05-20 12:00:00", "updated_at": "2024-05-20 12:00:01", "mode": "PVP", "difficulty": None,
+}
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.frames = 0
+        self.last = None
+        self.seen = None
+        self.sent_at = 0.0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.frames += 1
+        self.last = text
+        self.sent_at = time.perf_counter()
+        if self.seen is not None:
+            self.seen(self)
+
+async def run(spectators: int, moves: int) -> dict:
+    manager = WSConnectionManager()
+    players = [RecordingWebSocket(), RecordingWebSocket()]
+    for player in players:
+        await manager.connect(player, "1")
+    watchers = [RecordingWebSocket() for _ in range(spectators)]
+    for watcher in watchers:
+        await manager.spectate(watcher, "1", lambda: asyncio.sleep(0, "{}"))
+
+    publish, player_wait, spectator_wait = [], [], []
+    for seq in range(1, moves + 1):
+        game = {**GAME, "seq": seq}
+        delta = {"type": "move", "seq": seq, "board": "X.O.X....", "move": [1, 1], "turn": "player2"}
+        arrived = asyncio.get_running_loop().create_future()
+        remaining = [spectators]
+        def seen(watcher):
+            remaining[0] -= 1
+            if remaining[0] == 0 and not arrived.done():
+                arrived.set_result(None)
+        for watcher in watchers:
+            watcher.seen = seen
+        player_frames = players[1].frames
+
+        started = time.perf_counter()
+        manager.deliver("1", game, (), delta)
+        publish.append(time.perf_counter() - started)
+        if spectators:
+            await arrived
+        spectator_wait.append(time.perf_counter() - started)
+        while players[1].frames == player_frames:
+            await asyncio.sleep(0)
+        player_wait.append(players[1].sent_at - started)
+
+    started = time.perf_counter()
+    for _ in range(spectators):
+        json.dumps(GAME)
+    per_socket = time.perf_counter() - started
+
+    for watcher in watchers:
+        manager.unspectate(watcher, "1")
+    for player in players:
+        manager.disconnect(player, "1")
+    average = lambda values: sum(values) / len(values) * 1000
+    return {"publish_ms": average(publish), "player_ms": average(player_wait),
+            "all_spectators_ms": average(spectator_wait), "encode_per_socket_ms": per_socket * 1000}
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--spectators', type=int, default=10000)
+    parser.add_argument('--moves', type=int, default=200)
+    args = parser.parse_args()
+
+    for spectators in (0, args.spectators):
+        report = await run(spectators, args.moves)
+        print(f"{spectators:>6} spectators: publish {report['publish_ms']:.3f}ms  players after {report['player_ms']:.3f}ms  "
+              f"all spectators after {report['all_spectators_ms']:.2f}ms  "
+              f"(encoding per socket would cost {report['encode_per_socket_ms']:.2f}ms)")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,140 @@
+# A knockout (or round robin) tournament of N bot players on one worker,
+# 1024 by default. Every bot follows the tournament channel and its game's
+# channel with a socket that only records frames. Bots move on random free
+# cells through game.service.update and broadcast like /games/ws/{game_id},
+# with the flusher writing games to SQL behind them. Reports the total wall
+# time, moves/s and how long the scheduler took to create each round, next
+# to creating the first round's games one at a time.
+#
+#   DB_CONNECTION=sqlite:///./bench.db python -m benchmarks.bench_tournament --players 1024 --fake-redis
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+os.environ.setdefault("DB_CONNECTION", "sqlite:///./bench.db")
+
+from database import DB, AsyncDB
+from redis_database import AsyncRedisDB
+from game.model import CreateTournamentModel, UpdateGameModel
+from game.schema import GameSchema
+from game.flusher import GameFlusher
+from game import tournament
+import game.scripts as gameScripts
+import game.service as gameService
+from websocket_connection_manager import WSConnectionManager
+from benchmarks.bench_async_latency import serialize_sqlite_writers
+
+class BotSocket:
+    def __init__(self):
+        self.frames = 0
+        self.rounds = asyncio.Queue()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.frames += 1
+        if text.startswith(('{"type":"round"', '{"type":"replay"', '{"type":"finish"')):
+            self.rounds.put_nowait(json.loads(text))
+
+async def play(match: dict, size: int, sockets: dict, manager: WSConnectionManager, redis_db, rng: random.Random) -> int:
+    game_id = str(match["game_id"])
+    for player in (match["player1"], match["player2"]):
+        await manager.connect(sockets[player], game_id)
+    game = {"turn": match["player1"], "is_over": False, "board": [[''] * size for _ in range(size)]}
+    moves = 0
+    while not game["is_over"]:
+        free = [(row, col) for row in range(size) for col in range(size) if not game["board"][row][col]]
+        game = await gameService.update(UpdateGameModel(turn=game["turn"], move=list(rng.choice(free))), game_id, None, redis_db)
+        await manager.broadcast(game, game_id, spectator_message=gameService.spectator_delta(game))
+        moves += 1
+    for player in (match["player1"], match["player2"]):
+        manager.disconnect(sockets[player], game_id)
+    return moves
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--players', type=int, default=1024)
+    parser.add_argument('--format', choices=("SINGLE_ELIMINATION", "ROUND_ROBIN"), default="SINGLE_ELIMINATION")
+    parser.add_argument('--board-size', type=int, default=3)
+    parser.add_argument('--fake-redis', action='store_true')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    db = DB.get_instance()
+    GameSchema.__table__.drop(bind=db.engine, checkfirst=True)
+    db.Base.metadata.create_all(bind=db.engine)
+    serialize_sqlite_writers()
+    if args.fake_redis:
+        import fakeredis
+        redis_db = fakeredis.FakeAsyncRedis()
+    else:
+        redis_db = AsyncRedisDB.get_db()
+        await redis_db.flushdb()
+    await gameScripts.load_all(redis_db)
+    flusher = GameFlusher.get_instance()
+    await flusher.start(redis_db)
+    # a round's results arrive in one burst, the queue must hold them
+    manager = WSConnectionManager.instance = WSConnectionManager(send_queue_size=4 * args.players)
+
+    # time spent creating each round, the last result of a round waits for it
+    round_times = []
+    start_round = tournament.start_round
+    async def timed_start_round(*round_args):
+        start = time.perf_counter()
+        await start_round(*round_args)
+        round_times.append(time.perf_counter() - start)
+    tournament.start_round = timed_start_round
+
+    rng = random.Random(args.seed)
+    players = [f"bot{index}" for index in range(args.players)]
+    sockets = {player: BotSocket() for player in players}
+    started = time.perf_counter()
+    created = await tournament.create_tournament(CreateTournamentModel(players=players, format=args.format, board_size=args.board_size), redis_db)
+    for socket in sockets.values():
+        await manager.connect(socket, tournament.channel_id(created["id"]))
+    follower = sockets[players[0]]
+
+    matches, moves, games = created["matches"], 0, 0
+    while True:
+        played = await asyncio.gather(*(play(match, args.board_size, sockets, manager, redis_db, rng) for match in matches if match["game_id"] is not None))
+        moves += sum(played)
+        games += len(played)
+        frame = await follower.rounds.get()
+        if frame["type"] == "finish":
+            break
+        if frame["type"] == "replay":
+            # drawn knockout games are played again before the next round
+            matches = [frame]
+            while not follower.rounds.empty():
+                matches.append(follower.rounds.get_nowait())
+        else:
+            matches = frame["matches"]
+    elapsed = time.perf_counter() - started
+    await flusher.stop()
+
+    print(f"{args.players} player {args.format.lower()}: {games} games, {moves} moves in {elapsed:.2f}s wall time "
+          f"({moves / elapsed:,.0f} moves/s), winner {frame['winner']}")
+    print(f"rounds created in mean {sum(round_times) / len(round_times) * 1000:.1f}ms, max {max(round_times) * 1000:.1f}ms "
+          f"({len(round_times)} rounds)")
+    print(f"{sum(socket.frames for socket in sockets.values())} frames to {len(sockets)} bots, "
+          f"max queue depth {manager.stats()['max_queue_depth']}, dropped {manager.stats()['dropped_frames']}")
+    print(f"flusher wrote {flusher.flushed_games} games in {flusher.commits} commits")
+
+    # the first round again, a game and a round trip at a time
+    first_round = args.players // 2
+    start = time.perf_counter()
+    for game_id in await gameService.next_game_ids(first_round, redis_db):
+        await gameService.create_matched(game_id, f"a{game_id}", f"b{game_id}", redis_db)
+    print(f"{first_round} games one by one: {(time.perf_counter() - start) * 1000:.1f}ms, "
+          f"as a round: {round_times[0] * 1000:.1f}ms")
+
+    await AsyncDB.close_db_connection()
+    DB.close_db_connection()
+    await redis_db.aclose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
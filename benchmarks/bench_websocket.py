@@ -0,0 +1,184 @@
+# End to end websocket load test. Starts the app (one uvicorn worker) on
+# SQLite and a local Redis, or fakeredis in its own process. It opens N
+# concurrent games over /games/ws/{game_id}, two sockets per game, and plays
+# scripted or random moves. The report is JSON: moves per second,
+# move-to-broadcast latency percentiles and server memory per connection.
+#
+#   python -m benchmarks.bench_websocket --games 200 --fake-redis --output ws.json
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+import websockets
+
+# nine moves, ends in a draw
+SCRIPTED_MOVES = ([0, 0], [0, 1], [0, 2], [1, 1], [1, 0], [1, 2], [2, 1], [2, 0], [2, 2])
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+def rss_kib(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+def percentile(values: list, fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+async def wait_until_up(url: str, server: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise RuntimeError(f"server exited with {server.returncode}")
+            try:
+                await client.get(url + "/docs")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+async def create_games(url: str, games: int, concurrency: int) -> list:
+    limit = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+        async def create(index: int) -> dict:
+            async with limit:
+                game = (await client.post("/games", json={"player": f"p1-{index}"})).raise_for_status().json()
+                return (await client.post(f"/games/{game['id']}", json={"player": f"p2-{index}"})).raise_for_status().json()
+        return await asyncio.gather(*(create(index) for index in range(games)))
+
+async def next_update(websocket, move: list, player: str) -> dict:
+    # skips join notices and anything that is not the broadcast of this move
+    while True:
+        message = json.loads(await websocket.recv())
+        if isinstance(message, dict):
+            if "error" in message:
+                raise RuntimeError(message["error"])
+            if message.get("move") == move and message.get("updated_by") == player:
+                return message
+
+async def play(game: dict, sockets: dict, mode: str, rng: random.Random, latencies: list) -> int:
+    players = (game["player1"], game["player2"])
+    free = [[row, col] for row in range(3) for col in range(3)]
+    moves = 0
+    for index in range(9):
+        mover, other = players[index % 2], players[1 - index % 2]
+        move = SCRIPTED_MOVES[index] if mode == "scripted" else free.pop(rng.randrange(len(free)))
+        if mode == "scripted":
+            free.remove(move)
+        started = time.perf_counter()
+        await sockets[mover].send(json.dumps({"turn": mover, "move": move}))
+        update = await next_update(sockets[other], move, mover)
+        latencies.append(time.perf_counter() - started)
+        await next_update(sockets[mover], move, mover)
+        moves += 1
+        if update["is_over"]:
+            break
+    return moves
+
+async def run(args, url: str, server: subprocess.Popen) -> dict:
+    rng = random.Random(args.seed)
+    games = await create_games(url, args.games, args.concurrency)
+
+    rss_before = rss_kib(server.pid)
+    ws_url = url.replace("http://", "ws://")
+    sockets = []
+    for game in games:
+        pair = {}
+        for player in (game["player1"], game["player2"]):
+            pair[player] = await websockets.connect(f"{ws_url}/games/ws/{game['id']}", max_queue=None)
+        sockets.append(pair)
+    await asyncio.sleep(0.5)
+    rss_after = rss_kib(server.pid)
+
+    latencies = []
+    started = time.perf_counter()
+    results = await asyncio.gather(*(play(game, pair, args.moves, rng, latencies) for game, pair in zip(games, sockets)),
+                                   return_exceptions=True)
+    elapsed = time.perf_counter() - started
+
+    for pair in sockets:
+        for websocket in pair.values():
+            await websocket.close()
+
+    moves = sum(result for result in results if isinstance(result, int))
+    errors = [str(result) for result in results if isinstance(result, BaseException)]
+    latencies.sort()
+    connections = 2 * len(games)
+    return {
+        "config": {"games": args.games, "moves": args.moves, "redis": "fakeredis" if args.fake_redis else "local",
+                   "broadcast_backend": os.environ.get("BROADCAST_BACKEND", "local"), "seed": args.seed},
+        "connections": connections,
+        "moves": moves,
+        "elapsed_s": round(elapsed, 3),
+        "moves_per_s": round(moves / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+            "p50": round(percentile(latencies, 0.50) * 1000, 3),
+            "p95": round(percentile(latencies, 0.95) * 1000, 3),
+            "p99": round(percentile(latencies, 0.99) * 1000, 3),
+        },
+        "memory_kib": {
+            "rss_before_connections": rss_before,
+            "rss_after_connections": rss_after,
+            "per_connection": round((rss_after - rss_before) / connections, 2),
+        },
+        "errors": len(errors),
+        "error_samples": errors[:5],
+    }
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--moves', choices=("scripted", "random"), default="scripted")
+    parser.add_argument('--concurrency', type=int, default=50, help="concurrent requests while creating games")
+    parser.add_argument('--fake-redis', action='store_true', help="run fakeredis instead of using REDIS_URL")
+    parser.add_argument('--db', default="sqlite:///./bench.db")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    if args.db.startswith("sqlite:///./") and os.path.exists(args.db[len("sqlite:///"):]):
+        os.remove(args.db[len("sqlite:///"):])
+
+    env = {**os.environ, "DB_CONNECTION": args.db}
+    processes = []
+    try:
+        if args.fake_redis:
+            redis_port = free_port()
+            processes.append(subprocess.Popen([sys.executable, "-c",
+                f"from fakeredis import TcpFakeServer; TcpFakeServer(('127.0.0.1', {redis_port}), server_type='redis').serve_forever()"]))
+            env.update(REDIS_URL="127.0.0.1", REDIS_PORT=str(redis_port))
+            await asyncio.sleep(0.5)
+
+        port = free_port()
+        server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"], env=env)
+        processes.append(server)
+        url = f"http://127.0.0.1:{port}"
+        await wait_until_up(url, server)
+
+        report = await run(args, url, server)
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    print(output)
+
+if __name__ == "__main__":
+    asyncio.run(main())
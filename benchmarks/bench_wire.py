@@ -0,0 +1,98 @@
+# Bytes and server CPU per move on /games/ws/{game_id}, JSON against the
+# binary subprotocol (game.wire). Random games are played through
+# game.service.update on fakeredis to record real moves and replies, then
+# each protocol's share of a move is replayed on them: decoding the client
+# frame, validating the move and encoding the reply broadcast to the
+# players. Bytes include websocket framing (client frames are masked).
+# Redis and the move itself cost the same either way and are left out.
+#
+#   python -m benchmarks.bench_wire --games 200 --board-size 3 15
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+os.environ.setdefault("DB_CONNECTION", "sqlite:///./bench.db")
+
+import fakeredis
+import orjson
+from game import wire
+from game.model import UpdateGameModel
+from game.flusher import GameFlusher
+import game.scripts as gameScripts
+import game.service as gameService
+
+def framed(payload: int, masked: bool = False) -> int:
+    header = 2 if payload < 126 else 4 if payload < 65536 else 10
+    return header + (4 if masked else 0) + payload
+
+async def record(games: int, size: int, seed: int, redis_db) -> list:
+    # (client JSON move, reply game) for every move of every game
+    rng = random.Random(seed)
+    moves = []
+    for game_id in await gameService.next_game_ids(games, redis_db):
+        game = gameService.new_game(game_id, f"alice{game_id}", f"bob{game_id}", size, gameService.win_length_for(size))
+        async with redis_db.pipeline(transaction=True) as pipe:
+            gameService.queue_new_game(pipe, game, 0)
+            await pipe.execute()
+        while not game["is_over"]:
+            free = [(row, col) for row in range(size) for col in range(size) if not game["board"][row][col]]
+            move = {"turn": game["turn"], "move": list(rng.choice(free))}
+            game = await gameService.update(UpdateGameModel(**move), str(game_id), None, redis_db)
+            moves.append((move, game))
+    return moves
+
+def json_move(text: str, game: dict) -> str:
+    UpdateGameModel.model_validate(json.loads(text), from_attributes=True, strict=False)
+    return orjson.dumps(game).decode("utf-8")
+
+def binary_move(frame: bytes, game: dict) -> bytes:
+    UpdateGameModel.model_validate(wire.BINARY.decode_move(frame, game), from_attributes=True, strict=False)
+    return wire.BINARY.encode(game)
+
+def measure(name: str, moves: list, repeat: int):
+    frames = []
+    for move, game in moves:
+        if name == "json":
+            frames.append((json.dumps(move), game))
+        else:
+            seat = 1 if move["turn"] == game["player1"] else 2
+            frames.append((wire.CLIENT_MOVE.pack(seat, move["move"][0] * game["board_size"] + move["move"][1]), game))
+    handle = json_move if name == "json" else binary_move
+    start = time.process_time()
+    for _ in range(repeat):
+        for frame, game in frames:
+            handle(frame, game)
+    cpu = (time.process_time() - start) / (repeat * len(frames))
+    sent = received = 0
+    for frame, game in frames:
+        received += framed(len(frame), masked=True)
+        # both players get the reply
+        sent += 2 * framed(len(handle(frame, game)))
+    print(f"  {name:<7} in {received / len(frames):>6.1f} B  out {sent / len(frames):>7.1f} B/move (2 players)  "
+          f"cpu {cpu * 1e6:>6.2f} us/move")
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=200)
+    parser.add_argument('--board-size', type=int, nargs='+', default=[3, 15])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    redis_db = fakeredis.FakeAsyncRedis()
+    await gameScripts.load_all(redis_db)
+    # nothing reaches SQL, finished games are not flushed
+    GameFlusher.instance = GameFlusher()
+    GameFlusher.instance.flush_finished = lambda *_: asyncio.sleep(0)
+    for size in args.board_size:
+        moves = await record(args.games, size, args.seed, redis_db)
+        print(f"{size}x{size}, {len(moves)} moves")
+        for name in ("json", "binary"):
+            measure(name, moves, args.repeat)
+    await redis_db.aclose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
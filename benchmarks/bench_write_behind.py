@@ -0,0 +1,113 @@
+# SQL commits per second with write-behind persistence, driving moves at a
+# fixed rate (5,000/s by default). Before the flusher every move was its own
+# commit, so the baseline is one commit per move.
+#
+#   DB_CONNECTION=sqlite:///./bench.db python -m benchmarks.bench_write_behind --rate 5000 --seconds 10
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault("DB_CONNECTION", "sqlite:///./bench.db")
+
+from sqlalchemy import event
+from database import DB, AsyncDB
+from redis_database import AsyncRedisDB
+from game.model import UpdateGameModel
+from game.schema import GameSchema
+from game.flusher import GameFlusher, DIRTY_GAMES, upsert_games
+from game import codec
+import game.service as gameService
+from benchmarks.bench_async_latency import serialize_sqlite_writers
+
+# nine moves, ends in a draw
+MOVES = ([0, 0], [0, 1], [0, 2], [1, 1], [1, 0], [1, 2], [2, 1], [2, 0], [2, 2])
+
+def new_game(game_id: int) -> dict:
+    return {
+        "id": game_id, "board": [['', '', ''], ['', '', ''], ['', '', '']], "winner": None,
+        "is_draw": False, "is_over": False, "player1": "player1", "player2": "player2",
+        "player1_symbol": "X", "player2_symbol": "O", "move": None, "turn": "player1",
+        "status": "INIT", "created_by": "player1", "updated_by": "player2",
+        "created_at": "2024-05-20 12:00:00", "updated_at": "2024-05-20 12:00:00",
+    }
+
+async def seed(games: int, redis_db):
+    # straight into Redis and one bulk insert, setup is not what we measure
+    rows = []
+    for game_id in range(1, games + 1):
+        game = new_game(game_id)
+        await redis_db.hset(f"GAME_{game_id}", mapping=codec.encode_game(game, 1))
+        rows.append({column: game.get(column) for column in GameSchema.__table__.columns.keys()} | {"seq": 1})
+    db = AsyncDB.get_instance()
+    async with db.SessionLocal() as session:
+        for start in range(0, len(rows), 1000):
+            await session.execute(upsert_games(db.engine.dialect.name, rows[start:start + 1000]))
+        await session.commit()
+
+async def play(game_id: int, interval: float, deadline: float, redis_db, counters: dict):
+    for i, move in enumerate(MOVES):
+        if time.perf_counter() >= deadline:
+            return
+        started = time.perf_counter()
+        await gameService.update(UpdateGameModel(turn="player1" if i % 2 == 0 else "player2", move=move), game_id, None, redis_db)
+        counters["moves"] += 1
+        await asyncio.sleep(max(0.0, interval - (time.perf_counter() - started)))
+    counters["finished"] += 1
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rate', type=int, default=5000, help="target moves per second")
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--move-interval', type=float, default=0.1, help="seconds between moves of one game")
+    parser.add_argument('--fake-redis', action='store_true')
+    args = parser.parse_args()
+
+    db = DB.get_instance()
+    GameSchema.__table__.drop(bind=db.engine, checkfirst=True)
+    db.Base.metadata.create_all(bind=db.engine)
+    serialize_sqlite_writers()
+
+    if args.fake_redis:
+        import fakeredis
+        redis_db = fakeredis.FakeAsyncRedis()
+    else:
+        redis_db = AsyncRedisDB.get_db()
+        await redis_db.delete(DIRTY_GAMES)
+
+    commits = [0]
+    event.listen(AsyncDB.get_instance().engine.sync_engine, "commit", lambda connection: commits.__setitem__(0, commits[0] + 1))
+
+    # enough concurrent games that each one plays at a human-ish pace
+    concurrent = max(1, int(args.rate * args.move_interval))
+    games = concurrent * int(args.seconds / (args.move_interval * len(MOVES)) + 2)
+    await seed(games, redis_db)
+    commits[0] = 0
+
+    flusher = GameFlusher.get_instance()
+    await flusher.start(redis_db)
+    counters = {"moves": 0, "finished": 0}
+    started = time.perf_counter()
+    deadline = started + args.seconds
+    next_game = 1
+    running = set()
+    while time.perf_counter() < deadline and next_game <= games:
+        while len(running) < concurrent and next_game <= games:
+            running.add(asyncio.create_task(play(next_game, args.move_interval, deadline, redis_db, counters)))
+            next_game += 1
+        done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+    await asyncio.gather(*running)
+    elapsed = time.perf_counter() - started
+    await flusher.stop()
+
+    moves = counters["moves"]
+    print(f"moves    : {moves} in {elapsed:.1f}s ({moves / elapsed:,.0f}/s, target {args.rate:,}/s)")
+    print(f"before   : {moves / elapsed:,.0f} commits/s (one per move)")
+    print(f"after    : {commits[0] / elapsed:,.1f} commits/s ({commits[0]} commits, {counters['finished']} games finished)")
+    print(f"saved    : {(moves - commits[0]) / elapsed:,.0f} commits/s ({1 - commits[0] / max(moves, 1):.1%})")
+
+    await AsyncDB.close_db_connection()
+    await redis_db.aclose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+# Soak test of the websocket registry: connection churn in process, each
+# cycle a player who leaves, one whose sends fail, one who stalls until the
+# drop policy closes it, one who goes quiet until reaped, and a spectator.
+# Traced memory (after gc) is sampled every --sample cycles and should level
+# off instead of growing with the cycles. The unit test of the same churn
+# runs 2000 cycles, this runs as many as asked.
+#
+#   python -m benchmarks.bench_ws_soak --cycles 20000 --sample 4000
+import argparse
+import asyncio
+import gc
+import time
+import tracemalloc
+
+from websocket_connection_manager import WSConnectionManager
+
+class SoakWebSocket:
+    def __init__(self, fails: bool = False, stalls: bool = False):
+        self.fails = fails
+        self.stalls = stalls
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, text):
+        if self.fails:
+            raise ConnectionResetError()
+        if self.stalls:
+            await asyncio.Event().wait()
+
+    async def send_json(self, message):
+        await self.send_text(message)
+
+    async def close(self, code=1000, reason=None):
+        pass
+
+async def churn(manager: WSConnectionManager, cycle: int, games: int):
+    channel_id = f"game{cycle % games}"
+    sockets = [SoakWebSocket(), SoakWebSocket(fails=True), SoakWebSocket(stalls=True), SoakWebSocket()]
+    for websocket in sockets:
+        await manager.connect(websocket, channel_id)
+    watcher = SoakWebSocket()
+    await manager.spectate(watcher, channel_id, lambda: asyncio.sleep(0, '{"seq": 0}'))
+    for seq in range(6):
+        await manager.broadcast({"seq": seq}, channel_id, spectator_message={"seq": seq})
+    while manager.queue_depth():
+        await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    manager.disconnect(sockets[0], channel_id)
+    manager.unspectate(watcher, channel_id)
+    manager.reap(time.monotonic() + manager.idle_timeout + 1)
+    await asyncio.sleep(0)
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cycles', type=int, default=20000)
+    parser.add_argument('--sample', type=int, default=4000)
+    parser.add_argument('--games', type=int, default=50)
+    args = parser.parse_args()
+
+    manager = WSConnectionManager(idle_timeout=60, send_queue_size=4, slow_consumer_policy="drop")
+    # warm up, then count only what gc cannot free
+    for cycle in range(200):
+        await churn(manager, cycle, args.games)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    start = time.perf_counter()
+    for cycle in range(1, args.cycles + 1):
+        await churn(manager, cycle, args.games)
+        if cycle % args.sample == 0 or cycle == args.cycles:
+            gc.collect()
+            grown = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, "filename"))
+            print(f"{cycle:>8} cycles  {cycle / (time.perf_counter() - start):>7,.0f} cycles/s  "
+                  f"traced memory {grown / 1024:>+8.1f} KiB  connections {len(manager.writers)}")
+    tracemalloc.stop()
+    assert manager.active_connections == {} and manager.writers == {} and manager.feeds == {}
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,17 +1,46 @@
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from dotenv import load_dotenv
+from typing import AsyncIterator, Iterator
+from metrics import Metrics
 import os
 
 load_dotenv()
 
+# async drivers used when DB_ASYNC_CONNECTION is not set explicitly
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+def async_connection_url(url: str) -> str:
+    scheme, separator, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme.split("+")[0], scheme) + separator + rest
+
+def pool_options(url: str) -> dict:
+    options = {
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() not in ("0", "false", "no", "off"),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    }
+    # SQLite gets a pool SQLAlchemy picks per driver, it cannot be sized
+    if url.startswith("sqlite"):
+        return options
+    return options | {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    }
+
 class DB:
     instance = None
     session = None
     Base = None
     def __init__(self):
-        self.engine = create_engine(os.getenv("DB_CONNECTION"))
+        url = os.getenv("DB_CONNECTION")
+        self.engine = create_engine(url, **pool_options(url))
         self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
         self.Base = declarative_base()
         self.Base.metadata.create_all(bind=self.engine)
@@ -24,8 +53,10 @@ class DB:
         return DB.instance
     
     @staticmethod
-    def get_db() -> Session:
-       return DB.get_instance().SessionLocal()
+    def get_db() -> Iterator[Session]:
+        # request scoped, the connection goes back to the pool afterwards
+        with DB.get_instance().SessionLocal() as session:
+            yield session
     
     @staticmethod
     def get_base():
@@ -33,8 +64,32 @@ class DB:
 
     @staticmethod
     def close_db_connection():
-        db = DB.get_db()
-        try:
-            db.close()
-        except:
-            pass
\ No newline at end of file
+        if DB.instance is not None:
+            DB.instance.engine.dispose()
+
+class AsyncDB:
+    instance = None
+    def __init__(self):
+        url = os.getenv("DB_ASYNC_CONNECTION") or async_connection_url(os.getenv("DB_CONNECTION"))
+        self.options = pool_options(url)
+        self.engine = create_async_engine(url, **self.options)
+        self.SessionLocal = async_sessionmaker(self.engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+        metrics = Metrics.get_instance()
+        # NullPool (aiosqlite) keeps no count
+        metrics.watch("db_pool_in_use", lambda: getattr(self.engine.pool, "checkedout", int)())
+        metrics.watch("db_pool_limit", lambda: self.options.get("pool_size", 1) + self.options.get("max_overflow", 0))
+
+    @staticmethod
+    def get_instance():
+        if AsyncDB.instance is None:
+            AsyncDB.instance = AsyncDB()
+        return AsyncDB.instance
+
+    @staticmethod
+    async def get_db() -> AsyncIterator[AsyncSession]:
+        async with AsyncDB.get_instance().SessionLocal() as session:
+            yield session
+
+    @staticmethod
+    async def close_db_connection():
+        await AsyncDB.get_instance().engine.dispose()
@@ -0,0 +1,175 @@
+import asyncio
+import random
+import pytest
+from fastapi import HTTPException
+from game import codec, events, scripts, stats
+from game.actors import GameActors, play_state
+from game.flusher import DIRTY_GAMES
+from game.lifecycle import GAME_EXPIRY, GameReaper
+from game.model import UpdateGameModel
+from game.service import create_matched, get_game, new_game, queue_new_game, update
+from game.shards import GameShards, ShardRing
+from game.__test__.test_mock_data import anyio_backend, fake_redis, mock_db, mock_flusher
+from game.__test__.test_websocket_connection_manager import FakeWebSocket, drain
+from websocket_connection_manager import WSConnectionManager
+
+async def create_large(game_id, board_size, win_length, redis_db):
+    game = new_game(game_id, "Alice", "Bob", board_size, win_length)
+    async with redis_db.pipeline(transaction=True) as pipe:
+        queue_new_game(pipe, game, GameReaper.get_instance().deadline())
+        await pipe.execute()
+
+async def script_move(game_id, turn, row, col, updated_at, redis_db):
+    keys = [f"GAME_{game_id}", DIRTY_GAMES, GAME_EXPIRY, stats.LEADERBOARD, stats.DIRTY_PLAYERS, events.events_key(game_id)]
+    args = [turn, row, col, updated_at, *GameReaper.get_instance().move_deadlines(), stats.PLAYER_STATS_PREFIX, events.EVENT_LOG_SIZE]
+    return await scripts.APPLY_MOVE(redis_db, keys, args)
+
+@pytest.fixture
+async def actors(fake_redis):
+    actors = GameActors(idle_ttl=60)
+    await actors.start(fake_redis)
+    try:
+        yield actors
+    finally:
+        await actors.stop()
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("board_size, win_length", [(3, 3), (9, 5)])
+async def test_play_state_matches_apply_move(fake_redis, board_size, win_length):
+    rng = random.Random(board_size)
+    for game_id in range(1, 6):
+        await create_large(game_id, board_size, win_length, fake_redis)
+        state = await fake_redis.hget(f"GAME_{game_id}", "state")
+        turn, other = "Alice", "Bob"
+        for ply in range(board_size * board_size + 2):
+            # mostly legal moves, with wrong turns and taken or outside cells mixed in
+            row, col = rng.randrange(-1, board_size + 1), rng.randrange(board_size)
+            mover = other if rng.random() < 0.1 else turn
+            updated_at = codec.encode_timestamp(f"2024-05-20 12:00:{ply % 60:02d}")
+            code, expected = play_state(state, "Alice", "Bob", mover, row, col, updated_at)
+            result = await script_move(game_id, mover, row, col, updated_at, fake_redis)
+            assert result[0].decode("utf-8") == code
+            if code == "OK":
+                assert result[1] == expected
+                state = expected
+                turn, other = other, turn
+
+@pytest.mark.anyio
+async def test_actor_moves_match_update(mock_db, fake_redis, mock_flusher, actors):
+    await create_matched(1, "Alice", "Bob", fake_redis)
+    await create_matched(2, "Alice", "Bob", fake_redis)
+    moves = [("Alice", [0, 0]), ("Bob", [1, 1]), ("Alice", [0, 1]), ("Bob", [2, 2])]
+    for turn, move in moves:
+        by_update = await update(UpdateGameModel(turn=turn, move=move), "1", mock_db, fake_redis)
+        by_actor = await actors.move(UpdateGameModel(turn=turn, move=move), "2", mock_db, fake_redis)
+        times = {"created_at": None, "updated_at": None}
+        assert {**by_actor, "id": 1, **times} == {**by_update, **times}
+        # a read settles the replay first
+        await actors.settle("2")
+        assert (await get_game(2, fake_redis))["seq"] == by_actor["seq"]
+
+    await actors.stop()
+    assert actors.replayed_moves == 4 and actors.diverged == 0
+    in_redis = await get_game(2, fake_redis)
+    assert in_redis["board"] == by_actor["board"] and in_redis["seq"] == by_actor["seq"] == 4
+    assert await fake_redis.xlen(events.events_key(2)) == 4
+
+@pytest.mark.anyio
+async def test_mailbox_serializes_moves(mock_db, fake_redis, mock_flusher, actors):
+    await create_matched(1, "Alice", "Bob", fake_redis)
+    replies = [actors.move(UpdateGameModel(turn="Alice", move=[0, col]), "1", mock_db, fake_redis) for col in range(2)]
+    results = await asyncio.gather(*replies, return_exceptions=True)
+
+    assert results[0]["board"][0] == ["X", "", ""]
+    assert isinstance(results[1], HTTPException) and results[1].detail == "It's not your turn"
+
+@pytest.mark.anyio
+async def test_finished_game_is_written_and_dropped(mock_db, fake_redis, mock_flusher, actors):
+    await create_matched(1, "Alice", "Bob", fake_redis)
+    for turn, move in [("Alice", [0, 0]), ("Bob", [1, 0]), ("Alice", [0, 1]), ("Bob", [1, 1])]:
+        await actors.move(UpdateGameModel(turn=turn, move=move), "1", mock_db, fake_redis)
+    game = await actors.move(UpdateGameModel(turn="Alice", move=[0, 2]), "1", mock_db, fake_redis)
+
+    assert game["winner"] == "Alice" and "1" not in actors.actors
+    # flushed after its last move reached Redis
+    assert (await get_game(1, fake_redis))["is_over"]
+    mock_flusher.flush_finished.assert_awaited_once_with({"GAME_1": 5}, fake_redis)
+
+@pytest.mark.anyio
+async def test_diverged_actor_reloads(mock_db, fake_redis, mock_flusher, actors):
+    await create_matched(1, "Alice", "Bob", fake_redis)
+    await actors.move(UpdateGameModel(turn="Alice", move=[0, 0]), "1", mock_db, fake_redis)
+    await actors.replay()
+    # another worker moved while this one still held the game
+    await update(UpdateGameModel(turn="Bob", move=[1, 1]), "1", mock_db, fake_redis)
+    await actors.move(UpdateGameModel(turn="Bob", move=[2, 2]), "1", mock_db, fake_redis)
+    await actors.settle("1")
+
+    assert actors.diverged == 1 and "1" not in actors.actors
+    game = await actors.move(UpdateGameModel(turn="Alice", move=[0, 1]), "1", mock_db, fake_redis)
+    assert game["board"] == [["X", "X", ""], ["", "O", ""], ["", "", ""]]
+
+@pytest.mark.anyio
+async def test_failed_replay_resyncs_the_game(mock_db, fake_redis, mock_flusher, actors, monkeypatch):
+    manager = WSConnectionManager()
+    monkeypatch.setattr(WSConnectionManager, "instance", manager)
+    player = FakeWebSocket()
+    await manager.connect(player, "1")
+    await create_matched(1, "Alice", "Bob", fake_redis)
+    await actors.move(UpdateGameModel(turn="Alice", move=[0, 0]), "1", mock_db, fake_redis)
+    await actors.settle("1")
+    # the game expired while the actor still held it, the move is answered from memory
+    await fake_redis.delete("GAME_1")
+    game = await actors.move(UpdateGameModel(turn="Bob", move=[1, 1]), "1", mock_db, fake_redis)
+    await actors.settle("1")
+    # the resync reads Redis on its own task
+    for _ in range(50):
+        if player.received:
+            break
+        await asyncio.sleep(0.01)
+    await drain(manager)
+
+    assert game["seq"] == 2 and "1" not in actors.actors
+    assert player.received == [{"error": "Game has expired"}]
+
+def test_ring_spreads_games_and_moves_few_on_growth():
+    ring = ShardRing(["a", "b", "c", "d"])
+    owners = [ring.owner(game_id) for game_id in range(20000)]
+    assert all(4000 <= owners.count(shard) <= 6000 for shard in "abcd")
+
+    grown = ShardRing(["a", "b", "c", "d", "e"])
+    moved = [game_id for game_id, owner in enumerate(owners) if grown.owner(game_id) != owner]
+    # only games taken by the new shard move
+    assert all(grown.owner(game_id) == "e" for game_id in moved)
+    assert 2500 <= len(moved) <= 5500
+
+@pytest.mark.anyio
+async def test_moves_are_forwarded_to_the_owner(mock_db, fake_redis, mock_flusher):
+    workers = [GameShards(["a", "b"], shard, timeout=2, actors=GameActors()) for shard in "ab"]
+    for worker in workers:
+        await worker.start(fake_redis)
+    try:
+        game_id = next(str(game_id) for game_id in range(1, 100) if workers[0].ring.owner(game_id) == "b")
+        await create_matched(int(game_id), "Alice", "Bob", fake_redis)
+        game = await workers[0].move({"turn": "Alice", "move": [1, 1]}, game_id, mock_db, fake_redis)
+        with pytest.raises(HTTPException) as excinfo:
+            await workers[0].move({"turn": "Alice", "move": [0, 0]}, game_id, mock_db, fake_redis)
+
+        assert game["board"][1][1] == "X" and workers[0].forwarded == 2
+        assert excinfo.value.detail == "It's not your turn"
+        assert game_id in workers[1].actors.actors and not workers[0].actors.actors
+    finally:
+        for worker in workers:
+            await worker.stop()
+
+@pytest.mark.anyio
+async def test_forward_to_a_missing_shard_fails(mock_db, fake_redis):
+    worker = GameShards(["a", "b"], "a", timeout=0.1)
+    await worker.start(fake_redis)
+    try:
+        game_id = next(str(game_id) for game_id in range(1, 100) if worker.ring.owner(game_id) == "b")
+        with pytest.raises(HTTPException) as excinfo:
+            await worker.move({"turn": "Alice", "move": [1, 1]}, game_id, mock_db, fake_redis)
+        assert excinfo.value.status_code == 503
+    finally:
+        await worker.stop()
@@ -0,0 +1,55 @@
+from game import ai, engine
+import random
+
+def test_table_holds_one_entry_per_symmetry_class():
+    solver = ai.Solver.get_instance()
+    # 5478 reachable positions fold into 765
+    assert len(solver.keys) == 765
+    assert list(solver.keys) == sorted(solver.keys)
+
+def test_canonical_is_the_same_for_every_symmetry():
+    player1, player2 = engine.board_to_masks([['X', '', ''], ['', 'O', ''], ['', '', 'X']], 'X', 'O')
+    key, _ = ai.canonical(player1, player2)
+    for transform in ai.TRANSFORMS:
+        assert ai.canonical(transform[player1], transform[player2])[0] == key
+
+def test_empty_board_is_a_draw():
+    entry, _ = ai.Solver.get_instance().lookup(0, 0)
+    assert ai._score(entry) == 0
+
+def test_takes_the_win_and_blocks():
+    solver = ai.Solver.get_instance()
+    # player2 to move can win on the middle row or block player1's top row
+    player1, player2 = engine.board_to_masks([['X', 'X', ''], ['O', 'O', ''], ['X', '', '']], 'X', 'O')
+    assert solver.choose_move(player1, player2) == (1, 2)
+    player1, player2 = engine.board_to_masks([['X', 'X', ''], ['O', '', ''], ['', '', '']], 'X', 'O')
+    assert solver.choose_move(player1, player2) == (0, 2)
+
+def test_hard_never_loses():
+    solver = ai.Solver.get_instance()
+
+    def play(player1: int, player2: int):
+        # every player1 move, the bot answers as player2
+        for cell in range(ai.CELLS):
+            bit = 1 << cell
+            if (player1 | player2) & bit:
+                continue
+            after_move = player1 | bit
+            result = engine.outcome(after_move, player2)
+            assert result != engine.PLAYER1_WIN
+            if result != engine.IN_PROGRESS:
+                continue
+            row, col = solver.choose_move(after_move, player2)
+            answer = player2 | engine.cell_bit(row, col)
+            assert not after_move & answer
+            if engine.outcome(after_move, answer) == engine.IN_PROGRESS:
+                play(after_move, answer)
+
+    play(0, 0)
+
+def test_easy_samples_suboptimal_moves():
+    solver = ai.Solver.get_instance()
+    player1, player2 = engine.board_to_masks([['X', 'X', ''], ['O', 'O', ''], ['X', '', '']], 'X', 'O')
+    moves = {solver.choose_move(player1, player2, "EASY", random.Random(seed)) for seed in range(50)}
+    assert (1, 2) in moves
+    assert len(moves) > 1
@@ -0,0 +1,50 @@
+import json
+import pytest
+from game import codec
+from game.__test__.test_mock_data import mock_game_model_dict
+
+def test_round_trip():
+    game = {**mock_game_model_dict, "id": 7, "board": [['X', '', 'O'], ['', 'X', ''], ['', '', '']],
+            "status": "IN_PROGRESS", "turn": "Bob", "move": [1, 1], "updated_by": "Alice",
+            "updated_at": "2024-05-20 12:00:00.123456"}
+    decoded = codec.decode_game(7, {field.encode(): value if isinstance(value, bytes) else value.encode()
+                                    for field, value in codec.encode_game(game, seq=3).items()})
+    assert decoded == {**game, "winner": None, "difficulty": None, "seq": 3, "board_size": 3, "win_length": 3}
+
+def test_state_is_fixed_size_and_carries_seq():
+    state = codec.encode_state(mock_game_model_dict, seq=41)
+    assert len(state) == codec.STATE.size == 20
+    assert codec.state_seq(state) == 41
+
+def test_large_board_round_trip():
+    board = [[''] * 19 for _ in range(19)]
+    board[0][0], board[9][9], board[18][18] = 'X', 'O', 'X'
+    game = {**mock_game_model_dict, "id": 7, "board": board, "board_size": 19, "win_length": 5,
+            "status": "IN_PROGRESS", "turn": "Bob", "move": [18, 18], "updated_by": "Alice",
+            "updated_at": "2024-05-20 12:00:00.123456"}
+    fields = codec.encode_game(game, seq=3)
+    # two 361 bit masks and the header
+    assert len(fields["state"]) == codec.LARGE_STATE.size + 2 * 46 == 113
+    assert codec.state_seq(fields["state"]) == 3
+    decoded = codec.decode_game(7, {field.encode(): value if isinstance(value, bytes) else value.encode()
+                                    for field, value in fields.items()})
+    assert decoded == {**game, "winner": None, "difficulty": None, "seq": 3}
+
+def test_missing_players_and_finished_game():
+    game = {**mock_game_model_dict, "player2": None, "turn": None, "status": "FINISH", "is_over": True,
+            "is_draw": True, "updated_at": None}
+    fields = codec.encode_game(game)
+    assert "player2" not in fields
+    decoded = codec.decode_game(1, {field.encode(): value if isinstance(value, bytes) else value.encode()
+                                    for field, value in fields.items()})
+    assert decoded["player2"] is None and decoded["turn"] is None
+    assert decoded["is_over"] and decoded["is_draw"] and decoded["status"] == "FINISH"
+
+def test_from_legacy_matches_encode():
+    data = json.dumps(mock_game_model_dict).encode()
+    assert codec.from_legacy(data) == codec.encode_game(mock_game_model_dict)
+
+def test_unknown_version_is_rejected():
+    state = b"\x09" + codec.encode_state(mock_game_model_dict)[1:]
+    with pytest.raises(codec.CodecError):
+        codec.decode_game(1, {b"state": state})
@@ -0,0 +1,54 @@
+import random
+from game import engine
+
+def test_outcome_table_lines():
+    for line in engine.WIN_LINES:
+        assert engine.outcome(line, 0) == engine.PLAYER1_WIN
+        assert engine.outcome(0, line) == engine.PLAYER2_WIN
+
+def test_outcome_table_draw_and_in_progress():
+    player1, player2 = engine.board_to_masks([['X', 'X', 'O'], ['O', 'O', 'X'], ['X', 'X', 'O']], 'X', 'O')
+    assert engine.outcome(player1, player2) == engine.DRAW
+    assert engine.outcome(0, 0) == engine.IN_PROGRESS
+    assert engine.outcome(engine.cell_bit(1, 1), engine.cell_bit(0, 0)) == engine.IN_PROGRESS
+
+def test_overlapping_masks_are_invalid():
+    assert engine.outcome(1, 1) == engine.INVALID
+
+def test_board_mask_round_trip():
+    board = [['X', '', 'O'], ['', 'X', ''], ['O', '', '']]
+    player1, player2 = engine.board_to_masks(board, 'X', 'O')
+    assert player1 == engine.cell_bit(0, 0) | engine.cell_bit(1, 1)
+    assert player2 == engine.cell_bit(0, 2) | engine.cell_bit(2, 0)
+    assert engine.masks_to_board(player1, player2, 'X', 'O') == board
+
+def stones(size, cells):
+    return sum(1 << engine.cell_index(row, col, size) for row, col in cells)
+
+def test_wins_at_every_direction():
+    lines = ([(7, col) for col in range(3, 8)], [(row, 0) for row in range(10, 15)],
+             [(index, index) for index in range(5)], [(index, 14 - index) for index in range(10, 15)])
+    for line in lines:
+        mask = stones(15, line)
+        for row, col in line:
+            assert engine.wins_at(mask, 15, 5, row, col)
+        assert not engine.wins_at(stones(15, line[:-1]), 15, 5, *line[0])
+
+def test_wins_at_does_not_wrap_rows():
+    # the last cells of row 0 and the first of row 1 are next to each other in the mask
+    assert not engine.wins_at(stones(7, [(0, 5), (0, 6), (1, 0), (1, 1)]), 7, 4, 0, 6)
+
+def test_wins_at_matches_a_full_scan():
+    rng = random.Random(3)
+    for _ in range(300):
+        size = rng.randint(4, 9)
+        win_length = rng.randint(3, min(size, 6))
+        cells = rng.sample(range(size * size), rng.randint(1, size * size // 2))
+        mask = sum(1 << cell for cell in cells)
+        row, col = divmod(cells[-1], size)
+        expected = any(
+            all(0 <= r + step * d_row < size and 0 <= c + step * d_col < size
+                and mask >> ((r + step * d_row) * size + c + step * d_col) & 1 for step in range(win_length))
+            for d_row, d_col in engine.DIRECTIONS
+            for r, c in ((row - shift * d_row, col - shift * d_col) for shift in range(win_length)))
+        assert engine.wins_at(mask, size, win_length, row, col) == expected
@@ -0,0 +1,102 @@
+import asyncio
+import random
+import pytest
+from game import events
+from game.model import UpdateGameModel
+from game.service import update
+from game.__test__.test_mock_data import anyio_backend, fake_redis, mock_db, mock_flusher, seed_game
+from game.__test__.test_websocket_connection_manager import FakeWebSocket, drain
+from websocket_connection_manager import WSConnectionManager
+
+# nine moves, ends in a draw
+MOVES = ([0, 0], [0, 1], [0, 2], [1, 1], [1, 0], [1, 2], [2, 1], [2, 0], [2, 2])
+PLAYERS = ("Alice", "Bob")
+
+async def play(game_id, moves, db, redis_db) -> list:
+    games = []
+    for index, move in enumerate(moves):
+        games.append(await update(UpdateGameModel(turn=PLAYERS[index % 2], move=move), game_id, db, redis_db))
+    return games
+
+@pytest.mark.anyio
+async def test_missed_events_replays_the_moves_after_last_seq(mock_db, fake_redis, mock_flusher):
+    await seed_game(fake_redis, "1", status="INIT")
+    games = await play("1", MOVES[:4], mock_db, fake_redis)
+
+    missed = await events.missed_events("1", 1, fake_redis)
+
+    assert missed == games[1:]
+    assert [game["seq"] for game in missed] == [2, 3, 4]
+
+@pytest.mark.anyio
+async def test_missed_events_nothing_when_up_to_date(mock_db, fake_redis, mock_flusher):
+    await seed_game(fake_redis, "1", status="INIT")
+    await play("1", MOVES[:2], mock_db, fake_redis)
+
+    assert await events.missed_events("1", 2, fake_redis) == []
+    assert await events.missed_events("2", 0, fake_redis) == []
+
+@pytest.mark.anyio
+async def test_missed_events_snapshot_once_the_log_is_trimmed(mock_db, fake_redis, mock_flusher, monkeypatch):
+    monkeypatch.setattr(events, "EVENT_LOG_SIZE", 2)
+    await seed_game(fake_redis, "1", status="INIT")
+    games = await play("1", MOVES[:5], mock_db, fake_redis)
+
+    assert await fake_redis.xlen(events.events_key("1")) == 2
+    assert await events.missed_events("1", 1, fake_redis) == [games[-1]]
+    assert await events.missed_events("1", 3, fake_redis) == games[3:]
+
+@pytest.mark.anyio
+async def test_reconnects_under_load_see_every_move_once(mock_db, fake_redis, mock_flusher):
+    # clients drop and come back with the last seq they saw while moves keep going
+    rng = random.Random(7)
+    manager = WSConnectionManager()
+    game_ids = [str(game_id) for game_id in range(1, 31)]
+    clients = {}
+    for game_id in game_ids:
+        await seed_game(fake_redis, game_id, id=int(game_id), status="INIT")
+        for player in PLAYERS:
+            websocket = FakeWebSocket()
+            await manager.connect(websocket, game_id)
+            clients[(game_id, player)] = {"socket": websocket, "sockets": [websocket], "connected": True}
+
+    def last_seq(client) -> int:
+        return max((message["seq"] for websocket in client["sockets"] for message in websocket.received), default=0)
+
+    async def reconnect(game_id, client):
+        websocket = FakeWebSocket()
+        client["socket"] = websocket
+        client["sockets"].append(websocket)
+        client["connected"] = True
+        await manager.connect(websocket, game_id, resume=True)
+        manager.replay(websocket, await events.missed_events(game_id, last_seq(client), fake_redis))
+
+    async def churn(game_id):
+        for player in PLAYERS:
+            client = clients[(game_id, player)]
+            if client["connected"] and rng.random() < 0.3:
+                await drain(manager)
+                manager.disconnect(client["socket"], game_id)
+                client["connected"] = False
+            elif not client["connected"] and rng.random() < 0.5:
+                await reconnect(game_id, client)
+
+    async def run(game_id):
+        for index, move in enumerate(MOVES):
+            async def move_and_broadcast():
+                game = await update(UpdateGameModel(turn=PLAYERS[index % 2], move=move), game_id, mock_db, fake_redis)
+                await manager.broadcast(game, game_id)
+            await asyncio.gather(move_and_broadcast(), churn(game_id))
+            await asyncio.sleep(0)
+
+    await asyncio.gather(*(run(game_id) for game_id in game_ids))
+    for (game_id, _), client in clients.items():
+        if not client["connected"]:
+            await reconnect(game_id, client)
+    await drain(manager)
+
+    reconnects = sum(len(client["sockets"]) - 1 for client in clients.values())
+    assert reconnects > len(clients) // 2
+    for client in clients.values():
+        seqs = [message["seq"] for websocket in client["sockets"] for message in websocket.received]
+        assert seqs == list(range(1, len(MOVES) + 1))
@@ -0,0 +1,82 @@
+import pytest
+import asyncio
+from unittest.mock import AsyncMock, patch
+from sqlalchemy.dialects import mysql, sqlite
+from game.flusher import GameFlusher, DIRTY_GAMES, upsert_games, game_row
+from game import codec
+from game.__test__.test_mock_data import mock_game_model_dict, anyio_backend, fake_redis, seed_game
+
+def test_upsert_games_mysql_guards_on_seq():
+    row = game_row(1, [codec.encode_state(mock_game_model_dict, 4)] + [None] * len(codec.COLD_FIELDS))
+    sql = str(upsert_games("mysql", [row]).compile(dialect=mysql.dialect()))
+    assert "ON DUPLICATE KEY UPDATE" in sql
+    assert "if(" in sql
+    # seq is assigned last so the other columns see the stored one
+    assert sql.rstrip().endswith("games.seq)")
+
+def test_upsert_games_sqlite_guards_on_seq():
+    row = game_row(1, [codec.encode_state(mock_game_model_dict, 4)] + [None] * len(codec.COLD_FIELDS))
+    sql = str(upsert_games("sqlite", [row]).compile(dialect=sqlite.dialect()))
+    assert "ON CONFLICT (id) DO UPDATE" in sql
+    assert "WHERE excluded.seq >= coalesce(games.seq" in sql
+
+def test_game_row():
+    state = codec.encode_state({**mock_game_model_dict, "board": [['X', '', ''], ['', '', ''], ['', '', '']]}, 7)
+    fields = [state] + [mock_game_model_dict.get(field, "").encode() for field in codec.COLD_FIELDS]
+
+    row = game_row("12", fields)
+
+    assert row["id"] == 12
+    assert row["seq"] == 7
+    assert row["board"][0] == ['X', '', '']
+    assert row["player2"] == mock_game_model_dict["player2"]
+    assert "move" not in row
+    assert game_row("12", [None] * len(fields)) is None
+
+@pytest.mark.anyio
+async def test_flush_games_keeps_games_marked_again(fake_redis):
+    await fake_redis.hset(DIRTY_GAMES, mapping={"GAME_1": 3, "GAME_2": 5})
+
+    # neither game is left in Redis, so nothing reaches SQL
+    flushed = await GameFlusher().flush_games({"GAME_1": 3, "GAME_2": 4}, fake_redis)
+
+    assert flushed == 0
+    assert await fake_redis.hgetall(DIRTY_GAMES) == {b"GAME_2": b"5"}
+
+@pytest.mark.anyio
+async def test_flush_batches(fake_redis):
+    for game_id in range(1, 6):
+        await seed_game(fake_redis, game_id)
+        await fake_redis.hset(DIRTY_GAMES, f"GAME_{game_id}", 1)
+    flusher = GameFlusher(batch_size=2)
+
+    with patch.object(GameFlusher, "flush_games", wraps=flusher.flush_games) as flush_games, \
+         patch("game.flusher.AsyncDB.get_instance") as get_db:
+        session = get_db.return_value.SessionLocal.return_value.__aenter__.return_value
+        session.execute, session.commit = AsyncMock(), AsyncMock()
+        get_db.return_value.engine.dialect.name = "sqlite"
+        flushed = await flusher.flush(fake_redis)
+
+    assert flushed == 5
+    assert all(len(call.args[0]) <= 2 for call in flush_games.call_args_list)
+    assert session.commit.await_count == flusher.commits == 3
+    assert await fake_redis.hlen(DIRTY_GAMES) == 0
+
+def test_notify_wakes_at_batch_size():
+    flusher = GameFlusher(batch_size=3)
+    flusher.notify()
+    flusher.notify()
+    assert not flusher.wake.is_set()
+    flusher.notify()
+    assert flusher.wake.is_set()
+
+@pytest.mark.anyio
+async def test_flush_finished_shares_a_round(fake_redis):
+    flusher = GameFlusher(interval=60)
+    with patch.object(GameFlusher, "flush", AsyncMock(return_value=2)) as flush:
+        await flusher.start(fake_redis)
+        await asyncio.gather(flusher.flush_finished({"GAME_1": 9}), flusher.flush_finished({"GAME_2": 9}))
+        await flusher.stop()
+
+    # one round for both games, one more on stop
+    assert flush.await_count == 2
@@ -0,0 +1,96 @@
+import csv
+import io
+import json
+import uuid
+import pytest
+from datetime import datetime
+from game import history
+from game.schema import GameSchema
+from game.__test__.test_mock_data import mock_game_schema_dict, anyio_backend
+from database import DB, AsyncDB
+
+@pytest.fixture()
+async def players():
+    # games of players only this test knows, on the test database
+    db = DB.get_instance()
+    db.get_base().metadata.create_all(bind=db.engine)
+    alice, bob = f"Alice-{uuid.uuid4().hex[:8]}", f"Bob-{uuid.uuid4().hex[:8]}"
+    async with AsyncDB.get_instance().SessionLocal() as session:
+        for day in range(1, 8):
+            session.add(GameSchema(**{**mock_game_schema_dict, "id": None, "player1": alice, "player2": bob,
+                                      "status": "FINISH" if day % 2 else "IN_PROGRESS", "board": [['X', '', ''], ['', '', ''], ['', '', '']],
+                                      "created_at": str(datetime(2024, 5, day, 12))}))
+        await session.commit()
+    try:
+        yield alice, bob
+    finally:
+        await AsyncDB.close_db_connection()
+
+@pytest.mark.anyio
+async def test_list_games_pages_newest_first(players):
+    alice, _ = players
+    seen = []
+    after = None
+    async with AsyncDB.get_instance().SessionLocal() as db:
+        while True:
+            page = await history.list_games(db, after, 3, player=alice)
+            seen += page["games"]
+            after = page["next_cursor"]
+            if after is None:
+                break
+    assert [game["created_at"][:10] for game in seen] == [f"2024-05-0{day}" for day in range(7, 0, -1)]
+    assert len({game["id"] for game in seen}) == 7
+
+@pytest.mark.anyio
+async def test_list_games_filters(players):
+    alice, bob = players
+    async with AsyncDB.get_instance().SessionLocal() as db:
+        finished = await history.list_games(db, player=bob, status="FINISH")
+        window = await history.list_games(db, player=alice, created_after=datetime(2024, 5, 3), created_before=datetime(2024, 5, 5))
+        nobody = await history.list_games(db, player="nobody-" + alice)
+
+    assert len(finished["games"]) == 4 and all(game["status"] == "FINISH" for game in finished["games"])
+    assert [game["created_at"][:10] for game in window["games"]] == ["2024-05-04", "2024-05-03"]
+    assert finished["next_cursor"] is None
+    assert nobody == {"games": [], "next_cursor": None}
+
+@pytest.mark.anyio
+async def test_created_at_is_stamped_per_game(monkeypatch):
+    db = DB.get_instance()
+    db.get_base().metadata.create_all(bind=db.engine)
+    player = f"Carol-{uuid.uuid4().hex[:8]}"
+    class Clock(datetime):
+        at = datetime(2024, 6, 1, 12)
+        @classmethod
+        def now(cls, tz=None):
+            return cls.at
+    monkeypatch.setattr("game.schema.datetime", Clock)
+    try:
+        async with AsyncDB.get_instance().SessionLocal() as session:
+            for hour in (9, 12, 15):
+                # created_at left to the column default
+                Clock.at = datetime(2024, 6, 1, hour)
+                fields = {key: value for key, value in mock_game_schema_dict.items() if key not in ("id", "created_at")}
+                session.add(GameSchema(**{**fields, "player1": player}))
+                await session.commit()
+            window = await history.list_games(session, player=player, created_after=datetime(2024, 6, 1, 10), created_before=datetime(2024, 6, 1, 14))
+    finally:
+        await AsyncDB.close_db_connection()
+
+    assert [game["created_at"] for game in window["games"]] == [str(datetime(2024, 6, 1, 12))]
+
+@pytest.mark.anyio
+async def test_export_streams_ndjson_and_csv(players):
+    alice, _ = players
+    chunks = [chunk async for chunk in history.export_games("ndjson", batch_size=2, player=alice)]
+    games = [json.loads(line) for line in b"".join(chunks).splitlines()]
+    # oldest first, one chunk per batch
+    assert [game["created_at"][:10] for game in games] == [f"2024-05-0{day}" for day in range(1, 8)]
+    assert len(chunks) == 4
+    assert games[0]["board"][0] == ["X", "", ""]
+
+    text = b"".join([chunk async for chunk in history.export_games("csv", status="IN_PROGRESS", player=alice)]).decode()
+    rows = list(csv.DictReader(io.StringIO(text)))
+    assert list(rows[0]) == list(history.COLUMNS)
+    assert [row["created_at"][:10] for row in rows] == ["2024-05-02", "2024-05-04", "2024-05-06"]
+    assert json.loads(rows[0]["board"])[0] == ["X", "", ""]
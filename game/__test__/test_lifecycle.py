@@ -0,0 +1,59 @@
+import pytest
+from unittest.mock import AsyncMock, patch
+from game.lifecycle import GameReaper, GAME_EXPIRY
+from game.flusher import DIRTY_GAMES
+from game import scripts
+from game.__test__.test_mock_data import anyio_backend, fake_redis, seed_game
+
+@pytest.fixture
+def closed_channels():
+    with patch("game.lifecycle.WSConnectionManager.get_instance") as get_manager:
+        get_manager.return_value.close_channels = AsyncMock()
+        yield get_manager.return_value.close_channels
+
+@pytest.mark.anyio
+async def test_reap_deletes_only_games_past_their_deadline(fake_redis, closed_channels):
+    for game_id in range(1, 4):
+        await seed_game(fake_redis, game_id)
+    await fake_redis.zadd(GAME_EXPIRY, {"GAME_1": 1000, "GAME_2": 2000, "GAME_3": 9000})
+
+    reaped = await GameReaper().reap(fake_redis, now=5)
+
+    assert reaped == 2
+    assert await fake_redis.exists("GAME_1", "GAME_2") == 0
+    assert await fake_redis.exists("GAME_3") == 1
+    assert await fake_redis.zrange(GAME_EXPIRY, 0, -1) == [b"GAME_3"]
+    closed_channels.assert_awaited_once_with(["1", "2"], "Game has expired")
+
+@pytest.mark.anyio
+async def test_reap_flushes_unsaved_moves_first(fake_redis, closed_channels):
+    await seed_game(fake_redis, 1)
+    await fake_redis.zadd(GAME_EXPIRY, {"GAME_1": 1000})
+    await fake_redis.hset(DIRTY_GAMES, "GAME_1", 3)
+
+    async def flush_games(dirty, redis_db):
+        assert dirty == {b"GAME_1": b"3"}
+        await scripts.CLEAN_DIRTY(redis_db, [DIRTY_GAMES], [b"GAME_1", b"3"])
+        return 1
+
+    flusher = AsyncMock()
+    flusher.flush_games.side_effect = flush_games
+    with patch("game.lifecycle.GameFlusher.get_instance", return_value=flusher):
+        # the first pass hands the game to the flusher, the second deletes it
+        reaper = GameReaper(batch_size=1)
+        assert await reaper.reap(fake_redis, now=5) == 1
+
+    flusher.flush_games.assert_awaited_once()
+    assert await fake_redis.exists("GAME_1") == 0
+
+@pytest.mark.anyio
+async def test_backfill_runs_once(fake_redis):
+    await seed_game(fake_redis, 1)
+    await seed_game(fake_redis, 2)
+    await fake_redis.set("GAME_ID", 2)
+    reaper = GameReaper()
+
+    assert await reaper.backfill(fake_redis) == 2
+    await seed_game(fake_redis, 3)
+    assert await reaper.backfill(fake_redis) == 0
+    assert sorted(await fake_redis.zrange(GAME_EXPIRY, 0, -1)) == [b"GAME_1", b"GAME_2"]
@@ -0,0 +1,65 @@
+import pytest
+import asyncio
+from fastapi import HTTPException
+from game.matchmaking import Matchmaker, QUEUE, TICKET_PREFIX
+from game.service import get_game
+from game.__test__.test_mock_data import anyio_backend, fake_redis, mock_flusher
+
+@pytest.fixture
+async def matchmakers(fake_redis):
+    # two workers sharing one Redis
+    workers = [Matchmaker(timeout=2), Matchmaker(timeout=2)]
+    for worker in workers:
+        await worker.start(fake_redis)
+    try:
+        yield workers
+    finally:
+        for worker in workers:
+            await worker.stop()
+
+async def queued(matchmaker, player, fake_redis):
+    # waits until the player's ticket is in the queue
+    pairing = asyncio.create_task(matchmaker.matchmake(player, fake_redis))
+    while await fake_redis.llen(QUEUE) == 0:
+        await asyncio.sleep(0.01)
+    return pairing
+
+@pytest.mark.anyio
+async def test_matchmake_pairs_across_workers(fake_redis, matchmakers, mock_flusher):
+    waiting = await queued(matchmakers[0], "Alice", fake_redis)
+    game = await matchmakers[1].matchmake("Bob", fake_redis)
+
+    assert await waiting == game
+    assert game["player1"] == "Alice"
+    assert game["player2"] == "Bob"
+    assert game["turn"] == "Alice"
+    assert game["status"] == "INIT"
+    assert await get_game(game["id"], fake_redis) == game
+    assert await fake_redis.hget("DIRTY_GAMES", f"GAME_{game['id']}") == b"0"
+    assert await fake_redis.llen(QUEUE) == 0
+    mock_flusher.notify.assert_called_once()
+
+@pytest.mark.anyio
+async def test_matchmake_does_not_pair_a_player_with_itself(fake_redis, matchmakers, mock_flusher):
+    first = await queued(matchmakers[0], "Alice", fake_redis)
+    second = asyncio.create_task(matchmakers[1].matchmake("Alice", fake_redis))
+    await asyncio.sleep(0.05)
+    assert await fake_redis.llen(QUEUE) == 2
+
+    game = await matchmakers[1].matchmake("Bob", fake_redis)
+    assert game["player1"] == "Alice"
+    assert await first == game
+    second.cancel()
+
+@pytest.mark.anyio
+async def test_matchmake_times_out(fake_redis, mock_flusher):
+    matchmaker = Matchmaker(timeout=0.1)
+    await matchmaker.start(fake_redis)
+
+    with pytest.raises(HTTPException) as excinfo:
+        await matchmaker.matchmake("Alice", fake_redis)
+    await matchmaker.stop()
+
+    assert excinfo.value.status_code == 408
+    assert await fake_redis.keys(f"{TICKET_PREFIX}*") == []
+    assert matchmaker.waiting == {}
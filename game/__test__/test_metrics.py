@@ -0,0 +1,39 @@
+from metrics import Metrics, NOOP
+
+def sample(metrics: Metrics, name: str, labels: dict):
+    return metrics.registry.get_sample_value(name, labels)
+
+def test_stage_timer_records_to_the_histogram():
+    metrics = Metrics(enabled=True)
+    with metrics.time("update", "apply_move"):
+        pass
+    with metrics.time("update", "apply_move"):
+        pass
+    assert sample(metrics, "game_stage_seconds_count", {"operation": "update", "stage": "apply_move"}) == 2
+
+def test_counts_results_and_fanout():
+    metrics = Metrics(enabled=True)
+    metrics.count("ws_move")
+    metrics.count("ws_move", "400")
+    metrics.observe_fanout(2)
+    assert sample(metrics, "game_operations_total", {"operation": "ws_move", "result": "ok"}) == 1
+    assert sample(metrics, "game_operations_total", {"operation": "ws_move", "result": "400"}) == 1
+    assert sample(metrics, "websocket_broadcast_fanout_sum", {}) == 2
+
+def test_gauges_are_read_at_scrape_time():
+    metrics = Metrics(enabled=True)
+    sockets = []
+    metrics.watch("websocket_connections", lambda: len(sockets))
+    sockets.extend([1, 2, 3])
+    text = metrics.render().decode()
+    assert "websocket_connections 3.0" in text
+    assert "game_stage_seconds" in text
+
+def test_disabled_metrics_are_a_no_op():
+    metrics = Metrics(enabled=False)
+    assert metrics.time("update", "apply_move") is NOOP
+    metrics.count("ws_move")
+    metrics.observe_fanout(4)
+    metrics.watch("active_games", lambda: 1)
+    assert not hasattr(metrics, "registry")
+    assert metrics.stages == {} and metrics.results == {}
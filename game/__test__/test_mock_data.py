@@ -1,10 +1,13 @@
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, AsyncMock, patch
 import pytest
 from fastapi import HTTPException
-from sqlalchemy.orm import Session
-from redis import Redis
+from sqlalchemy.ext.asyncio import AsyncSession
+from redis.asyncio import Redis
 from game.model import GameModel, CreateGameModel, UpdateGameModel
+from game import codec
+from game.flusher import GameFlusher
 import os
+import json
 
 mock_game_schema_dict = {
         "id": 1,
@@ -19,7 +22,8 @@ mock_game_schema_dict = {
         "created_by": "Alice",
         "updated_by": "Alice",
         "created_at": "2024-05-20T12:00:00Z",
-        "updated_at": "2024-05-20T12:00:00Z"
+        "updated_at": "2024-05-20T12:00:00Z",
+        "mode": "PVP",
 }
 
 mock_game_model_dict = {
@@ -29,16 +33,49 @@ mock_game_model_dict = {
 
 
 
+# redis.asyncio commands are plain methods returning awaitables, so spec alone
+# does not make them awaitable on the mock
+ASYNC_REDIS_COMMANDS = ("hexists", "hget", "hset", "hdel", "expire", "ping", "incr", "zadd", "xadd")
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
 @pytest.fixture
 def mock_db():
-    db = MagicMock(spec=Session)
+    db = MagicMock(spec=AsyncSession)
     return db
 
 @pytest.fixture
 def mock_redis():
     redis = MagicMock(spec=Redis)
+    for command in ASYNC_REDIS_COMMANDS:
+        setattr(redis, command, AsyncMock(return_value=MagicMock()))
     return redis
 
+@pytest.fixture
+async def fake_redis():
+    # scripts need a real command implementation, so update tests use fakeredis
+    fakeredis = pytest.importorskip("fakeredis")
+    redis = fakeredis.FakeAsyncRedis()
+    try:
+        yield redis
+    finally:
+        await redis.aclose()
+
+@pytest.fixture
+def mock_flusher():
+    flusher = MagicMock(spec=GameFlusher)
+    flusher.flush_finished = AsyncMock(return_value=1)
+    with patch("game.service.GameFlusher.get_instance", return_value=flusher):
+        yield flusher
+
+async def seed_game(redis, game_id, **fields):
+    await redis.hset(f"GAME_{game_id}", mapping=codec.encode_game({**mock_game_model_dict, **fields}))
+
+async def seed_legacy_game(redis, game_id, **fields):
+    await redis.hset(f"GAME_{game_id}", "data", json.dumps({**mock_game_model_dict, **fields}))
+
 @pytest.fixture
 def mock_create_game_data():
     return CreateGameModel(player="player1")
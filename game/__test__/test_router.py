@@ -0,0 +1,67 @@
+import asyncio
+import json
+import pytest
+from fastapi import WebSocketDisconnect
+from game.router import update_game, batch_moves
+from game.model import BatchMovesModel
+from game.__test__.test_mock_data import anyio_backend, mock_db, fake_redis, mock_flusher, seed_game
+from game.__test__.test_websocket_connection_manager import FakeWebSocket, drain
+from websocket_connection_manager import WSConnectionManager
+
+class PlayerWebSocket(FakeWebSocket):
+    # sends what it is given, then hangs up
+    def __init__(self, *incoming):
+        super().__init__()
+        self.scope = {}
+        self.incoming = list(incoming)
+
+    async def receive_json(self):
+        await asyncio.sleep(0)
+        if not self.incoming:
+            raise WebSocketDisconnect(1000)
+        return self.incoming.pop(0)
+
+@pytest.fixture
+def manager(monkeypatch):
+    manager = WSConnectionManager(max_channel_connections=2)
+    monkeypatch.setattr(WSConnectionManager, "instance", manager)
+    return manager
+
+@pytest.mark.anyio
+async def test_player_leaving_ends_the_loop(manager):
+    other = FakeWebSocket()
+    await manager.connect(other, "1")
+    player = PlayerWebSocket({"type": "ping"})
+    await asyncio.wait_for(update_game(player, "1", redis_db=None), 1)
+    await drain(manager)
+
+    assert player.received == [{"type": "pong"}]
+    assert other.received[-1] == "Player disconnected from game 1"
+    assert manager.active_connections == {"1": [other]} and id(player) not in manager.writers
+
+@pytest.mark.anyio
+async def test_full_game_turns_players_away(manager):
+    for _ in range(2):
+        await manager.connect(FakeWebSocket(), "1")
+    player = PlayerWebSocket()
+    await update_game(player, "1", redis_db=None)
+
+    assert (player.closed, player.close_reason) == (1008, "Too many connections to this game")
+    assert len(manager.active_connections["1"]) == 2
+
+@pytest.mark.anyio
+async def test_batch_moves_reach_each_games_players(manager, mock_db, fake_redis, mock_flusher):
+    for game_id in ("1", "2"):
+        await seed_game(fake_redis, game_id)
+    players = {game_id: FakeWebSocket() for game_id in ("1", "2")}
+    for game_id, websocket in players.items():
+        await manager.connect(websocket, game_id)
+    data = BatchMovesModel(moves=[{"game_id": 1, "turn": "Alice", "move": [0, 0]}, {"game_id": 2, "turn": "Bob", "move": [0, 0]}])
+
+    response = await batch_moves(data, mock_db, fake_redis)
+    await drain(manager)
+
+    first, second = json.loads(response.body)["results"]
+    assert (first["status_code"], first["game"]["move"]) == (200, [0, 0])
+    assert (second["status_code"], second["detail"], second["game_id"]) == (400, "It's not your turn", 2)
+    assert players["1"].received == [first["game"]] and players["2"].received == []
@@ -1,9 +1,12 @@
-from game.service import create, update
-from game.__test__.test_mock_data import mock_game_model_dict, mock_game_schema_dict, mock_db, mock_redis
+from game.service import create, update, sync_game_ids
+from game.flusher import GameFlusher, DIRTY_GAMES
+import game.scripts as gameScripts
+from game.__test__.test_mock_data import mock_game_model_dict, mock_game_schema_dict, mock_db, mock_redis, anyio_backend
 from game.model import CreateGameModel, UpdateGameModel
-from game.schema import GameSchema
-from database import DB
-from redis_database import RedisDB
+from game.schema import GameSchema, PlayerSchema
+from game import stats
+from database import DB, AsyncDB
+from redis_database import AsyncRedisDB
 import pytest
 import os
 
@@ -14,25 +17,31 @@ def test_set_environment_variables():
 
 
 @pytest.fixture()
-def mock_db():
+async def mock_db():
     db = DB.get_instance()
     db.get_base().metadata.create_all(bind=db.engine)
-    try:
-        yield db.get_db()
-    finally:
-        db.get_db().rollback()
-        db.close_db_connection()
+    async with AsyncDB.get_instance().SessionLocal() as session:
+        try:
+            yield session
+        finally:
+            await session.rollback()
+    # pooled connections are bound to this test's event loop
+    await AsyncDB.close_db_connection()
 
 @pytest.fixture()
-def mock_redis():
-    redis = RedisDB.get_instance()
+async def mock_redis():
+    redis = AsyncRedisDB.get_instance()
+    await gameScripts.load_all(redis.get_db())
+    async with AsyncDB.get_instance().SessionLocal() as session:
+        await sync_game_ids(session, redis.get_db())
     try:
         yield redis.get_db()
     finally:
-        redis.get_db().close()
+        await AsyncRedisDB.close_db_connection()
 
-def test_create(mock_db, mock_redis):
-    game = create(CreateGameModel(player=mock_game_model_dict["player1"]), mock_db, mock_redis, None)
+@pytest.mark.anyio
+async def test_create(mock_db, mock_redis):
+    game = await create(CreateGameModel(player=mock_game_model_dict["player1"]), mock_db, mock_redis, None)
     assert game["player1"] == mock_game_model_dict["player1"]
     assert game["player2"] == None
     assert game["player1_symbol"] == mock_game_model_dict["player1_symbol"]
@@ -43,14 +52,15 @@ def test_create(mock_db, mock_redis):
     assert game["created_by"] == mock_game_model_dict["created_by"]
     assert game["updated_by"] == mock_game_model_dict["updated_by"]
 
-    game_exist = mock_db.query(GameSchema).filter(GameSchema.id == game["id"]).limit(1)
-    assert game_exist.count() == 1
+    game_exist = await mock_db.get(GameSchema, game["id"])
+    assert game_exist is not None
     # exist =  mock_redis.hexists(f"GAME_{game["id"]}", "data")
     # assert exist == True
 
-def test_join(mock_db, mock_redis):
-    game = create(CreateGameModel(player=mock_game_model_dict["player1"]), mock_db, mock_redis, None)
-    game = create(CreateGameModel(player=mock_game_model_dict["player2"]), mock_db, mock_redis, game_id=game["id"])
+@pytest.mark.anyio
+async def test_join(mock_db, mock_redis):
+    game = await create(CreateGameModel(player=mock_game_model_dict["player1"]), mock_db, mock_redis, None)
+    game = await create(CreateGameModel(player=mock_game_model_dict["player2"]), mock_db, mock_redis, game_id=game["id"])
     assert game["player1"] == mock_game_model_dict["player1"]
     assert game["player2"] == mock_game_model_dict["player2"]
     assert game["player1_symbol"] == mock_game_model_dict["player1_symbol"]
@@ -62,17 +72,109 @@ def test_join(mock_db, mock_redis):
     assert game["created_by"] == mock_game_model_dict["created_by"]
     assert game["updated_by"] == mock_game_model_dict["player2"]
 
-    game_exist = mock_db.query(GameSchema).filter(GameSchema.id == game["id"]).limit(1)
-    assert game_exist.count() == 1
+    game_exist = await mock_db.get(GameSchema, game["id"])
+    assert game_exist is not None
 
-def test_update(mock_db, mock_redis):
-    game = create(CreateGameModel(player=mock_game_model_dict["player1"]), mock_db, mock_redis, None)
-    game = create(CreateGameModel(player=mock_game_model_dict["player2"]), mock_db, mock_redis, game["id"])
-    update_game = update(UpdateGameModel(turn=mock_game_model_dict["player1"], move=[0,0]), game["id"], mock_db, mock_redis)
+@pytest.mark.anyio
+async def test_update(mock_db, mock_redis):
+    game = await create(CreateGameModel(player=mock_game_model_dict["player1"]), mock_db, mock_redis, None)
+    game = await create(CreateGameModel(player=mock_game_model_dict["player2"]), mock_db, mock_redis, game["id"])
+    update_game = await update(UpdateGameModel(turn=mock_game_model_dict["player1"], move=[0,0]), game["id"], mock_db, mock_redis)
     assert update_game["board"][0][0] == mock_game_model_dict['player1_symbol']
     assert update_game["turn"] == mock_game_model_dict["player2"]
     assert update_game["status"] == "IN_PROGRESS"
     assert update_game["is_over"] == mock_game_model_dict["is_over"]
     assert update_game["is_draw"] == mock_game_model_dict["is_draw"]
     assert update_game["updated_by"] == mock_game_model_dict["player1"]
-    assert update_game["created_by"] == mock_game_model_dict["player1"]
\ No newline at end of file
+    assert update_game["created_by"] == mock_game_model_dict["player1"]
+
+    # SQL is written behind the move
+    assert await mock_redis.hget(DIRTY_GAMES, f"GAME_{game['id']}") == b"2"
+    await GameFlusher.get_instance().flush(mock_redis)
+    assert await mock_redis.hget(DIRTY_GAMES, f"GAME_{game['id']}") is None
+    game_record = await mock_db.get(GameSchema, game["id"])
+    await mock_db.refresh(game_record)
+    assert game_record.status == "IN_PROGRESS"
+    assert game_record.turn == mock_game_model_dict["player2"]
+    assert game_record.board[0][0] == mock_game_model_dict['player1_symbol']
+    assert game_record.seq == 2
+
+@pytest.mark.anyio
+async def test_create_ai_game(mock_db, mock_redis):
+    game = await create(CreateGameModel(player="Alice", mode="AI", difficulty="MEDIUM"), mock_db, mock_redis, None)
+    assert game["player2"] == "BOT"
+    assert game["status"] == "INIT"
+    assert game["mode"] == "AI"
+    assert game["difficulty"] == "MEDIUM"
+
+    update_game = await update(UpdateGameModel(turn="Alice", move=[1, 1]), game["id"], mock_db, mock_redis)
+    assert update_game["turn"] == "Alice"
+    assert sum(row.count("O") for row in update_game["board"]) == 1
+
+@pytest.mark.anyio
+async def test_update_finish_is_flushed(mock_db, mock_redis):
+    game = await create(CreateGameModel(player="Alice"), mock_db, mock_redis, None)
+    game = await create(CreateGameModel(player="Bob"), mock_db, mock_redis, game["id"])
+    for turn, move in (("Alice", [0, 0]), ("Bob", [1, 0]), ("Alice", [0, 1]), ("Bob", [1, 1]), ("Alice", [0, 2])):
+        update_game = await update(UpdateGameModel(turn=turn, move=move), game["id"], mock_db, mock_redis)
+    assert update_game["status"] == "FINISH"
+
+    # no flusher run needed once the game is over
+    assert await mock_redis.hget(DIRTY_GAMES, f"GAME_{game['id']}") is None
+    game_record = await mock_db.get(GameSchema, game["id"])
+    await mock_db.refresh(game_record)
+    assert game_record.status == "FINISH"
+    assert game_record.winner == "Alice"
+    assert game_record.board[0] == ["X", "X", "X"]
+
+    # and so are the player counters
+    for name in ("Alice", "Bob"):
+        player = await mock_db.get(PlayerSchema, name)
+        await mock_db.refresh(player)
+        counters = await mock_redis.hmget(stats.PLAYER_STATS_PREFIX + name, stats.STAT_FIELDS)
+        assert [player.wins, player.losses, player.draws, player.games] == [int(value or 0) for value in counters]
+
+@pytest.mark.anyio
+async def test_gomoku_game_is_flushed(mock_db, mock_redis):
+    game = await create(CreateGameModel(player="Alice", board_size=15), mock_db, mock_redis, None)
+    assert game["board_size"] == 15 and game["win_length"] == 5
+    game = await create(CreateGameModel(player="Bob"), mock_db, mock_redis, game["id"])
+    assert len(game["board"]) == 15 and game["win_length"] == 5
+
+    update_game = await update(UpdateGameModel(turn="Alice", move=[14, 14]), game["id"], mock_db, mock_redis)
+    assert update_game["board"][14][14] == "X"
+    await GameFlusher.get_instance().flush(mock_redis)
+    game_record = await mock_db.get(GameSchema, game["id"])
+    await mock_db.refresh(game_record)
+    assert (game_record.board_size, game_record.win_length) == (15, 5)
+    assert game_record.board[14][14] == "X"
+
+@pytest.mark.anyio
+async def test_flush_keeps_newer_row(mock_db, mock_redis):
+    game = await create(CreateGameModel(player="Alice"), mock_db, mock_redis, None)
+    game = await create(CreateGameModel(player="Bob"), mock_db, mock_redis, game["id"])
+    key = f"GAME_{game['id']}"
+    await update(UpdateGameModel(turn="Alice", move=[0, 0]), game["id"], mock_db, mock_redis)
+    stale_state = await mock_redis.hget(key, "state")
+    await update(UpdateGameModel(turn="Bob", move=[1, 1]), game["id"], mock_db, mock_redis)
+    await GameFlusher.get_instance().flush(mock_redis)
+
+    # a late flush of the first move must not roll the row back
+    await mock_redis.hset(key, "state", stale_state)
+    await GameFlusher.get_instance().flush_games({key: 2}, mock_redis)
+    game_record = await mock_db.get(GameSchema, game["id"])
+    await mock_db.refresh(game_record)
+    assert game_record.seq == 3
+    assert game_record.board[1][1] == "O"
+@pytest.mark.anyio
+async def test_player_stats_reload_from_sql(mock_db, mock_redis):
+    mock_db.add(PlayerSchema(name="Reloaded", wins=4, losses=1, draws=2, games=7))
+    await mock_db.commit()
+    await mock_redis.delete(stats.STATS_LOADED, stats.PLAYER_STATS_PREFIX + "Reloaded")
+
+    assert await stats.sync_player_stats(mock_db, mock_redis) >= 1
+    assert await stats.sync_player_stats(mock_db, mock_redis) == 0
+    player = await stats.get_player_stats("Reloaded", mock_redis)
+    assert (player["wins"], player["games"]) == (4, 7)
+    await mock_db.delete(await mock_db.get(PlayerSchema, "Reloaded"))
+    await mock_db.commit()
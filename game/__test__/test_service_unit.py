@@ -1,24 +1,30 @@
 import pytest
 from unittest.mock import MagicMock, patch
-from sqlalchemy.orm import Session
-from redis import Redis
+from sqlalchemy.ext.asyncio import AsyncSession
+from redis.asyncio import Redis
 from fastapi import HTTPException
-from game.model import GameModel, CreateGameModel, UpdateGameModel
+from game.model import GameModel, CreateGameModel, UpdateGameModel, BatchMoveModel
 from game.schema import GameSchema
-from game.service import create, update
-from game.__test__.test_mock_data import mock_game_schema_dict, mock_game_model_dict, mock_db, mock_redis, mock_create_game_data
+from game.service import create, update, update_many, get_game, spectator_delta, spectator_snapshot, read_game
+from game.cache import GameCache
+from game.lifecycle import GameReaper
+from game import engine
+from game.__test__.test_mock_data import mock_game_schema_dict, mock_game_model_dict, mock_db, mock_redis, mock_create_game_data, anyio_backend, fake_redis, mock_flusher, seed_game, seed_legacy_game
 import os
 import json
+import asyncio
+import random
 
 os.environ["GAME_EXPIRE_TIME"] = "0"
 
 
 
 
+@pytest.mark.anyio
 @patch('game.model.GameModel.model_validate', return_value=GameModel(**{**mock_game_schema_dict, 'player2': None}))
-def test_create_game(mock_db, mock_redis, mock_create_game_data):
+async def test_create_game(mock_game_validate, mock_db, mock_redis, mock_create_game_data):
     
-    result = create(mock_create_game_data, mock_db, mock_redis)
+    result = await create(mock_create_game_data, mock_db, mock_redis)
     assert result['player1'] == mock_game_schema_dict['player1']
     assert result['player2'] == None
     assert result['player1_symbol'] == mock_game_schema_dict['player1_symbol']
@@ -30,16 +36,16 @@ def test_create_game(mock_db, mock_redis, mock_create_game_data):
     mock_db.commit.assert_called_once()
 
 
+@pytest.mark.anyio
 @patch('game.model.GameModel.model_validate', return_value=GameModel(**{**mock_game_schema_dict, 'status': "INIT"}))
-def test_join_game(mock_db, mock_redis, mock_create_game_data):
-    mock_db.filter.return_value.limit.return_value.count.return_value = 1
-    mock_db.query.filter.return_value.limit.return_value.first.return_value = GameModel(**mock_game_schema_dict)
+async def test_join_game(mock_game_validate, mock_db, mock_redis, mock_create_game_data):
+    mock_db.get.return_value = GameModel(**mock_game_schema_dict)
 
     mock_redis.hset.return_value = True
     mock_redis.expire.return_value = True
 
 
-    result = create(mock_create_game_data, mock_db, mock_redis)
+    result = await create(mock_create_game_data, mock_db, mock_redis)
     assert result['player1'] == mock_game_schema_dict['player1']
     assert result['player2'] == mock_game_schema_dict['player2']
     assert result['player1_symbol'] == mock_game_schema_dict['player1_symbol']
@@ -50,29 +56,40 @@ def test_join_game(mock_db, mock_redis, mock_create_game_data):
     assert mock_db.add.call_count == 1
     mock_db.commit.assert_called_once()
 
+@pytest.mark.anyio
+async def test_join_game_with_a_stale_event_log(mock_db, fake_redis):
+    await seed_game(fake_redis, "1", player2=None)
+    # left over from before, its top id is past the join's seq
+    await fake_redis.xadd("GAME_1_EVENTS", {"state": b""}, id="50-0")
+    mock_db.get.return_value = GameSchema(**{**mock_game_schema_dict, "player2": None})
+
+    result = await create(CreateGameModel(player="Bob"), mock_db, fake_redis, "1")
+
+    assert result["player2"] == "Bob" and result["status"] == "INIT"
+    assert (await get_game("1", fake_redis))["player2"] == "Bob"
+
 @pytest.fixture
-def test_exceptions(mock_db, mock_redis, mock_create_game_data):
-    mock_db.filter.return_value.limit.return_value.count.return_value = 0
+async def test_exceptions(mock_db, mock_redis, mock_create_game_data):
+    mock_db.get.return_value = None
 
     with pytest.raises(HTTPException) as excinfo:
-        create(mock_create_game_data, mock_db, mock_redis, game_id="123")
+        await create(mock_create_game_data, mock_db, mock_redis, game_id="123")
 
     assert excinfo.value.status_code == 404
     assert excinfo.value.detail == "Game not found"
 
-    mock_db.filter.return_value.limit.return_value.count.return_value = 1
-    mock_db.filter.return_value.limit.return_value.first.return_value = GameSchema(**{**mock_game_schema_dict, "is_over": True})
+    mock_db.get.return_value = GameSchema(**{**mock_game_schema_dict, "is_over": True})
 
     with pytest.raises(HTTPException) as excinfo:
-        create(mock_create_game_data, mock_db, mock_redis, game_id="123")
+        await create(mock_create_game_data, mock_db, mock_redis, game_id="123")
 
     assert excinfo.value.status_code == 400
     assert excinfo.value.detail == "Game is over"
 
-    mock_db.filter.return_value.limit.return_value.first.return_value = GameSchema(**{**mock_game_schema_dict})
+    mock_db.get.return_value = GameSchema(**{**mock_game_schema_dict})
 
     with pytest.raises(HTTPException) as excinfo:
-        create(mock_create_game_data, mock_db, mock_redis, game_id="123")
+        await create(mock_create_game_data, mock_db, mock_redis, game_id="123")
 
     assert excinfo.value.status_code == 400
     assert excinfo.value.detail == "Game is full"
@@ -80,21 +97,16 @@ def test_exceptions(mock_db, mock_redis, mock_create_game_data):
     mock_redis.hexists.return_value = False
 
     with pytest.raises(HTTPException) as excinfo:
-        create(mock_create_game_data, mock_db, mock_redis, game_id="123")
+        await create(mock_create_game_data, mock_db, mock_redis, game_id="123")
     
     assert excinfo.value.status_code == 404
     assert excinfo.value.detail == "Game has expired"
 
-@patch('game.model.GameModel.model_validate', return_value=GameModel(**{**mock_game_model_dict, 'status': "INIT"}))
-@patch('game.model.UpdateGameModel.model_validate', return_value=UpdateGameModel(**{"turn": mock_game_model_dict['player1'], "move": [0, 1]}))
-def test_update_game(mock_db, mock_redis):
-    mock_db.query.return_value.filter.return_value.first.return_value = GameSchema(**{**mock_game_schema_dict})
+@pytest.mark.anyio
+async def test_update_game(mock_db, fake_redis, mock_flusher):
+    await seed_game(fake_redis, "123", status="INIT")
 
-    mock_redis.hget.return_value.decode.return_value.replace.return_value = json.dumps(mock_game_model_dict)
-    mock_redis.hset.return_value = None
-    mock_redis.expire.return_value = None
-
-    result = update(UpdateGameModel(turn="Alice", move=[0, 1]), "123", mock_db, mock_redis)
+    result = await update(UpdateGameModel(turn="Alice", move=[0, 1]), "123", mock_db, fake_redis)
 
     assert result['player1'] == mock_game_schema_dict['player1']
     assert result['player2'] == mock_game_schema_dict['player2']
@@ -103,156 +115,351 @@ def test_update_game(mock_db, mock_redis):
     assert result['status'] == "IN_PROGRESS"
     assert result['turn'] == mock_game_model_dict['player2']
     assert result['move'] == [0, 1]
+    assert await get_game("123", fake_redis) == result
+    assert await fake_redis.hget("DIRTY_GAMES", "GAME_123") == b"1"
+    assert await fake_redis.zscore("GAME_EXPIRY", "GAME_123") is not None
+    mock_flusher.notify.assert_called_once()
+    mock_flusher.flush_finished.assert_not_called()
+    mock_db.commit.assert_not_called()
 
-@patch('game.model.GameModel.model_validate', return_value=GameModel(**{**mock_game_model_dict, "board":[['X', '', 'X'], ['', '', ''], ['', '', '']]}))
-@patch('game.model.UpdateGameModel.model_validate', return_value=UpdateGameModel(**{"turn": mock_game_model_dict['player1'], "move": [0, 1]}))
-def test_update_game_win_game(mock_db, mock_redis):
-    mock_db.query.return_value.filter.return_value.first.return_value = GameSchema(**mock_game_schema_dict)
-    
-    mock_redis.hget.return_value.decode.return_value.replace.return_value = json.dumps(mock_game_model_dict)
-    mock_redis.hexists.return_value = True
+@pytest.mark.anyio
+async def test_update_game_win_game(mock_db, fake_redis, mock_flusher):
+    await seed_game(fake_redis, "123", board=[['X', '', 'X'], ['', '', ''], ['', '', '']])
 
-    
-    result = update(UpdateGameModel(turn=mock_game_model_dict['player1'], move=[0, 1]), "123", mock_db, mock_redis)
+    result = await update(UpdateGameModel(turn=mock_game_model_dict['player1'], move=[0, 1]), "123", mock_db, fake_redis)
 
     assert result["is_over"] == True
     assert result["winner"] == mock_game_model_dict['player1']
     assert result["is_draw"] == False
     assert result["status"] == "FINISH"
-    assert mock_db.commit.call_count == 1
+    mock_flusher.flush_finished.assert_awaited_once()
+    mock_flusher.notify.assert_not_called()
 
-@patch('game.model.GameModel.model_validate', return_value=GameModel(**{**mock_game_model_dict, "board":[['X', '', 'O'], ['O', 'O', 'X'], ['X', 'X', 'O']]}))
-@patch('game.model.UpdateGameModel.model_validate', return_value=UpdateGameModel(**{"turn": mock_game_model_dict['player1'], "move": [0, 1]}))
-def test_update_game_draw_game(mock_db, mock_redis):
-    mock_db.query.return_value.filter.return_value.first.return_value = GameSchema(**mock_game_schema_dict)
-    
-    mock_redis.hget.return_value.decode.return_value.replace.return_value = json.dumps(mock_game_model_dict)
-    mock_redis.hexists.return_value = True
+@pytest.mark.anyio
+async def test_finished_games_expire_sooner(mock_db, fake_redis, mock_flusher):
+    await seed_game(fake_redis, "123", board=[['X', '', 'X'], ['', '', ''], ['', '', '']])
+    await seed_game(fake_redis, "124", board=[['X', '', 'X'], ['', '', ''], ['', '', '']])
+    with patch("game.service.GameReaper.get_instance", return_value=GameReaper(idle_ttl=600, finished_ttl=5)):
+        await update(UpdateGameModel(turn="Alice", move=[0, 1]), "123", mock_db, fake_redis)
+        await update(UpdateGameModel(turn="Alice", move=[1, 1]), "124", mock_db, fake_redis)
 
-    
-    result = update(UpdateGameModel(turn=mock_game_model_dict['player1'], move=[0, 1]), "123", mock_db, mock_redis)
+    finished = await fake_redis.zscore("GAME_EXPIRY", "GAME_123")
+    idle = await fake_redis.zscore("GAME_EXPIRY", "GAME_124")
+    assert 590_000 <= idle - finished <= 600_000
+
+@pytest.mark.anyio
+async def test_update_game_draw_game(mock_db, fake_redis, mock_flusher):
+    await seed_game(fake_redis, "123", board=[['X', '', 'O'], ['O', 'O', 'X'], ['X', 'X', 'O']])
+
+    result = await update(UpdateGameModel(turn=mock_game_model_dict['player1'], move=[0, 1]), "123", mock_db, fake_redis)
 
     assert result["is_over"] == True
     assert result["winner"] == None
     assert result["is_draw"] == True
     assert result["status"] == "FINISH"
-    assert mock_db.commit.call_count == 1
+    mock_flusher.flush_finished.assert_awaited_once()
+    mock_flusher.notify.assert_not_called()
+
+@pytest.mark.anyio
+async def test_update_game_ai_answers(mock_db, fake_redis, mock_flusher):
+    await seed_game(fake_redis, "123", player2="BOT", mode="AI", difficulty="HARD",
+                    board=[['X', '', ''], ['', 'O', ''], ['', '', '']])
+
+    result = await update(UpdateGameModel(turn="Alice", move=[0, 1]), "123", mock_db, fake_redis)
 
-@patch('game.model.GameModel.model_validate', return_value=GameModel(**{**mock_game_model_dict, 'status': "INIT"}))
-@patch('game.model.UpdateGameModel.model_validate', return_value=UpdateGameModel(**{"turn": mock_game_model_dict['player1'], "move": [0, 1]}))
-def test_update_game_exeptions_1(mock_db, mock_redis):
-    mock_db.query.return_value.filter.return_value.first.return_value = None
+    # the bot blocks the top row before the reply
+    assert result["board"][0] == ['X', 'X', 'O']
+    assert result["turn"] == "Alice"
+    assert result["updated_by"] == "BOT"
+    assert result["move"] == [0, 2]
+    assert await fake_redis.hget("DIRTY_GAMES", "GAME_123") == b"2"
+
+@pytest.mark.anyio
+async def test_update_game_finish_survives_failed_flush(mock_db, fake_redis, mock_flusher):
+    await seed_game(fake_redis, "123", board=[['X', '', 'X'], ['', '', ''], ['', '', '']])
+    mock_flusher.flush_finished.side_effect = ConnectionError("database is down")
+
+    result = await update(UpdateGameModel(turn="Alice", move=[0, 1]), "123", mock_db, fake_redis)
+
+    assert result["status"] == "FINISH"
+    assert await fake_redis.hget("DIRTY_GAMES", "GAME_123") == b"1"
+
+@pytest.mark.anyio
+async def test_update_game_exeptions_1(mock_db, fake_redis):
+    mock_db.get.return_value = None
 
     with pytest.raises(HTTPException) as excinfo:
-        update(UpdateGameModel(turn="Alice", move=[0, 1]), "123", mock_db, mock_redis)
+        await update(UpdateGameModel(turn="Alice", move=[0, 1]), "123", mock_db, fake_redis)
 
     assert excinfo.value.status_code == 404
     assert excinfo.value.detail == "Game not found"
 
-    mock_db.query.return_value.filter.return_value.first.return_value = GameSchema(**mock_game_schema_dict)
-    mock_redis.hexists.return_value = False
+    mock_db.get.return_value = GameSchema(**mock_game_schema_dict)
 
     with pytest.raises(HTTPException) as excinfo:
-        update(UpdateGameModel(turn="Alice", move=[0, 1]), "123", mock_db, mock_redis)
+        await update(UpdateGameModel(turn="Alice", move=[0, 1]), "123", mock_db, fake_redis)
 
     assert excinfo.value.status_code == 404
     assert excinfo.value.detail == "Game has expired"
 
-@patch('game.model.GameModel.model_validate', return_value=None)
-@patch('game.model.UpdateGameModel.model_validate', return_value=UpdateGameModel(**{"turn": mock_game_model_dict['player1'], "move": [0, 1]}))
-def test_update_game_exeptions_2(mock_db, mock_redis):
-    mock_db.query.return_value.filter.return_value.first.return_value = GameSchema(**mock_game_schema_dict)
-    
-    mock_redis.hget.return_value.decode.return_value.replace.return_value = json.dumps(mock_game_model_dict)
-    mock_redis.hexists.return_value = True
-
+@pytest.mark.anyio
+async def test_update_game_exeptions_2(mock_db, fake_redis):
     with pytest.raises(HTTPException) as excinfo:
-        update(UpdateGameModel(turn="Alice", move=[0, 1]), "123", mock_db, mock_redis)
+        await update(UpdateGameModel(turn="Alice", move=[0, 1]), "not-a-game", mock_db, fake_redis)
 
     assert excinfo.value.status_code == 404
     assert excinfo.value.detail == "Game not found"
 
-
-@patch('game.model.GameModel.model_validate', return_value=GameModel(**{**mock_game_model_dict, 'status': "INIT"}))
-@patch('game.model.UpdateGameModel.model_validate', return_value=UpdateGameModel(**{"turn": mock_game_model_dict['player2'], "move": [0, 1]}))
-def test_update_game_exeptions_3(mock_db, mock_redis):
-    mock_db.query.return_value.filter.return_value.first.return_value = GameSchema(**mock_game_schema_dict)
-    
-    mock_redis.hget.return_value.decode.return_value.replace.return_value = json.dumps(mock_game_model_dict)
-    mock_redis.hexists.return_value = True
+@pytest.mark.anyio
+@pytest.mark.parametrize("game, turn, move, status_code, detail", [
+    ({'status': "INIT"}, "Bob", [0, 1], 400, "It's not your turn"),
+    ({'is_over': True}, "Alice", [0, 1], 400, "Game is over"),
+    ({}, "Alice", [0, 1, 2], 400, "Invalid move"),
+    ({}, "Should return invalid turn", [0, 1], 400, "It's not your turn"),
+    ({"board": [['', 'X', ''], ['', '', ''], ['', '', '']]}, "Alice", [0, 1], 400, "Invalid move"),
+    ({}, "Alice", [0, 5], 400, "Invalid move"),
+    ({}, "Alice", ["a", 1], 400, "Invalid move"),
+])
+async def test_update_game_exeptions_3_to_8(mock_db, fake_redis, game, turn, move, status_code, detail):
+    await seed_game(fake_redis, "123", **game)
 
     with pytest.raises(HTTPException) as excinfo:
-        update(UpdateGameModel(turn="Bob", move=[0, 1]), "123", mock_db, mock_redis)
-
-    assert excinfo.value.status_code == 400
-    assert excinfo.value.detail == "It's not your turn"
-
-@patch('game.model.GameModel.model_validate', return_value=GameModel(**{**mock_game_model_dict, 'is_over': True}))
-@patch('game.model.UpdateGameModel.model_validate', return_value=UpdateGameModel(**{"turn": mock_game_model_dict['player1'], "move": [0, 1]}))
-def test_update_game_exeptions_4(mock_db, mock_redis):
-    mock_db.query.return_value.filter.return_value.first.return_value = GameSchema(**mock_game_schema_dict)
-    
-    mock_redis.hget.return_value.decode.return_value.replace.return_value = json.dumps(mock_game_model_dict)
-    mock_redis.hexists.return_value = True
+        await update(UpdateGameModel(turn=turn, move=move), "123", mock_db, fake_redis)
+
+    assert excinfo.value.status_code == status_code
+    assert excinfo.value.detail == detail
+    stored = await get_game("123", fake_redis)
+    assert stored["board"] == {**mock_game_model_dict, **game}["board"]
+    assert stored["turn"] == mock_game_model_dict["turn"]
+
+@pytest.mark.anyio
+async def test_update_game_concurrent_conflicting_moves(mock_db, fake_redis, mock_flusher):
+    await seed_game(fake_redis, "123")
+
+    moves = [UpdateGameModel(turn=player, move=[1, 1]) for player in ("Alice", "Bob") * 10]
+    results = await asyncio.gather(*(update(move, "123", mock_db, fake_redis) for move in moves), return_exceptions=True)
+
+    applied = [result for result in results if isinstance(result, dict)]
+    assert len(applied) == 1
+    assert applied[0]["board"][1][1] == "X"
+    assert all(isinstance(result, HTTPException) for result in results if not isinstance(result, dict))
+    assert mock_flusher.notify.call_count == 1
+
+@pytest.mark.anyio
+async def test_update_many_plays_every_game_in_order(mock_db, fake_redis, mock_flusher):
+    for game_id in ("1", "2"):
+        await seed_game(fake_redis, game_id)
+    await seed_game(fake_redis, "3", player2="BOT", mode="AI", difficulty="HARD",
+                    board=[['X', '', ''], ['', 'O', ''], ['', '', '']])
+    mock_db.scalars.return_value = []
+    moves = [
+        BatchMoveModel(game_id=1, turn="Alice", move=[0, 0]),
+        BatchMoveModel(game_id=2, turn="Alice", move=[0, 0]),
+        # the second move on a game is played after the first
+        BatchMoveModel(game_id=1, turn="Bob", move=[1, 1]),
+        BatchMoveModel(game_id=2, turn="Alice", move=[0, 1]),
+        BatchMoveModel(game_id=3, turn="Alice", move=[0, 1]),
+        BatchMoveModel(game_id=4, turn="Alice", move=[0, 0]),
+        BatchMoveModel(game_id=1, turn="Alice", move=["a", 1]),
+    ]
+
+    results = await update_many(moves, mock_db, fake_redis)
+
+    assert results[0]["move"] == [0, 0] and results[0]["seq"] == 1
+    assert results[2]["board"][1][1] == "O" and results[2]["seq"] == 2
+    assert results[1]["turn"] == "Bob"
+    assert [(result.status_code, result.detail) for result in (results[3], results[5], results[6])] == [
+        (400, "It's not your turn"), (404, "Game not found"), (400, "Invalid move")]
+    # the bot answers in the same batch
+    assert results[4]["board"][0] == ['X', 'X', 'O'] and results[4]["updated_by"] == "BOT"
+    assert await get_game("1", fake_redis) == results[2]
+    mock_flusher.notify.assert_called_once()
+    mock_flusher.flush_finished.assert_not_called()
+
+@pytest.mark.anyio
+async def test_update_many_persists_finished_games_together(mock_db, fake_redis, mock_flusher):
+    for game_id in ("1", "2"):
+        await seed_game(fake_redis, game_id, board=[['X', '', 'X'], ['', '', ''], ['', '', '']])
+
+    results = await update_many([BatchMoveModel(game_id=game_id, turn="Alice", move=[0, 1]) for game_id in (1, 2)], mock_db, fake_redis)
+
+    assert [result["winner"] for result in results] == ["Alice", "Alice"]
+    mock_flusher.flush_finished.assert_awaited_once_with({"GAME_1": 1, "GAME_2": 1}, fake_redis)
+    mock_flusher.notify.assert_not_called()
+
+@pytest.mark.anyio
+async def test_update_many_reports_a_failed_move_on_its_own(mock_db, fake_redis, mock_flusher):
+    await seed_game(fake_redis, "1")
+    # the script errors on a key of the wrong type
+    await fake_redis.set("GAME_2", "not a game")
+
+    results = await update_many([BatchMoveModel(game_id=game_id, turn="Alice", move=[0, 0]) for game_id in (1, 2)], mock_db, fake_redis)
+
+    assert results[0]["move"] == [0, 0] and await get_game("1", fake_redis) == results[0]
+    assert (results[1].status_code, results[1].detail) == (503, "Move could not be saved")
+
+@pytest.mark.anyio
+async def test_update_game_migrates_legacy_json(mock_db, fake_redis, mock_flusher):
+    await seed_legacy_game(fake_redis, "123", status="INIT")
+
+    result = await update(UpdateGameModel(turn="Alice", move=[2, 2]), "123", mock_db, fake_redis)
+
+    assert result["board"][2][2] == "X"
+    assert result["turn"] == mock_game_model_dict["player2"]
+    assert await fake_redis.hexists("GAME_123", "data") == False
+    assert await get_game("123", fake_redis) == result
+
+@pytest.mark.anyio
+async def test_update_game_unknown_state_version(mock_db, fake_redis, mock_flusher):
+    # no legacy blob to migrate from, the state stays unreadable
+    await fake_redis.hset("GAME_123", "state", b"\x7f" + bytes(16))
 
     with pytest.raises(HTTPException) as excinfo:
-        update(UpdateGameModel(turn=mock_game_model_dict['player1'], move=[0, 1]), "123", mock_db, mock_redis)
+        await update(UpdateGameModel(turn="Alice", move=[0, 1]), "123", mock_db, fake_redis)
 
-    assert excinfo.value.status_code == 400
-    assert excinfo.value.detail == "Game is over"
+    assert excinfo.value.status_code == 500
+    assert excinfo.value.detail == "Game state could not be read"
 
-@patch('game.model.GameModel.model_validate', return_value=GameModel(**{**mock_game_model_dict}))
-@patch('game.model.UpdateGameModel.model_validate', return_value=UpdateGameModel(**{"turn": mock_game_model_dict['player1'], "move": [0, 1, 2]}))
-def test_update_game_exeptions_5(mock_db, mock_redis):
-    mock_db.query.return_value.filter.return_value.first.return_value = GameSchema(**mock_game_schema_dict)
-    
-    mock_redis.hget.return_value.decode.return_value.replace.return_value = json.dumps(mock_game_model_dict)
-    mock_redis.hexists.return_value = True
-
-    with pytest.raises(HTTPException) as excinfo:
-        update(UpdateGameModel(turn=mock_game_model_dict['player1'], move=[0, 1, 2]), "123", mock_db, mock_redis)
-
-    assert excinfo.value.status_code == 400
-    assert excinfo.value.detail == "Invalid move"
+@pytest.mark.anyio
+async def test_spectator_snapshot_and_delta(mock_db, fake_redis, mock_flusher):
+    await seed_game(fake_redis, "123", status="INIT")
+    assert await spectator_snapshot("124", fake_redis) is None
+    assert json.loads(await spectator_snapshot("123", fake_redis))["type"] == "snapshot"
 
-@patch('game.model.GameModel.model_validate', return_value=GameModel(**{**mock_game_model_dict}))
-@patch('game.model.UpdateGameModel.model_validate', return_value=UpdateGameModel(**{"turn": "Should return invalid turn", "move": [0, 1]}))
-def test_update_game_exeptions_6(mock_db, mock_redis):
-    mock_db.query.return_value.filter.return_value.first.return_value = GameSchema(**mock_game_schema_dict)
-    
-    mock_redis.hget.return_value.decode.return_value.replace.return_value = json.dumps(mock_game_model_dict)
-    mock_redis.hexists.return_value = True
+    result = await update(UpdateGameModel(turn="Alice", move=[0, 1]), "123", mock_db, fake_redis)
+    delta = spectator_delta(result)
+    assert delta["board"] == ".X......."
+    assert delta["seq"] == 1
+    assert delta["turn"] == "Bob"
+    assert "player1" not in delta
 
+@pytest.fixture
+def game_cache(monkeypatch):
+    cache = GameCache(size=2)
+    monkeypatch.setattr(GameCache, "instance", cache)
+    return cache
+
+@pytest.mark.anyio
+async def test_read_game_revalidates(mock_db, fake_redis, mock_flusher, game_cache):
+    await seed_game(fake_redis, "123", status="INIT")
+    etag, body = await read_game(123, fake_redis)
+    assert etag == '"123.0"' and json.loads(body) == json.loads(json.dumps(await get_game("123", fake_redis)))
+    assert await read_game(123, fake_redis) == (etag, body) and game_cache.hits == 1
+    assert await read_game(123, fake_redis, 'W/"123.0"') == (etag, None)
+
+    result = await update(UpdateGameModel(turn="Alice", move=[0, 1]), "123", mock_db, fake_redis)
+    assert "123" not in game_cache.entries
+    new_etag, body = await read_game(123, fake_redis, etag)
+    assert new_etag == '"123.1"' and json.loads(body)["board"] == result["board"]
+
+@pytest.mark.anyio
+async def test_read_game_never_serves_another_workers_stale_copy(mock_db, fake_redis, mock_flusher, game_cache, monkeypatch):
+    await seed_game(fake_redis, "123", status="INIT")
+    await read_game(123, fake_redis)
+    # the move lands on another worker, this worker's cache is not told
+    monkeypatch.setattr(GameCache, "instance", GameCache())
+    await update(UpdateGameModel(turn="Alice", move=[0, 1]), "123", mock_db, fake_redis)
+    monkeypatch.setattr(GameCache, "instance", game_cache)
+
+    etag, body = await read_game(123, fake_redis)
+    assert etag == '"123.1"' and json.loads(body)["board"][0][1] == "X"
+
+@pytest.mark.anyio
+async def test_read_game_missing_and_legacy(fake_redis, game_cache):
+    await seed_legacy_game(fake_redis, "7", status="INIT")
     with pytest.raises(HTTPException) as excinfo:
-        update(UpdateGameModel(turn="Should return invalid turn", move=[0, 1]), "123", mock_db, mock_redis)
-
-    assert excinfo.value.status_code == 400
-    assert excinfo.value.detail == "It's not your turn"
+        await read_game(8, fake_redis)
+    etag, body = await read_game(7, fake_redis)
 
-@patch('game.model.GameModel.model_validate', return_value=GameModel(**{**mock_game_model_dict, "board":[['', 'X', ''], ['', '', ''], ['', '', '']]}))
-@patch('game.model.UpdateGameModel.model_validate', return_value=UpdateGameModel(**{"turn": mock_game_model_dict['player1'], "move": [0, 1]}))
-def test_update_game_exeptions_7(mock_db, mock_redis):
-    mock_db.query.return_value.filter.return_value.first.return_value = GameSchema(**mock_game_schema_dict)
-    
-    mock_redis.hget.return_value.decode.return_value.replace.return_value = json.dumps(mock_game_model_dict)
-    mock_redis.hexists.return_value = True
+    assert excinfo.value.status_code == 404
+    assert json.loads(body)["player1"] == "Alice" and await read_game(7, fake_redis, etag) == (etag, None)
+
+def test_game_cache_drops_least_recently_read():
+    cache = GameCache(size=2)
+    cache.put(1, 0, b"1")
+    cache.put(2, 0, b"2")
+    cache.get(1, 0)
+    cache.put(3, 0, b"3")
+    assert list(cache.entries) == ["1", "3"] and cache.get(1, 1) is None
+
+def empty_board(size):
+    return [[''] * size for _ in range(size)]
+
+@pytest.mark.anyio
+async def test_update_large_board_five_in_a_row(mock_db, fake_redis, mock_flusher):
+    await seed_game(fake_redis, "123", status="INIT", board=empty_board(15), board_size=15, win_length=5)
+    # Alice builds the anti-diagonal from (4, 10) down to (8, 6), Bob plays along the top row
+    for index in range(4):
+        await update(UpdateGameModel(turn="Alice", move=[4 + index, 10 - index]), "123", mock_db, fake_redis)
+        result = await update(UpdateGameModel(turn="Bob", move=[0, index]), "123", mock_db, fake_redis)
+        assert not result["is_over"]
+
+    result = await update(UpdateGameModel(turn="Alice", move=[8, 6]), "123", mock_db, fake_redis)
+
+    assert result["is_over"] and result["winner"] == "Alice" and result["status"] == "FINISH"
+    assert result["move"] == [8, 6] and result["seq"] == 9
+    assert result["board_size"] == 15 and result["win_length"] == 5
+    assert len(result["board"]) == 15 and result["board"][6][8] == "X"
+    assert await get_game("123", fake_redis) == result
+    mock_flusher.flush_finished.assert_awaited_once()
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("move", [[15, 0], [0, 15], [-1, 3], [2, 2]])
+async def test_update_large_board_invalid_moves(mock_db, fake_redis, move):
+    board = empty_board(15)
+    board[2][2] = 'O'
+    await seed_game(fake_redis, "123", board=board, board_size=15, win_length=5)
 
     with pytest.raises(HTTPException) as excinfo:
-        update(UpdateGameModel(turn=mock_game_model_dict['player1'], move=[0, 1]), "123", mock_db, mock_redis)
+        await update(UpdateGameModel(turn="Alice", move=move), "123", mock_db, fake_redis)
 
-    assert excinfo.value.status_code == 400
     assert excinfo.value.detail == "Invalid move"
-
-@patch('game.model.GameModel.model_validate', return_value=GameModel(**{**mock_game_model_dict}))
-@patch('game.model.UpdateGameModel.model_validate', return_value=UpdateGameModel(**{"turn": mock_game_model_dict['player1'], "move": [0, 5]}))
-def test_update_game_exeptions_8(mock_db, mock_redis):
-    mock_db.query.return_value.filter.return_value.first.return_value = GameSchema(**mock_game_schema_dict)
-    
-    mock_redis.hget.return_value.decode.return_value.replace.return_value = json.dumps(mock_game_model_dict)
-    mock_redis.hexists.return_value = True
-
+    assert (await get_game("123", fake_redis))["board"] == board
+
+@pytest.mark.anyio
+async def test_update_large_board_draw(mock_db, fake_redis, mock_flusher):
+    # X X O O / O O X X / X X O O / O O X X has no four in a row
+    await seed_game(fake_redis, "123", status="INIT", board=empty_board(4), board_size=4, win_length=4)
+    cells = {"Alice": [(0, 0), (0, 1), (1, 2), (1, 3), (2, 0), (2, 1), (3, 2), (3, 3)],
+             "Bob": [(0, 2), (0, 3), (1, 0), (1, 1), (2, 2), (2, 3), (3, 0), (3, 1)]}
+    for index in range(16):
+        player = ("Alice", "Bob")[index % 2]
+        result = await update(UpdateGameModel(turn=player, move=list(cells[player][index // 2])), "123", mock_db, fake_redis)
+        assert result["is_over"] == (index == 15)
+
+    assert result["is_draw"] and result["winner"] is None
+
+@pytest.mark.anyio
+async def test_update_large_boards_agree_with_engine(mock_db, fake_redis, mock_flusher):
+    # random games on random boards, the script and game.engine must call every move the same
+    rng = random.Random(5)
+    for game_id in range(1, 41):
+        size = rng.randint(4, 9)
+        win_length = rng.randint(3, min(size, 5))
+        await seed_game(fake_redis, game_id, id=game_id, status="INIT", board=empty_board(size), board_size=size, win_length=win_length)
+        masks = {"Alice": 0, "Bob": 0}
+        cells = rng.sample(range(size * size), size * size)
+        for index, cell in enumerate(cells):
+            player = ("Alice", "Bob")[index % 2]
+            row, col = divmod(cell, size)
+            masks[player] |= 1 << cell
+            result = await update(UpdateGameModel(turn=player, move=[row, col]), str(game_id), mock_db, fake_redis)
+            won = engine.wins_at(masks[player], size, win_length, row, col)
+            assert result["winner"] == (player if won else None)
+            assert result["is_over"] == (won or index == len(cells) - 1)
+            if result["is_over"]:
+                break
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("data, detail", [
+    ({"board_size": 4, "win_length": 5}, "Win length is longer than the board"),
+    ({"board_size": 15, "mode": "AI"}, "AI games are played on a 3x3 board"),
+])
+async def test_create_rejects_board_settings(mock_db, mock_redis, data, detail):
     with pytest.raises(HTTPException) as excinfo:
-        update(UpdateGameModel(turn=mock_game_model_dict['player1'], move=[0, 5]), "123", mock_db, mock_redis)
+        await create(CreateGameModel(player="Alice", **data), mock_db, mock_redis)
 
     assert excinfo.value.status_code == 400
-    assert excinfo.value.detail == "Invalid move"
\ No newline at end of file
+    assert excinfo.value.detail == detail
+    mock_db.add.assert_not_called()
+
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from game import engine, simulate
+
+def replay(moves, length) -> int:
+    player1 = player2 = 0
+    result = engine.IN_PROGRESS
+    for cell in moves[:length]:
+        assert result == engine.IN_PROGRESS
+        player1, player2, result = engine.play(player1, player2, int(cell))
+    return result
+
+def test_random_games_follow_the_rules():
+    games = simulate.simulate(2000, seed=1)
+    for moves, length, outcome in zip(games["moves"], games["length"], games["outcome"]):
+        assert replay(moves, length) == outcome != engine.IN_PROGRESS
+        assert (moves[length:] == simulate.NO_MOVE).all()
+    # first player wins most random games
+    counts = np.bincount(games["outcome"], minlength=4)
+    assert counts[engine.PLAYER1_WIN] > counts[engine.PLAYER2_WIN] > counts[engine.DRAW]
+
+def test_perfect_players_never_lose():
+    assert (simulate.simulate(500, "HARD", "HARD")["outcome"] == engine.DRAW).all()
+    assert not (simulate.simulate(2000, "RANDOM", "HARD", seed=2)["outcome"] == engine.PLAYER1_WIN).any()
+    assert not (simulate.simulate(2000, "HARD", "RANDOM", seed=3)["outcome"] == engine.PLAYER2_WIN).any()
+
+def test_easy_bot_blunders():
+    outcomes = simulate.simulate(2000, "EASY", "HARD", seed=4)["outcome"]
+    assert (outcomes == engine.PLAYER2_WIN).any()
+    assert not (outcomes == engine.PLAYER1_WIN).any()
+
+def test_run_is_repeatable_across_workers(tmp_path):
+    single = simulate.run(3000, "RANDOM", "MEDIUM", workers=1, chunk_size=1000, seed=9)
+    pooled = simulate.run(3000, "RANDOM", "MEDIUM", workers=2, chunk_size=1000, seed=9)
+    for column in single:
+        assert (single[column] == pooled[column]).all()
+
+    path = tmp_path / "games.npz"
+    simulate.save(path, single, player1="RANDOM", player2="MEDIUM", seed=9)
+    loaded = simulate.load(path)
+    assert (loaded["moves"] == single["moves"]).all() and loaded["moves"].dtype == np.uint8
+    assert str(loaded["player2"]) == "MEDIUM"
+
+def test_engine_play_rejects_invalid_moves():
+    player1, player2, _ = engine.play(0, 0, 4)
+    with pytest.raises(ValueError):
+        engine.play(player1, player2, 4)
+    with pytest.raises(ValueError):
+        engine.play(player1, player2, 9)
+    with pytest.raises(ValueError):
+        engine.play(0b111, 0b11000, 8)
@@ -0,0 +1,61 @@
+import pytest
+from unittest.mock import AsyncMock, patch
+from fastapi import HTTPException
+from game.model import UpdateGameModel
+from game.flusher import GameFlusher
+from game.service import update
+from game import stats, scripts
+from game.__test__.test_mock_data import mock_db, anyio_backend, fake_redis, mock_flusher, seed_game
+
+ALMOST_WON = [['X', '', 'X'], ['O', '', ''], ['O', '', '']]
+
+async def finish(redis, game_id, winning=True, **fields):
+    board = ALMOST_WON if winning else [['X', '', 'O'], ['O', 'O', 'X'], ['X', 'X', 'O']]
+    await seed_game(redis, game_id, board=board, **fields)
+    return await update(UpdateGameModel(turn="Alice", move=[0, 1]), game_id, None, redis)
+
+@pytest.mark.anyio
+async def test_finished_games_are_counted(fake_redis, mock_flusher):
+    await scripts.load_all(fake_redis)
+    await finish(fake_redis, "1")
+    await finish(fake_redis, "2", winning=False)
+
+    alice = await stats.get_player_stats("Alice", fake_redis)
+    bob = await stats.get_player_stats("Bob", fake_redis)
+    assert alice == {"name": "Alice", "rank": 1, "wins": 1, "losses": 0, "draws": 1, "games": 2}
+    assert bob == {"name": "Bob", "rank": 2, "wins": 0, "losses": 1, "draws": 1, "games": 2}
+    assert await fake_redis.hgetall(stats.DIRTY_PLAYERS) == {b"Alice": b"2", b"Bob": b"2"}
+
+@pytest.mark.anyio
+async def test_ai_games_are_not_counted(fake_redis, mock_flusher):
+    await finish(fake_redis, "1", mode="AI", player2="BOT")
+
+    with pytest.raises(HTTPException) as excinfo:
+        await stats.get_player_stats("Alice", fake_redis)
+    assert excinfo.value.status_code == 404
+
+@pytest.mark.anyio
+async def test_leaderboard_pages(fake_redis):
+    await fake_redis.zadd(stats.LEADERBOARD, {"a": 5, "b": 3, "c": 1})
+    await fake_redis.hset(stats.PLAYER_STATS_PREFIX + "b", mapping={"wins": 3, "losses": 2, "games": 5})
+
+    page = await stats.get_leaderboard(1, 1, fake_redis)
+    assert page["total"] == 3
+    assert page["players"] == [{"name": "b", "rank": 2, "wins": 3, "losses": 2, "draws": 0, "games": 5}]
+    assert (await stats.get_leaderboard(3, 10, fake_redis))["players"] == []
+
+@pytest.mark.anyio
+async def test_flush_players_upserts_and_cleans(fake_redis):
+    await fake_redis.hset(stats.PLAYER_STATS_PREFIX + "Alice", mapping={"wins": 2, "games": 3})
+    await fake_redis.hset(stats.DIRTY_PLAYERS, "Alice", 3)
+
+    with patch("game.flusher.AsyncDB.get_instance") as get_db:
+        session = get_db.return_value.SessionLocal.return_value.__aenter__.return_value
+        session.execute, session.commit = AsyncMock(), AsyncMock()
+        get_db.return_value.engine.dialect.name = "sqlite"
+        flushed = await GameFlusher().flush_players(fake_redis)
+
+    assert flushed == 1
+    statement = session.execute.call_args.args[0]
+    assert statement.compile().params["wins_m0"] == 2
+    assert await fake_redis.hlen(stats.DIRTY_PLAYERS) == 0
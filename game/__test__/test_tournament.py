@@ -0,0 +1,165 @@
+import asyncio
+import random
+import time
+import pytest
+from fastapi import HTTPException
+from game import tournament
+from game.flusher import DIRTY_GAMES
+from game.lifecycle import GameReaper
+from game.model import CreateTournamentModel, UpdateGameModel
+from game.service import update
+from game.__test__.test_mock_data import anyio_backend, fake_redis, mock_db, mock_flusher
+from game.__test__.test_websocket_connection_manager import FakeWebSocket, drain
+from websocket_connection_manager import WSConnectionManager
+
+@pytest.fixture
+def manager(monkeypatch):
+    # room for a whole round of results, the default queue coalesces bursts
+    manager = WSConnectionManager(send_queue_size=4096)
+    monkeypatch.setattr(WSConnectionManager, "instance", manager)
+    return manager
+
+async def play_round(matches, db, redis_db, rng):
+    # bots move on random free cells through service.update, like /games/ws does
+    async def play(match):
+        game = {"turn": match["player1"], "is_over": False, "board": [[''] * 3 for _ in range(3)]}
+        while not game["is_over"]:
+            free = [(row, col) for row in range(3) for col in range(3) if not game["board"][row][col]]
+            game = await update(UpdateGameModel(turn=game["turn"], move=list(rng.choice(free))), str(match["game_id"]), db, redis_db)
+    await asyncio.gather(*(play(match) for match in matches if match["game_id"] is not None))
+
+async def run_tournament(players, format, manager, db, redis_db, seed=1) -> tuple:
+    rng = random.Random(seed)
+    follower = FakeWebSocket()
+    created = await tournament.create_tournament(CreateTournamentModel(players=players, format=format), redis_db)
+    await manager.connect(follower, tournament.channel_id(created["id"]))
+    rounds = [[match for match in created["matches"]]]
+    playing, seen = rounds[-1], 0
+    while True:
+        await play_round(playing, db, redis_db, rng)
+        await drain(manager)
+        frames, seen = follower.received[seen:], len(follower.received)
+        # drawn knockout games are played again before the round can end
+        playing = [frame for frame in frames if frame["type"] == "replay"]
+        if playing:
+            continue
+        if frames[-1]["type"] == "finish":
+            break
+        assert frames[-1]["type"] == "round"
+        rounds.append(frames[-1]["matches"])
+        playing = rounds[-1]
+    return await tournament.get_tournament(created["id"], redis_db), rounds, follower.received
+
+def test_knockout_byes_go_to_the_top_seeds():
+    players = [f"p{seed}" for seed in range(6)]
+    pairs = tournament.pairings("SINGLE_ELIMINATION", 1, players, {})
+
+    assert len(pairs) == 4 and tournament.total_rounds("SINGLE_ELIMINATION", 6) == 3
+    assert sorted(player for pair in pairs for player in pair if player) == players
+    assert [player1 or player2 for player1, player2 in pairs if None in (player1, player2)] == ["p0", "p1"]
+    # the top two seeds are on opposite halves
+    assert "p0" in pairs[0] and "p1" in pairs[2] + pairs[3]
+
+def test_round_robin_meets_everyone_once():
+    players = [f"p{seed}" for seed in range(7)]
+    met, first = set(), {player: 0 for player in players}
+    for round in range(1, tournament.total_rounds("ROUND_ROBIN", 7) + 1):
+        for player1, player2 in tournament.pairings("ROUND_ROBIN", round, players, {}):
+            if None in (player1, player2):
+                continue
+            met.add(frozenset((player1, player2)))
+            first[player1] += 1
+    assert len(met) == 7 * 6 // 2
+    # 6 games each, moving first in 2 to 4 of them
+    assert all(2 <= games <= 4 for games in first.values())
+
+@pytest.mark.anyio
+async def test_create_tournament_rejects_bad_fields(fake_redis, manager):
+    with pytest.raises(HTTPException) as duplicate:
+        await tournament.create_tournament(CreateTournamentModel(players=["Alice", "Alice"]), fake_redis)
+    with pytest.raises(HTTPException) as board:
+        await tournament.create_tournament(CreateTournamentModel(players=["Alice", "Bob"], board_size=4, win_length=5), fake_redis)
+    with pytest.raises(HTTPException) as missing:
+        await tournament.get_tournament(99, fake_redis)
+
+    assert duplicate.value.detail == "Players must be unique"
+    assert board.value.detail == "Win length is longer than the board"
+    assert missing.value.status_code == 404
+
+@pytest.mark.anyio
+async def test_round_robin_standings(mock_db, fake_redis, mock_flusher, manager):
+    players = ["Alice", "Bob", "Carol", "Dave", "Erin"]
+    final, rounds, frames = await run_tournament(players, "ROUND_ROBIN", manager, mock_db, fake_redis)
+
+    assert final["status"] == "FINISH" and len(rounds) == 5
+    games = [match for match in final["matches"] if match["game_id"] is not None]
+    assert len(games) == 10 and all(match["winner"] or match["is_draw"] for match in games)
+    # a point a game, shared on a draw
+    assert sum(standing["points"] for standing in final["standings"]) == 10
+    points = [standing["points"] for standing in final["standings"]]
+    assert final["winner"] == (final["standings"][0]["player"] if points[0] > points[1] else None)
+    assert [frame["seq"] for frame in frames] == list(range(2, final["seq"] + 1))
+
+@pytest.mark.anyio
+async def test_knockout_of_128_bots(mock_db, fake_redis, mock_flusher, manager):
+    # 7 rounds of 64 down to 1 games at once, benchmarks.bench_tournament runs 1024
+    players = [f"bot{seed}" for seed in range(128)]
+    final, rounds, frames = await run_tournament(players, "SINGLE_ELIMINATION", manager, mock_db, fake_redis)
+
+    assert [len(matches) for matches in rounds] == [64 >> round for round in range(7)]
+    for previous, matches in zip(rounds, rounds[1:]):
+        winners = [match["winner"] for match in final["matches"] if match["round"] == previous[0]["round"]]
+        assert [player for match in matches for player in (match["player1"], match["player2"])] == winners
+    assert final["winner"] == final["matches"][-1]["winner"] and final["winner"] in players
+    assert frames[-1] == {"type": "finish", "seq": final["seq"], "winner": final["winner"]}
+    assert sum(frame["type"] == "result" for frame in frames) == 127
+    assert not await fake_redis.hlen(tournament.TOURNAMENT_GAMES)
+
+@pytest.mark.anyio
+async def test_knockout_with_byes(mock_db, fake_redis, mock_flusher, manager):
+    players = [f"bot{seed}" for seed in range(6)]
+    final, rounds, _ = await run_tournament(players, "SINGLE_ELIMINATION", manager, mock_db, fake_redis, seed=3)
+
+    assert [match["winner"] for match in rounds[0] if match["game_id"] is None] == ["bot0", "bot1"]
+    assert len([match for match in final["matches"] if match["game_id"] is not None]) == 5
+    assert final["winner"] in players and final["rounds"] == 3
+
+@pytest.mark.anyio
+async def test_drawn_knockout_game_is_replayed_then_goes_to_the_top_seed(mock_db, fake_redis, mock_flusher, manager, monkeypatch):
+    monkeypatch.setattr(tournament, "TOURNAMENT_REPLAYS", 1)
+    follower = FakeWebSocket()
+    created = await tournament.create_tournament(CreateTournamentModel(players=["Alice", "Bob"]), fake_redis)
+    await manager.connect(follower, tournament.channel_id(created["id"]))
+    game_id, turn = created["matches"][0]["game_id"], "Alice"
+    for _ in range(2):
+        # nine moves, ends in a draw
+        for move in ([0, 0], [0, 1], [0, 2], [1, 1], [1, 0], [1, 2], [2, 1], [2, 0], [2, 2]):
+            game = await update(UpdateGameModel(turn=turn, move=move), str(game_id), mock_db, fake_redis)
+            turn = game["turn"]
+        await drain(manager)
+        game_id, turn = follower.received[-1].get("game_id"), "Bob"
+
+    replay, result, finish = follower.received
+    assert (replay["type"], replay["match"], replay["player1"], replay["player2"]) == ("replay", "1:0", "Bob", "Alice")
+    assert (result["type"], result["game_id"], result["winner"], result["is_draw"]) == ("result", replay["game_id"], "Alice", True)
+    assert finish["winner"] == "Alice"
+    final = await tournament.get_tournament(created["id"], fake_redis)
+    assert final["matches"][0]["game_id"] == replay["game_id"] and not await fake_redis.hlen(tournament.TOURNAMENT_GAMES)
+
+@pytest.mark.anyio
+async def test_expired_tournament_game_is_forfeited(mock_db, fake_redis, mock_flusher, manager):
+    follower = FakeWebSocket()
+    created = await tournament.create_tournament(CreateTournamentModel(players=["Alice", "Bob"]), fake_redis)
+    await manager.connect(follower, tournament.channel_id(created["id"]))
+    game_id = created["matches"][0]["game_id"]
+    await update(UpdateGameModel(turn="Alice", move=[0, 0]), str(game_id), mock_db, fake_redis)
+    # SQL has the game, Bob never answers
+    await fake_redis.delete(DIRTY_GAMES)
+
+    assert await GameReaper().reap(fake_redis, now=time.time() + 3600) == 1
+    await drain(manager)
+
+    result, finish = follower.received
+    assert (result["type"], result["winner"], result["forfeit"]) == ("result", "Alice", True)
+    assert finish == {"type": "finish", "seq": result["seq"] + 1, "winner": "Alice"}
+    assert not await fake_redis.hlen(tournament.TOURNAMENT_GAMES)
@@ -0,0 +1,396 @@
+import asyncio
+import json
+import multiprocessing
+import threading
+import time
+import pytest
+from game.__test__.test_mock_data import anyio_backend
+from websocket_connection_manager import WSConnectionManager, RedisBroadcastBackend
+
+fakeredis = pytest.importorskip("fakeredis")
+
+MESSAGES_PER_GAME = 50
+GAMES = ("1", "2")
+
+class FakeWebSocket:
+    def __init__(self):
+        self.received = []
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, message):
+        self.received.append(message)
+
+    async def send_text(self, text):
+        self.received.append(json.loads(text))
+
+    async def close(self, code=1000, reason=None):
+        self.closed = code
+        self.close_reason = reason
+
+class StalledWebSocket(FakeWebSocket):
+    def __init__(self):
+        super().__init__()
+        self.unblock = asyncio.Event()
+
+    async def send_text(self, text):
+        await self.unblock.wait()
+        self.received.append(json.loads(text))
+
+class BinaryWebSocket(FakeWebSocket):
+    async def accept(self, subprotocol=None):
+        self.subprotocol = subprotocol
+
+    async def send_bytes(self, frame):
+        self.received.append(frame)
+
+class StalledBinaryWebSocket(BinaryWebSocket):
+    def __init__(self):
+        super().__init__()
+        self.unblock = asyncio.Event()
+
+    async def send_bytes(self, frame):
+        await self.unblock.wait()
+        self.received.append(frame)
+
+async def drain(manager):
+    while manager.queue_depth():
+        await asyncio.sleep(0)
+    await asyncio.sleep(0)
+
+@pytest.fixture
+def redis_port():
+    server = fakeredis.TcpFakeServer(("127.0.0.1", 0))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server.server_address[1]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def redis_manager(port):
+    import redis.asyncio
+    manager = WSConnectionManager()
+    manager.backend = RedisBroadcastBackend(manager, redis.asyncio.Redis(port=port))
+    return manager
+
+def subscriber_worker(port, ready, results):
+    async def run():
+        manager = redis_manager(port)
+        sockets = {game_id: FakeWebSocket() for game_id in GAMES}
+        for game_id, websocket in sockets.items():
+            await manager.connect(websocket, game_id)
+        ready.set()
+        for _ in range(200):
+            if all(len(websocket.received) == MESSAGES_PER_GAME for websocket in sockets.values()):
+                break
+            await asyncio.sleep(0.05)
+        await manager.stop()
+        await manager.backend.redis.aclose()
+        results.put({game_id: websocket.received for game_id, websocket in sockets.items()})
+    asyncio.run(run())
+
+@pytest.mark.anyio
+async def test_local_broadcast_excludes_sender():
+    manager = WSConnectionManager()
+    sender, receiver = FakeWebSocket(), FakeWebSocket()
+    await manager.connect(sender, "1")
+    await manager.connect(receiver, "1")
+    await manager.broadcast({"message": "hello"}, "1", exclude=[sender])
+    await drain(manager)
+    assert sender.received == []
+    assert receiver.received == [{"message": "hello"}]
+
+@pytest.mark.anyio
+async def test_personal_messages_keep_the_socket_order():
+    manager = WSConnectionManager()
+    stalled = StalledWebSocket()
+    await manager.connect(stalled, "1")
+    await manager.broadcast({"seq": 1}, "1")
+    pong = asyncio.get_running_loop().create_task(manager.send_personal_message({"type": "pong"}, stalled))
+    await asyncio.sleep(0)
+    # returns only once the pong went out, after the move
+    assert not pong.done()
+    stalled.unblock.set()
+    await pong
+    assert stalled.received == [{"seq": 1}, {"type": "pong"}]
+
+@pytest.mark.anyio
+async def test_stalled_consumer_does_not_block_channel():
+    manager = WSConnectionManager(send_queue_size=4, slow_consumer_policy="coalesce")
+    stalled, healthy = StalledWebSocket(), FakeWebSocket()
+    await manager.connect(stalled, "1")
+    await manager.connect(healthy, "1")
+    for seq in range(10):
+        await manager.broadcast({"seq": seq}, "1")
+        await asyncio.sleep(0)
+    assert healthy.received == [{"seq": seq} for seq in range(10)]
+    # first frame is stuck in send_text, the queue keeps the newest four
+    assert manager.dropped_frames == 5
+    stalled.unblock.set()
+    await drain(manager)
+    assert stalled.received == [{"seq": seq} for seq in (0, 6, 7, 8, 9)]
+
+@pytest.mark.anyio
+async def test_drop_policy_disconnects_slow_consumer():
+    manager = WSConnectionManager(send_queue_size=2, slow_consumer_policy="drop")
+    stalled = StalledWebSocket()
+    await manager.connect(stalled, "1")
+    for seq in range(4):
+        await manager.broadcast({"seq": seq}, "1")
+    await asyncio.sleep(0)
+    assert manager.dropped_connections == 1
+    assert "1" not in manager.active_connections
+    assert stalled.closed == 1013
+    assert manager.stats()["connections"] == 0
+
+@pytest.mark.anyio
+async def test_close_channel_closes_its_sockets():
+    manager = WSConnectionManager()
+    sockets = [FakeWebSocket(), FakeWebSocket()]
+    for websocket in sockets:
+        await manager.connect(websocket, "1")
+    other = FakeWebSocket()
+    await manager.connect(other, "2")
+
+    await manager.close_channels(["1", "3"], "Game has expired")
+    await asyncio.sleep(0)
+
+    assert "1" not in manager.active_connections
+    assert [websocket.close_reason for websocket in sockets] == ["Game has expired"] * 2
+    assert manager.stats()["connections"] == 1
+    assert not hasattr(other, "closed")
+
+@pytest.mark.anyio
+async def test_spectators_get_snapshot_then_spectator_frames():
+    manager = WSConnectionManager()
+    player, spectator = FakeWebSocket(), FakeWebSocket()
+    await manager.connect(player, "1")
+
+    async def snapshot():
+        # an event published while the snapshot is read still reaches the spectator
+        await manager.broadcast({"board": "full"}, "1", spectator_message={"seq": 1})
+        return json.dumps({"type": "snapshot", "seq": 0})
+    assert await manager.spectate(spectator, "1", snapshot)
+    await manager.broadcast({"message": "New Player joined game..."}, "1")
+    await drain(manager)
+
+    assert spectator.received == [{"type": "snapshot", "seq": 0}, {"seq": 1}]
+    assert player.received == [{"board": "full"}, {"message": "New Player joined game..."}]
+    assert manager.stats()["connections"] == 1 and manager.spectator_count() == 1
+
+@pytest.mark.anyio
+async def test_slow_spectator_skips_to_the_newest_frame():
+    manager = WSConnectionManager()
+    spectator = StalledWebSocket()
+    spectator.unblock.set()
+    assert await manager.spectate(spectator, "1", lambda: asyncio.sleep(0, json.dumps({"seq": 0})))
+    spectator.unblock.clear()
+    for seq in range(1, 6):
+        await manager.broadcast({}, "1", spectator_message={"seq": seq})
+        await asyncio.sleep(0)
+    spectator.unblock.set()
+    await drain(manager)
+
+    assert spectator.received == [{"seq": 0}, {"seq": 1}, {"seq": 5}]
+    manager.unspectate(spectator, "1")
+    assert manager.feeds == {}
+
+@pytest.mark.anyio
+async def test_replay_goes_first_and_skips_live_frames_it_covers():
+    manager = WSConnectionManager()
+    websocket = FakeWebSocket()
+    await manager.connect(websocket, "1", resume=True)
+    # live moves reach the socket while the missed ones are being read
+    for seq in (3, 4):
+        await manager.broadcast({"seq": seq}, "1")
+    await asyncio.sleep(0)
+    assert websocket.received == []
+    manager.replay(websocket, [{"seq": 2}, {"seq": 3}])
+    await manager.broadcast({"seq": 5}, "1")
+    await drain(manager)
+
+    assert websocket.received == [{"seq": 2}, {"seq": 3}, {"seq": 4}, {"seq": 5}]
+
+@pytest.mark.anyio
+async def test_binary_sockets_share_channels_with_json_ones():
+    from game import wire
+    manager = WSConnectionManager()
+    text, binary = FakeWebSocket(), BinaryWebSocket()
+    await manager.connect(text, "1")
+    await manager.connect(binary, "1", protocol=wire.BINARY)
+    game = {"board": [["X", "", ""], ["", "", ""], ["", "", ""]], "move": [0, 0], "seq": 1, "status": "IN_PROGRESS",
+            "player1": "Alice", "player2": "Bob", "player1_symbol": "X", "player2_symbol": "O", "turn": "Bob",
+            "winner": None, "updated_by": "Alice", "is_over": False, "is_draw": False, "mode": "PVP"}
+    await manager.broadcast(game, "1")
+    await manager.send_personal_message({"error": "Invalid move"}, binary)
+    await drain(manager)
+
+    assert binary.subprotocol == wire.SUBPROTOCOL
+    assert text.received == [game]
+    # the error waits behind the move already queued
+    assert binary.received == [wire.MOVE_FRAME.pack(wire.MOVE, 1, 0, 2 | 2 << 2 | 1 << 6, 0), b"\x03Invalid move"]
+
+@pytest.mark.anyio
+async def test_slow_binary_client_gets_the_latest_state():
+    from game import wire
+    manager = WSConnectionManager(send_queue_size=4, slow_consumer_policy="coalesce")
+    stalled = StalledBinaryWebSocket()
+    await manager.connect(stalled, "1", protocol=wire.BINARY)
+    board, games = [["", "", ""] for _ in range(3)], []
+    for seq, cell in enumerate((0, 1, 2, 4, 3, 5, 7, 6), 1):
+        mover, turn, symbol = ("Alice", "Bob", "X") if seq % 2 else ("Bob", "Alice", "O")
+        board[cell // 3][cell % 3] = symbol
+        games.append({"board": [list(row) for row in board], "move": [cell // 3, cell % 3], "seq": seq, "status": "IN_PROGRESS",
+                      "player1": "Alice", "player2": "Bob", "player1_symbol": "X", "player2_symbol": "O", "turn": turn,
+                      "winner": None, "updated_by": mover, "is_over": False, "is_draw": False, "mode": "PVP"})
+    for game in games:
+        await manager.broadcast(game, "1")
+        await asyncio.sleep(0)
+    stalled.unblock.set()
+    await drain(manager)
+
+    # the first move was being sent, the sixth overflowed moves 2 to 5 into one STATE
+    assert stalled.received == [wire.BINARY.encode_move(games[0]), wire.BINARY.encode_state(games[5]),
+                                wire.BINARY.encode_move(games[6]), wire.BINARY.encode_move(games[7])]
+    assert manager.dropped_frames == 4
+
+class DeadWebSocket(FakeWebSocket):
+    async def send_text(self, text):
+        raise ConnectionResetError()
+
+@pytest.mark.anyio
+async def test_reaper_closes_idle_and_forgets_dead_sockets():
+    manager = WSConnectionManager(idle_timeout=60)
+    dead, idle, busy = DeadWebSocket(), FakeWebSocket(), FakeWebSocket()
+    for websocket in (dead, idle, busy):
+        await manager.connect(websocket, "1")
+    await manager.broadcast({"seq": 1}, "1")
+    await drain(manager)
+    assert manager.reap() == 1 and manager.active_connections["1"] == [idle, busy]
+
+    manager.touch(busy)
+    now = manager.writers[id(busy)].last_active
+    manager.writers[id(idle)].last_active = now - 40
+    assert manager.reap(now + 10) == 0
+    assert manager.reap(now + 30) == 1
+    await asyncio.sleep(0)
+    assert (idle.closed, idle.close_reason) == (1001, "Idle timeout")
+    assert manager.active_connections["1"] == [busy]
+    manager.disconnect(busy, "1")
+    assert manager.active_connections == {} and manager.writers == {}
+
+@pytest.mark.anyio
+async def test_connection_limits_turn_sockets_away():
+    manager = WSConnectionManager(max_connections=2, max_channel_connections=1)
+    first, second, third, spectator = FakeWebSocket(), FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+    assert await manager.connect(first, "1")
+    assert not await manager.connect(second, "1")
+    assert await manager.connect(third, "2")
+    assert not await manager.spectate(spectator, "3", lambda: asyncio.sleep(0, "{}"))
+
+    assert (second.closed, second.close_reason) == (1008, "Too many connections to this game")
+    assert (spectator.closed, spectator.close_reason) == (1013, "Too many connections")
+    # a socket already registered is only held to the per-game limit, and
+    # stays open on its other games when turned away
+    assert await manager.connect(first, "2") is False and manager.stats()["rejected_connections"] == 3
+    assert not hasattr(first, "closed") and manager.active_connections["1"] == [first]
+
+@pytest.mark.anyio
+async def test_churning_connections_keep_memory_flat():
+    import gc, tracemalloc
+    manager = WSConnectionManager(idle_timeout=60, send_queue_size=4, slow_consumer_policy="drop")
+    async def churn(cycle: int):
+        # players who leave, die, stall or go quiet, and spectators
+        sockets = [FakeWebSocket(), DeadWebSocket(), StalledWebSocket(), FakeWebSocket()]
+        for websocket in sockets:
+            await manager.connect(websocket, f"game{cycle % 50}")
+        watcher = FakeWebSocket()
+        await manager.spectate(watcher, f"game{cycle % 50}", lambda: asyncio.sleep(0, '{"seq": 0}'))
+        for seq in range(6):
+            await manager.broadcast({"seq": seq}, f"game{cycle % 50}", spectator_message={"seq": seq})
+        await drain(manager)
+        manager.disconnect(sockets[0], f"game{cycle % 50}")
+        manager.unspectate(watcher, f"game{cycle % 50}")
+        manager.reap(time.monotonic() + 61)
+        await asyncio.sleep(0)
+
+    for cycle in range(200):
+        await churn(cycle)
+    # writers and their tasks form cycles, count only what gc cannot free
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    # benchmarks.bench_ws_soak runs the same churn for 20k cycles
+    for cycle in range(2000):
+        await churn(cycle)
+    gc.collect()
+    grown = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, "filename"))
+    tracemalloc.stop()
+
+    assert manager.active_connections == {} and manager.writers == {} and manager.feeds == {}
+    assert grown < 64 * 1024
+
+@pytest.mark.anyio
+async def test_spectate_missing_game():
+    manager = WSConnectionManager()
+    assert not await manager.spectate(FakeWebSocket(), "1", lambda: asyncio.sleep(0, None))
+    assert manager.feeds == {}
+
+@pytest.mark.anyio
+async def test_spectator_gone_before_the_snapshot_is_unregistered():
+    manager = WSConnectionManager()
+    with pytest.raises(ConnectionResetError):
+        await manager.spectate(DeadWebSocket(), "1", lambda: asyncio.sleep(0, '{"seq": 0}'))
+    assert manager.feeds == {} and manager.spectator_count() == 0
+
+def test_redis_broadcast_many_is_delivered_in_order(redis_port):
+    async def run():
+        manager = redis_manager(redis_port)
+        sockets = {game_id: FakeWebSocket() for game_id in GAMES}
+        for game_id, websocket in sockets.items():
+            await manager.connect(websocket, game_id)
+        await manager.broadcast_many([(game_id, {"game": game_id, "seq": seq}, None) for seq in range(3) for game_id in GAMES])
+        for _ in range(100):
+            if all(len(websocket.received) == 3 for websocket in sockets.values()):
+                break
+            await asyncio.sleep(0.05)
+        await manager.stop()
+        await manager.backend.redis.aclose()
+        return {game_id: websocket.received for game_id, websocket in sockets.items()}
+
+    received = asyncio.run(run())
+    for game_id in GAMES:
+        assert received[game_id] == [{"game": game_id, "seq": seq} for seq in range(3)]
+
+def test_redis_broadcast_reaches_other_processes_in_order(redis_port):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    readies = [context.Event() for _ in range(2)]
+    workers = [context.Process(target=subscriber_worker, args=(redis_port, ready, results)) for ready in readies]
+    for worker in workers:
+        worker.start()
+    for ready in readies:
+        assert ready.wait(20)
+
+    async def publish():
+        manager = redis_manager(redis_port)
+        sender = FakeWebSocket()
+        await manager.connect(sender, GAMES[0])
+        for seq in range(MESSAGES_PER_GAME):
+            for game_id in GAMES:
+                await manager.broadcast({"game": game_id, "seq": seq}, game_id, exclude=[sender])
+        await asyncio.sleep(0.2)
+        await manager.stop()
+        await manager.backend.redis.aclose()
+        return sender.received
+    assert asyncio.run(publish()) == []
+
+    for _ in workers:
+        received = results.get(timeout=20)
+        for game_id in GAMES:
+            assert received[game_id] == [{"game": game_id, "seq": seq} for seq in range(MESSAGES_PER_GAME)]
+    for worker in workers:
+        worker.join(10)
@@ -0,0 +1,44 @@
+import pytest
+from fastapi import HTTPException
+from game import codec, wire
+from game.__test__.test_mock_data import mock_game_model_dict
+
+def game(**fields):
+    return {**mock_game_model_dict, "move": None, "seq": 0, "winner": None, "board_size": 3, "win_length": 3, **fields}
+
+def test_move_frame_carries_the_delta():
+    frame = wire.BINARY.encode(game(board=[["", "", ""], ["", "X", ""], ["", "", ""]], move=[1, 1], seq=7,
+                                    status="IN_PROGRESS", turn="Bob", updated_by="Alice"))
+    kind, seq, cell, flags, bools = wire.MOVE_FRAME.unpack(frame)
+
+    assert len(frame) == 9 and (kind, seq, cell, bools) == (wire.MOVE, 7, 4, 0)
+    assert codec.STATUSES[flags & 3] == "IN_PROGRESS" and flags >> 2 & 3 == 2 and flags >> 6 == 1
+
+def test_state_frame_for_ai_games_and_large_boards():
+    board = [["X", "", ""], ["", "O", ""], ["", "", ""]]
+    frame = wire.BINARY.encode(game(board=board, move=[1, 1], seq=2, mode="AI", status="IN_PROGRESS"))
+    kind, seq, _, _, size, win_length = wire.STATE_FRAME.unpack_from(frame)
+    masks = frame[wire.STATE_FRAME.size:]
+    assert (kind, seq, size, win_length, len(frame)) == (wire.STATE, 2, 3, 3, 13)
+    assert masks == (1).to_bytes(2, "little") + (1 << 4).to_bytes(2, "little")
+
+    large = [[""] * 19 for _ in range(19)]
+    large[18][18] = "X"
+    frame = wire.BINARY.replay_frames([game(board=large, board_size=19, win_length=5, seq=1, move=[18, 18])])[0]
+    assert len(frame) == wire.STATE_FRAME.size + 2 * codec.mask_bytes(19)
+    assert int.from_bytes(frame[wire.STATE_FRAME.size:][:46], "little") == 1 << 360
+
+def test_other_messages_are_notices():
+    assert wire.BINARY.encode("Player disconnected") == b'\x04"Player disconnected"'
+    assert wire.BINARY.encode({"message": "hi"}) == b'\x04{"message":"hi"}'
+
+def test_decode_move():
+    seats = game(board_size=15)
+    assert wire.BINARY.decode_move(wire.CLIENT_MOVE.pack(2, 31), seats) == {"turn": "Bob", "move": [2, 1]}
+    for frame, detail in ((b"\x01", "Invalid move"), (wire.CLIENT_MOVE.pack(3, 0), "Invalid move")):
+        with pytest.raises(HTTPException) as excinfo:
+            wire.BINARY.decode_move(frame, seats)
+        assert excinfo.value.detail == detail
+    with pytest.raises(HTTPException) as excinfo:
+        wire.BINARY.decode_move(wire.CLIENT_MOVE.pack(2, 0), game(player2=None))
+    assert excinfo.value.detail == "It's not your turn"
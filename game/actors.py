@@ -0,0 +1,299 @@
+from fastapi import HTTPException
+from collections import deque
+from datetime import datetime
+from typing import Optional, Tuple
+from redis.asyncio import Redis
+from redis.exceptions import NoScriptError
+from .model import UpdateGameModel
+from .lifecycle import GameReaper
+from . import ai, codec, engine, scripts
+from metrics import Metrics
+from websocket_connection_manager import WSConnectionManager
+import game.service as gameService
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger("uvicorn")
+metrics = Metrics.get_instance()
+
+# Games owned by this worker (game.shards) are played in memory. Each game
+# is an actor holding the codec state Redis would have, moves wait in its
+# mailbox and a single drain task applies them in order, so nothing locks.
+# The actor decides: a move is answered from memory, play_state does what
+# scripts.APPLY_MOVE does to the state, byte for byte. The moves are then
+# replayed through APPLY_MOVE behind the replies, the ones played while a
+# pipeline is out going in the next, which keeps the event log, stats,
+# expiry and the flusher working unchanged. Reads and resumes of a game
+# settle its replays first (GameShards.settle). A replay that fails or does
+# not end on the actor's state (the game changed under it) drops the actor,
+# the next move reloads it, and the game's sockets are sent what Redis
+# holds instead. Finished games wait for their replay and SQL like
+# service.update. Moves answered but not yet replayed are lost if the
+# worker dies.
+
+def play_state(state: bytes, player1: Optional[str], player2: Optional[str], turn: str, row: int, col: int, updated_at: bytes) -> Tuple[str, bytes]:
+    # scripts.APPLY_MOVE on a state, returns (code, new state)
+    if state[0] == codec.VERSION:
+        _, player1_mask, player2_mask, flags, bools, _, seq, _ = codec.STATE.unpack(state)
+        size = win_length = engine.BOARD_SIZE
+    else:
+        _, flags, bools, _, seq, _, size, win_length, moves = codec.LARGE_STATE.unpack_from(state)
+        length = codec.mask_bytes(size)
+        player1_mask = int.from_bytes(state[codec.LARGE_STATE.size:codec.LARGE_STATE.size + length], "little")
+        player2_mask = int.from_bytes(state[codec.LARGE_STATE.size + length:], "little")
+    turn_index = flags >> 2 & 3
+    if (None, player1, player2, None)[turn_index] != turn:
+        return "NOT_YOUR_TURN", state
+    if bools & 1:
+        return "GAME_OVER", state
+    if not (0 <= row < size and 0 <= col < size):
+        return "INVALID_MOVE", state
+    cell = row * size + col
+    if (player1_mask | player2_mask) >> cell & 1:
+        return "INVALID_MOVE", state
+
+    mover = 1 if turn == player1 else 2
+    if mover == 1:
+        player1_mask |= 1 << cell
+        mask = player1_mask
+    else:
+        player2_mask |= 1 << cell
+        mask = player2_mask
+    if state[0] == codec.VERSION:
+        outcome = engine.outcome(player1_mask, player2_mask)
+        won = outcome in (engine.PLAYER1_WIN, engine.PLAYER2_WIN)
+        full = outcome == engine.DRAW
+    else:
+        moves += 1
+        won = engine.wins_at(mask, size, win_length, row, col)
+        full = moves == size * size
+    status, winner, bools = 2, 0, 0
+    if won:
+        status, winner, bools = 3, mover, 1
+    elif full:
+        status, bools = 3, 3
+    else:
+        turn_index = 3 - mover
+    flags = status | turn_index << 2 | winner << 4 | mover << 6
+    timestamp = int.from_bytes(updated_at, "big")
+    if state[0] == codec.VERSION:
+        return "OK", codec.STATE.pack(codec.VERSION, player1_mask, player2_mask, flags, bools, cell, seq + 1, timestamp)
+    return "OK", (codec.LARGE_STATE.pack(codec.LARGE_VERSION, flags, bools, cell, seq + 1, timestamp, size, win_length, moves)
+                  + player1_mask.to_bytes(length, "little") + player2_mask.to_bytes(length, "little"))
+
+class GameActor:
+    __slots__ = ("game_id", "state", "fields", "mailbox", "draining", "replaying", "written", "touched")
+
+    def __init__(self, game_id: str):
+        self.game_id = game_id
+        # None until loaded from Redis by the first move
+        self.state: Optional[bytes] = None
+        # the other HASH_FIELDS as HMGET returned them
+        self.fields: dict = {}
+        self.mailbox = deque()
+        self.draining = False
+        # moves played in memory but not replayed to Redis yet
+        self.replaying = 0
+        # the replay of the last move played
+        self.written: Optional[asyncio.Future] = None
+        self.touched = time.monotonic()
+
+    def idle(self, now: float, ttl: float) -> bool:
+        return not self.mailbox and not self.draining and not self.replaying and now - self.touched > ttl
+
+    def game(self) -> dict:
+        return codec.decode_game(self.game_id, {**self.fields, b"state": self.state})
+
+class GameActors:
+    def __init__(self, idle_ttl: float = 30.0, batch_size: int = 500, redis_db = None):
+        # idle actors are dropped well before the reaper could delete their game
+        self.idle_ttl = idle_ttl
+        self.batch_size = batch_size
+        self.redis = redis_db
+        self.actors: dict[str, GameActor] = {}
+        # (actor, move keys, move args, state it must end on, future of the
+        # APPLY_MOVE reply or its error) in move order
+        self.replays = []
+        self.wake = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.stopping = False
+        self.replayed_moves = 0
+        self.diverged = 0
+        metrics.watch("game_actors", lambda: len(self.actors))
+
+    async def start(self, redis_db = None):
+        self.redis = redis_db or self.redis
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        # not cancelled: a replay cut short would lose its batch, and
+        # wait_for can swallow a cancel that lands as the wake event fires
+        if self.task is not None:
+            self.stopping = True
+            self.wake.set()
+            await self.task
+            self.task = None
+            self.stopping = False
+        while self.replays:
+            await self.replay()
+
+    async def run(self):
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.wake.wait(), 1.0)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            try:
+                # moves played while a pipeline is out go in the next one
+                while self.replays:
+                    await self.replay()
+                self.evict_idle()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Failed to replay game moves: {e}")
+                await asyncio.sleep(1)
+
+    def evict_idle(self, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        for game_id, actor in list(self.actors.items()):
+            if actor.idle(now, self.idle_ttl):
+                del self.actors[game_id]
+
+    def move(self, data: UpdateGameModel, game_id: str, db, redis_db: Redis) -> asyncio.Future:
+        # resolves with the game after the move, like service.update
+        actor = self.actors.get(game_id)
+        if actor is None or actor.idle(time.monotonic(), self.idle_ttl):
+            actor = self.actors[game_id] = GameActor(game_id)
+        reply = asyncio.get_running_loop().create_future()
+        actor.mailbox.append((data, db, redis_db, reply))
+        if not actor.draining:
+            actor.draining = True
+            asyncio.get_running_loop().create_task(self.drain(actor))
+        return reply
+
+    async def drain(self, actor: GameActor):
+        try:
+            while actor.mailbox:
+                data, db, redis_db, reply = actor.mailbox.popleft()
+                try:
+                    game = await self.play(actor, data, db, redis_db)
+                except Exception as e:
+                    if not reply.done():
+                        reply.set_exception(e)
+                    continue
+                # the socket may have gone while the move was played
+                if not reply.done():
+                    reply.set_result(game)
+        finally:
+            actor.draining = False
+
+    async def load(self, actor: GameActor, redis_db: Redis) -> bool:
+        values = await (redis_db or self.redis).hmget(f"GAME_{actor.game_id}", codec.HASH_FIELDS)
+        state = values[0]
+        # expired, legacy and unjoined games take the script path
+        if state is None or state[0] not in (codec.VERSION, codec.LARGE_VERSION) or values[2] is None:
+            return False
+        actor.state = state
+        actor.fields = dict(zip(codec.HASH_FIELDS[1:], values[1:]))
+        return True
+
+    async def play(self, actor: GameActor, data: UpdateGameModel, db, redis_db: Redis) -> dict:
+        # a dropped actor leaves the moves still in its mailbox to the script
+        if self.actors.get(actor.game_id) is not actor or actor.state is None and not await self.load(actor, redis_db):
+            if self.actors.get(actor.game_id) is actor:
+                del self.actors[actor.game_id]
+            return await gameService.update(data, actor.game_id, db, redis_db)
+        actor.touched = time.monotonic()
+        try:
+            row, col = (int(value) for value in data.move) if len(data.move) == 2 else (-1, -1)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid move")
+
+        written = self.apply(actor, data.turn, row, col, redis_db)
+        game = actor.game()
+        if game["mode"] == "AI" and game["turn"] == ai.BOT_PLAYER and not game["is_over"]:
+            row, col = ai.Solver.get_instance().choose_move(*codec.state_masks(actor.state), game["difficulty"])
+            written = self.apply(actor, ai.BOT_PLAYER, row, col, redis_db)
+            game = actor.game()
+
+        if game["is_over"]:
+            # the finished game has to be in Redis before SQL reads it
+            state = actor.state
+            result = await written
+            if self.actors.get(actor.game_id) is actor:
+                del self.actors[actor.game_id]
+            if isinstance(result, Exception):
+                raise HTTPException(status_code=503, detail="Move could not be saved")
+            if result[0] != b"OK":
+                raise await gameService.move_error(result[0].decode("utf-8"), actor.game_id, db)
+            if result[1] != state:
+                game = codec.decode_game(actor.game_id, dict(zip(codec.HASH_FIELDS, result[1:])))
+        await gameService.moved(actor.game_id, game, redis_db)
+        return game
+
+    async def settle(self, game_id: str):
+        # returns once the moves played on the game are in Redis
+        actor = self.actors.get(game_id)
+        if actor is not None and actor.written is not None and not actor.written.done():
+            await asyncio.shield(actor.written)
+
+    async def resync(self, game_id: str, redis_db: Redis):
+        # the game's sockets saw moves Redis does not have, they get what it holds
+        connectionManager = WSConnectionManager.get_instance()
+        try:
+            game = await gameService.get_game(game_id, redis_db)
+            if game is None:
+                await connectionManager.broadcast({"error": "Game has expired"}, game_id)
+            else:
+                await connectionManager.broadcast(game, game_id, spectator_message=gameService.spectator_delta(game))
+        except Exception as e:
+            logger.warning(f"Failed to resync game {game_id}: {e}")
+
+    def apply(self, actor: GameActor, turn: str, row: int, col: int, redis_db: Redis) -> asyncio.Future:
+        updated_at = codec.encode_timestamp(datetime.now().__str__())
+        player1, player2 = (actor.fields.get(key) for key in (b"player1", b"player2"))
+        code, state = play_state(actor.state, player1.decode("utf-8"), player2.decode("utf-8"), turn, row, col, updated_at)
+        if code != "OK":
+            status_code, detail = gameService.MOVE_ERRORS[code]
+            raise HTTPException(status_code=status_code, detail=detail)
+        actor.state = state
+        actor.replaying += 1
+        game_id = actor.game_id
+        move_keys, move_args = gameService.move_script_args(game_id, turn, row, col, updated_at, GameReaper.get_instance().move_deadlines())
+        written = actor.written = asyncio.get_running_loop().create_future()
+        self.replays.append((actor, move_keys, move_args, state, written))
+        self.wake.set()
+        return written
+
+    async def replay(self, redis_db: Redis = None):
+        # one pipeline for the oldest batch_size moves, games keep their order
+        redis_db = redis_db or self.redis
+        batch, self.replays = self.replays[:self.batch_size], self.replays[self.batch_size:]
+        async with redis_db.pipeline(transaction=False) as pipe:
+            for _, move_keys, move_args, _, _ in batch:
+                pipe.evalsha(scripts.APPLY_MOVE.sha, len(move_keys), *move_keys, *move_args)
+            try:
+                results = await pipe.execute(raise_on_error=False)
+            except Exception as e:
+                results = [e] * len(batch)
+        for (actor, move_keys, move_args, state, written), result in zip(batch, results):
+            if isinstance(result, NoScriptError):
+                # Redis lost its scripts, the rest of the batch failed the same way
+                try:
+                    result = await scripts.APPLY_MOVE(redis_db, move_keys, move_args)
+                except Exception as e:
+                    result = e
+            if isinstance(result, Exception) or result[0] != b"OK" or result[1] != state:
+                self.diverged += 1
+                logger.warning(f"Game {actor.game_id} diverged from Redis, reloading it: {result!r:.100}")
+                if self.actors.get(actor.game_id) is actor:
+                    del self.actors[actor.game_id]
+                    asyncio.get_running_loop().create_task(self.resync(actor.game_id, redis_db))
+            actor.replaying -= 1
+            self.replayed_moves += 1
+            if not written.done():
+                written.set_result(result)
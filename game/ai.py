@@ -0,0 +1,179 @@
+from array import array
+from bisect import bisect_left
+from typing import Tuple
+from . import engine
+import random
+
+# Perfect-play opponent. Every reachable position is solved once with minimax
+# and stored by its canonical form under the 8 board symmetries, so the table
+# only holds one entry per equivalence class.
+
+BOT_PLAYER = "BOT"
+
+# chance of playing a suboptimal move when one exists
+DIFFICULTIES = {
+    "EASY": 0.6,
+    "MEDIUM": 0.25,
+    "HARD": 0.0,
+}
+
+CELLS = engine.BOARD_SIZE * engine.BOARD_SIZE
+
+def _symmetries() -> list:
+    # cell permutations: 4 rotations, each optionally mirrored
+    size = engine.BOARD_SIZE
+    permutations = []
+    for mirror in (False, True):
+        for turns in range(4):
+            permutation = []
+            for cell in range(CELLS):
+                row, col = divmod(cell, size)
+                if mirror:
+                    col = size - 1 - col
+                for _ in range(turns):
+                    row, col = col, size - 1 - row
+                permutation.append(row * size + col)
+            permutations.append(permutation)
+    return permutations
+
+SYMMETRIES = _symmetries()
+INVERSES = [[permutation.index(cell) for cell in range(CELLS)] for permutation in SYMMETRIES]
+
+def _mask_table(permutation: list) -> array:
+    table = array('H', bytes(2 * (engine.FULL_BOARD + 1)))
+    for mask in range(engine.FULL_BOARD + 1):
+        for cell in range(CELLS):
+            if mask >> cell & 1:
+                table[mask] |= 1 << permutation[cell]
+    return table
+
+# mask -> transformed mask, one table per symmetry
+TRANSFORMS = [_mask_table(permutation) for permutation in SYMMETRIES]
+
+def canonical(player1: int, player2: int) -> Tuple[int, int]:
+    # smallest key over all symmetries and the symmetry that produces it
+    best_key, best_symmetry = -1, 0
+    for symmetry, transform in enumerate(TRANSFORMS):
+        key = transform[player1] << 9 | transform[player2]
+        if best_key < 0 or key < best_key:
+            best_key, best_symmetry = key, symmetry
+    return best_key, best_symmetry
+
+# Entries pack the score for the player to move with the best cell of the
+# canonical position: (score + 16) << 4 | cell. Scores are 10 - plies for a
+# win, plies - 10 for a loss and 0 for a draw, so faster wins score higher.
+NO_CELL = 15
+ILLEGAL = -128
+
+def _pack(score: int, cell: int) -> int:
+    return (score + 16) << 4 | cell
+
+def _score(entry: int) -> int:
+    return (entry >> 4) - 16
+
+def _parent_score(score: int) -> int:
+    # child score is for the opponent, one ply further away
+    if score > 0:
+        return -score + 1
+    if score < 0:
+        return -score - 1
+    return 0
+
+def _solve() -> Tuple[array, array]:
+    entries = {}
+
+    def solve(player1: int, player2: int) -> int:
+        key, symmetry = canonical(player1, player2)
+        if key in entries:
+            return entries[key]
+        player1, player2 = key >> 9, key & engine.FULL_BOARD
+        result = engine.outcome(player1, player2)
+        if result == engine.DRAW:
+            entry = _pack(0, NO_CELL)
+        elif result != engine.IN_PROGRESS:
+            # the previous move won
+            entry = _pack(-10, NO_CELL)
+        else:
+            player1_moves = bin(player1).count("1") == bin(player2).count("1")
+            best_score, best_cell = -99, NO_CELL
+            for cell in range(CELLS):
+                bit = 1 << cell
+                if (player1 | player2) & bit:
+                    continue
+                child = solve(player1 | bit, player2) if player1_moves else solve(player1, player2 | bit)
+                score = _parent_score(_score(child))
+                if score > best_score:
+                    best_score, best_cell = score, cell
+            entry = _pack(best_score, best_cell)
+        entries[key] = entry
+        return entry
+
+    solve(0, 0)
+    keys = sorted(entries)
+    return array('L', keys), array('H', (entries[key] for key in keys))
+
+class Solver:
+    instance = None
+    def __init__(self):
+        self.keys, self.entries = _solve()
+
+    def lookup(self, player1: int, player2: int) -> Tuple[int, int]:
+        # (entry, symmetry) of a reachable position
+        key, symmetry = canonical(player1, player2)
+        return self.entries[bisect_left(self.keys, key)], symmetry
+
+    def best_cell(self, player1: int, player2: int) -> int:
+        entry, symmetry = self.lookup(player1, player2)
+        cell = entry & 15
+        return NO_CELL if cell == NO_CELL else INVERSES[symmetry][cell]
+
+    def scored_moves(self, player1: int, player2: int) -> list:
+        # (score for the player to move, cell) of every free cell
+        player1_moves = bin(player1).count("1") == bin(player2).count("1")
+        moves = []
+        for cell in range(CELLS):
+            bit = 1 << cell
+            if (player1 | player2) & bit:
+                continue
+            child = self.lookup(player1 | bit, player2) if player1_moves else self.lookup(player1, player2 | bit)
+            moves.append((_parent_score(_score(child[0])), cell))
+        return moves
+
+    def choose_move(self, player1: int, player2: int, difficulty: str = "HARD", rng = random) -> Tuple[int, int]:
+        mistake = DIFFICULTIES.get(difficulty, 0.0)
+        if mistake and rng.random() < mistake:
+            moves = self.scored_moves(player1, player2)
+            best = max(score for score, _ in moves)
+            worse = [cell for score, cell in moves if score < best]
+            if worse:
+                return divmod(rng.choice(worse), engine.BOARD_SIZE)
+        return divmod(self.best_cell(player1, player2), engine.BOARD_SIZE)
+
+    def score_table(self) -> array:
+        # scored_moves of every reachable position, flattened: entry
+        # (player1 << 9 | player2) * 9 + cell, ILLEGAL where the cell is taken
+        # or the game is over. Lets game.simulate look up a whole batch at once
+        table = array('b', [ILLEGAL]) * (CELLS << 18)
+        seen = set()
+        stack = [(0, 0)]
+        while stack:
+            player1, player2 = stack.pop()
+            key = player1 << 9 | player2
+            if key in seen or engine.outcome(player1, player2) != engine.IN_PROGRESS:
+                continue
+            seen.add(key)
+            player1_moves = bin(player1).count("1") == bin(player2).count("1")
+            for score, cell in self.scored_moves(player1, player2):
+                table[key * CELLS + cell] = score
+                stack.append((player1 | 1 << cell, player2) if player1_moves else (player1, player2 | 1 << cell))
+        return table
+
+    def memory(self) -> int:
+        return (self.keys.itemsize * len(self.keys) + self.entries.itemsize * len(self.entries)
+                + sum(transform.itemsize * len(transform) for transform in TRANSFORMS))
+
+    @staticmethod
+    def get_instance():
+        if Solver.instance is None:
+            Solver.instance = Solver()
+        return Solver.instance
@@ -0,0 +1,40 @@
+from collections import OrderedDict
+from typing import Optional
+import os
+
+# Serialized games for GET /games/{game_id}, least recently read dropped
+# first. Entries carry the state seq they were built from: a read checks the
+# seq in Redis first, so a move on another worker is never served stale,
+# and service.moved drops the entry on this worker's moves.
+
+class GameCache:
+    instance = None
+    def __init__(self, size: int = 1024):
+        self.size = size
+        self.entries: OrderedDict[str, tuple] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, game_id, seq: int) -> Optional[bytes]:
+        entry = self.entries.get(str(game_id))
+        if entry is None or entry[0] != seq:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(str(game_id))
+        self.hits += 1
+        return entry[1]
+
+    def put(self, game_id, seq: int, body: bytes):
+        self.entries[str(game_id)] = (seq, body)
+        self.entries.move_to_end(str(game_id))
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, game_id):
+        self.entries.pop(str(game_id), None)
+
+    @staticmethod
+    def get_instance():
+        if GameCache.instance is None:
+            GameCache.instance = GameCache(int(os.getenv("GAME_CACHE_SIZE", "1024")))
+        return GameCache.instance
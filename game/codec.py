@@ -0,0 +1,151 @@
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from . import engine
+import json
+import struct
+
+# Redis layout of a game hash GAME_{id}:
+#   state           packed hot fields, rewritten on every move (STATE below)
+#   player1/player2 names, absent until set
+#   player1_symbol, player2_symbol, created_by, created_at, mode, difficulty
+# Games written before the codec keep a single JSON "data" field until migrated.
+
+VERSION = 1
+
+# version, player1 mask, player2 mask, status | turn | winner | updated_by
+# (2 bits each), is_over | is_draw, last move cell, seq, updated_at (us)
+STATE = struct.Struct(">BHHBBBIQ")
+
+# Boards other than 3x3 three-in-a-row: version, status | turn | winner |
+# updated_by, is_over | is_draw, last move cell, seq, updated_at (us), board
+# size, win length, stones played, then the player1 and player2 bitsets,
+# mask_bytes(size) little endian bytes each (113 bytes in all at 19x19)
+LARGE_VERSION = 2
+LARGE_STATE = struct.Struct(">BBBHIQBBH")
+NO_LARGE_MOVE = 0xFFFF
+
+STATUSES = ("CREATE", "INIT", "IN_PROGRESS", "FINISH")
+NO_MOVE = 255
+COLD_FIELDS = ("player1", "player2", "player1_symbol", "player2_symbol", "created_by", "created_at", "mode", "difficulty")
+_COLD_KEYS = tuple((field, field.encode()) for field in COLD_FIELDS)
+# everything decode_game reads, in HMGET order
+HASH_FIELDS = (b"state",) + tuple(key for _, key in _COLD_KEYS)
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+class CodecError(ValueError):
+    pass
+
+def _player_index(game: dict, name: Optional[str]) -> int:
+    if name is None:
+        return 0
+    if name == game.get("player1"):
+        return 1
+    if name == game.get("player2"):
+        return 2
+    return 0
+
+def _timestamp(value: Optional[str]) -> int:
+    if not value:
+        return 0
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return (moment - _EPOCH) // _MICROSECOND
+
+def _datetime(value: int) -> Optional[str]:
+    if not value:
+        return None
+    return (_EPOCH + value * _MICROSECOND).__str__()
+
+def encode_timestamp(value: Optional[str]) -> bytes:
+    return _timestamp(value).to_bytes(8, "big")
+
+def mask_bytes(size: int) -> int:
+    return (size * size + 7) // 8
+
+def encode_flags(game: dict) -> tuple:
+    # (status | turn | winner | updated_by, is_over | is_draw) as the state packs them
+    flags = (STATUSES.index(game["status"])
+             | _player_index(game, game.get("turn")) << 2
+             | _player_index(game, game.get("winner")) << 4
+             | _player_index(game, game.get("updated_by")) << 6)
+    return flags, int(bool(game.get("is_over"))) | int(bool(game.get("is_draw"))) << 1
+
+def encode_state(game: dict, seq: int = 0) -> bytes:
+    size = game.get("board_size") or engine.BOARD_SIZE
+    win_length = game.get("win_length") or engine.BOARD_SIZE
+    player1_mask, player2_mask = engine.board_to_masks(game.get("board") or (), game.get("player1_symbol"), game.get("player2_symbol"))
+    flags, bools = encode_flags(game)
+    move = game.get("move")
+    if size == win_length == engine.BOARD_SIZE:
+        cell = engine.cell_index(move[0], move[1]) if move else NO_MOVE
+        return STATE.pack(VERSION, player1_mask, player2_mask, flags, bools, cell, seq, _timestamp(game.get("updated_at")))
+    cell = engine.cell_index(move[0], move[1], size) if move else NO_LARGE_MOVE
+    length = mask_bytes(size)
+    return (LARGE_STATE.pack(LARGE_VERSION, flags, bools, cell, seq, _timestamp(game.get("updated_at")),
+                             size, win_length, bin(player1_mask | player2_mask).count("1"))
+            + player1_mask.to_bytes(length, "little") + player2_mask.to_bytes(length, "little"))
+
+def encode_game(game: dict, seq: int = 0) -> dict:
+    fields = {"state": encode_state(game, seq)}
+    for field in COLD_FIELDS:
+        if game.get(field) is not None:
+            fields[field] = game[field]
+    return fields
+
+def state_seq(state: bytes) -> int:
+    if state[0] == LARGE_VERSION:
+        return LARGE_STATE.unpack_from(state)[4]
+    return STATE.unpack(state)[6]
+
+def state_masks(state: bytes) -> tuple:
+    return STATE.unpack(state)[1:3]
+
+def decode_game(game_id, fields: dict) -> dict:
+    state = fields.get(b"state")
+    if state is None or state[0] not in (VERSION, LARGE_VERSION):
+        raise CodecError(f"Unsupported game state for game {game_id}")
+    if state[0] == VERSION:
+        _, player1_mask, player2_mask, flags, bools, cell, seq, updated_at = STATE.unpack(state)
+        size = win_length = engine.BOARD_SIZE
+        move = None if cell == NO_MOVE else [cell // size, cell % size]
+    else:
+        _, flags, bools, cell, seq, updated_at, size, win_length, _ = LARGE_STATE.unpack_from(state)
+        length = mask_bytes(size)
+        player1_mask = int.from_bytes(state[LARGE_STATE.size:LARGE_STATE.size + length], "little")
+        player2_mask = int.from_bytes(state[LARGE_STATE.size + length:], "little")
+        move = None if cell == NO_LARGE_MOVE else [cell // size, cell % size]
+    cold = {}
+    for field, key in _COLD_KEYS:
+        value = fields.get(key)
+        cold[field] = value.decode("utf-8") if value is not None else None
+    names = (None, cold["player1"], cold["player2"], None)
+    return {
+        "id": int(game_id),
+        "board": engine.masks_to_board(player1_mask, player2_mask, cold["player1_symbol"], cold["player2_symbol"], size),
+        "winner": names[flags >> 4 & 3],
+        "is_draw": bool(bools & 2),
+        "is_over": bool(bools & 1),
+        "player1": cold["player1"],
+        "player2": cold["player2"],
+        "player2_symbol": cold["player2_symbol"],
+        "player1_symbol": cold["player1_symbol"],
+        "move": move,
+        "turn": names[flags >> 2 & 3],
+        "status": STATUSES[flags & 3],
+        "created_by": cold["created_by"],
+        "updated_by": names[flags >> 6 & 3],
+        "created_at": cold["created_at"],
+        "updated_at": _datetime(updated_at),
+        "mode": cold["mode"],
+        "difficulty": cold["difficulty"],
+        "seq": seq,
+        "board_size": size,
+        "win_length": win_length,
+    }
+
+def from_legacy(data: bytes) -> dict:
+    # JSON "data" blob written by GameModel.model_dump() before the codec existed
+    return encode_game(json.loads(data.decode("utf-8").replace("'", '"')))
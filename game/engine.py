@@ -0,0 +1,106 @@
+from typing import Iterable, Tuple
+
+# Bitboard tic-tac-toe rules. Cell (row, col) is bit row * 3 + col and each
+# player's position is a 9 bit mask, player1 in the high half of a table index.
+
+BOARD_SIZE = 3
+FULL_BOARD = 0b111111111
+
+IN_PROGRESS = 0
+PLAYER1_WIN = 1
+PLAYER2_WIN = 2
+DRAW = 3
+INVALID = 255
+
+WIN_LINES = (
+    0b000000111, 0b000111000, 0b111000000,  # rows
+    0b001001001, 0b010010010, 0b100100100,  # columns
+    0b100010001, 0b001010100,               # diagonals
+)
+
+# Larger k-in-a-row boards, up to 19x19, keep each player's stones in a
+# plain int bitset laid out the same way (bit row * size + col). A move can
+# only complete a line through its own cell, so wins are checked around the
+# last move, at most k - 1 cells each way in the 4 directions.
+MAX_BOARD_SIZE = 19
+DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+def cell_index(row: int, col: int, size: int = BOARD_SIZE) -> int:
+    return row * size + col
+
+def cell_bit(row: int, col: int) -> int:
+    return 1 << cell_index(row, col)
+
+def has_line(mask: int) -> bool:
+    for line in WIN_LINES:
+        if mask & line == line:
+            return True
+    return False
+
+def wins_at(mask: int, size: int, win_length: int, row: int, col: int) -> bool:
+    # mask has a stone on (row, col), is it part of win_length in a row
+    for d_row, d_col in DIRECTIONS:
+        count = 1
+        for sign in (-1, 1):
+            r, c = row + sign * d_row, col + sign * d_col
+            while count < win_length and 0 <= r < size and 0 <= c < size and mask >> (r * size + c) & 1:
+                count += 1
+                r, c = r + sign * d_row, c + sign * d_col
+        if count >= win_length:
+            return True
+    return False
+
+def _build_outcome_table() -> bytearray:
+    # one byte per (player1, player2) mask pair, every non-overlapping pair is
+    # filled so any stored board (reachable or not) resolves without a scan
+    table = bytearray([INVALID]) * (1 << 18)
+    for player1 in range(FULL_BOARD + 1):
+        free = FULL_BOARD & ~player1
+        player2 = free
+        while True:
+            if has_line(player1):
+                outcome = PLAYER1_WIN
+            elif has_line(player2):
+                outcome = PLAYER2_WIN
+            elif player1 | player2 == FULL_BOARD:
+                outcome = DRAW
+            else:
+                outcome = IN_PROGRESS
+            table[(player1 << 9) | player2] = outcome
+            if player2 == 0:
+                break
+            player2 = (player2 - 1) & free
+    return table
+
+OUTCOMES = _build_outcome_table()
+
+def outcome(player1: int, player2: int) -> int:
+    return OUTCOMES[(player1 << 9) | player2]
+
+def play(player1: int, player2: int, cell: int) -> Tuple[int, int, int]:
+    # one 3x3 move for whoever is to move (player1 starts), no I/O, so the
+    # batch simulator and tests can drive it directly
+    if not 0 <= cell < 9 or (player1 | player2) >> cell & 1 or outcome(player1, player2) != IN_PROGRESS:
+        raise ValueError("Invalid move")
+    if bin(player1).count("1") == bin(player2).count("1"):
+        player1 |= 1 << cell
+    else:
+        player2 |= 1 << cell
+    return player1, player2, outcome(player1, player2)
+
+def board_to_masks(board: Iterable[Iterable[str]], player1_symbol: str, player2_symbol: str) -> Tuple[int, int]:
+    player1 = player2 = 0
+    bit = 1
+    for row in board:
+        for value in row:
+            if value == player1_symbol:
+                player1 |= bit
+            elif value == player2_symbol:
+                player2 |= bit
+            bit <<= 1
+    return player1, player2
+
+def masks_to_board(player1: int, player2: int, player1_symbol: str, player2_symbol: str, size: int = BOARD_SIZE) -> list:
+    cells = [player1_symbol if player1 >> index & 1 else player2_symbol if player2 >> index & 1 else ''
+             for index in range(size * size)]
+    return [cells[row:row + size] for row in range(0, size * size, size)]
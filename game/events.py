@@ -0,0 +1,30 @@
+from redis.asyncio import Redis
+from . import codec
+import os
+
+# Every change of a game's state is appended to a capped Redis stream, with
+# the state seq as the entry id ({seq}-0) and the 20 byte codec state as the
+# entry. scripts.APPLY_MOVE appends moves, service.create appends the join.
+# A reconnecting client sends the last seq it saw and gets the entries after
+# it, or just the current game once the log no longer reaches back that far.
+EVENTS_SUFFIX = "_EVENTS"
+EVENT_LOG_SIZE = int(os.getenv("GAME_EVENT_LOG_SIZE", "64"))
+
+def events_key(game_id) -> str:
+    return f"GAME_{game_id}{EVENTS_SUFFIX}"
+
+async def missed_events(game_id, last_seq: int, redis_db: Redis) -> list:
+    async with redis_db.pipeline(transaction=False) as pipe:
+        pipe.hgetall(f"GAME_{game_id}")
+        pipe.xrange(events_key(game_id), f"{last_seq + 1}-0", "+", count=EVENT_LOG_SIZE)
+        fields, entries = await pipe.execute()
+    if b"state" not in fields:
+        return []
+    current_seq = codec.state_seq(fields[b"state"])
+    if last_seq >= current_seq:
+        return []
+    first_seq = int(entries[0][0].split(b"-")[0]) if entries else None
+    if first_seq != last_seq + 1 or len(entries) != current_seq - last_seq:
+        # too far behind, a snapshot instead
+        return [codec.decode_game(game_id, fields)]
+    return [codec.decode_game(game_id, {**fields, b"state": entry[b"state"]}) for _, entry in entries]
@@ -0,0 +1,207 @@
+from sqlalchemy import func
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from typing import Optional
+from redis_database import AsyncRedisDB
+from database import AsyncDB
+from .schema import GameSchema, PlayerSchema
+from . import codec, scripts, stats
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger("uvicorn")
+
+# Redis is the authoritative store for live games. The move script records
+# GAME_{id} -> seq in this hash and the flusher copies those games to SQL in
+# batches, dropping an entry only if no newer move marked it again. Anything
+# left here after a crash is replayed on the next startup.
+DIRTY_GAMES = "DIRTY_GAMES"
+
+def upsert_rows(table, version: str, dialect: str, rows: list):
+    # a slow flush of an older snapshot must not overwrite a newer row
+    keys = [column.name for column in table.primary_key.columns]
+    columns = [column for column in table.columns.keys() if column not in keys]
+    stored_version = func.coalesce(table.c[version], 0)
+    if dialect == "mysql":
+        statement = mysql.insert(table).values(rows)
+        newer = statement.inserted[version] >= stored_version
+        # assignments apply left to right, the version goes last so every column compares against the old one
+        columns.sort(key=lambda column: column == version)
+        return statement.on_duplicate_key_update([
+            (column, func.if_(newer, statement.inserted[column], table.c[column])) for column in columns
+        ])
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    statement = insert(table).values(rows)
+    return statement.on_conflict_do_update(
+        index_elements=[table.c[key] for key in keys],
+        set_={column: statement.excluded[column] for column in columns},
+        where=statement.excluded[version] >= stored_version,
+    )
+
+def upsert_games(dialect: str, rows: list):
+    return upsert_rows(GameSchema.__table__, "seq", dialect, rows)
+
+def upsert_players(dialect: str, rows: list):
+    return upsert_rows(PlayerSchema.__table__, "games", dialect, rows)
+
+def game_row(game_id: int, fields: list) -> Optional[dict]:
+    if fields[0] is None:
+        return None
+    game = codec.decode_game(game_id, dict(zip(codec.HASH_FIELDS, fields)))
+    row = {column: game.get(column) for column in GameSchema.__table__.columns.keys()}
+    row["seq"] = codec.state_seq(fields[0])
+    return row
+
+class GameFlusher:
+    instance = None
+    def __init__(self, interval: float = 1.0, batch_size: int = 500, redis_db = None):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.redis = redis_db
+        self.pending = 0
+        self.waiters = []
+        self.wake = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.commits = 0
+        self.flushed_games = 0
+        self.flushed_players = 0
+
+    async def start(self, redis_db = None):
+        self.redis = redis_db or self.redis or AsyncRedisDB.get_db()
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.redis is not None:
+            await self.flush_round()
+
+    def notify(self, count: int = 1):
+        # one more dirty move, flush early once a batch is ready
+        self.pending += count
+        if self.pending >= self.batch_size:
+            self.wake.set()
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            await self.flush_round()
+
+    async def flush_round(self):
+        waiters, self.waiters = self.waiters, []
+        try:
+            await self.flush()
+        except asyncio.CancelledError:
+            self.waiters[:0] = waiters
+            raise
+        except Exception as e:
+            logger.warning(f"Failed to flush games: {e}")
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+            return
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def flush_finished(self, dirty: dict, redis_db = None):
+        # waits for the next round so games finishing together share a commit,
+        # without a running flusher the game is written on its own
+        if self.task is None:
+            await self.flush_games(dirty, redis_db)
+            await self.flush_players(redis_db)
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self.wake.set()
+        await waiter
+
+    async def flush(self, redis_db = None) -> int:
+        # drains every dirty game, batch_size games per commit
+        redis_db = redis_db or self.redis
+        self.pending = 0
+        flushed = 0
+        cursor = 0
+        while True:
+            cursor, dirty = await redis_db.hscan(DIRTY_GAMES, cursor, count=self.batch_size)
+            items = list(dirty.items())
+            for start in range(0, len(items), self.batch_size):
+                flushed += await self.flush_games(dict(items[start:start + self.batch_size]), redis_db)
+            if cursor == 0:
+                break
+        await self.flush_players(redis_db)
+        return flushed
+
+    async def flush_players(self, redis_db = None) -> int:
+        # player counters, same compare and delete as games
+        redis_db = redis_db or self.redis
+        flushed = 0
+        cursor = 0
+        while True:
+            cursor, dirty = await redis_db.hscan(stats.DIRTY_PLAYERS, cursor, count=self.batch_size)
+            names = list(dirty)
+            if names:
+                async with redis_db.pipeline(transaction=False) as pipe:
+                    for name in names:
+                        pipe.hmget(stats.PLAYER_STATS_PREFIX.encode() + name, stats.STAT_FIELDS)
+                    values = await pipe.execute()
+                rows = [stats.player_stats(name.decode("utf-8"), fields) for name, fields in zip(names, values)]
+                for row in rows:
+                    del row["rank"]
+                db = AsyncDB.get_instance()
+                async with db.SessionLocal() as session:
+                    await session.execute(upsert_players(db.engine.dialect.name, rows))
+                    await session.commit()
+                self.commits += 1
+                self.flushed_players += len(rows)
+                flushed += len(rows)
+                await scripts.CLEAN_DIRTY(redis_db, [stats.DIRTY_PLAYERS], [value for item in dirty.items() for value in item])
+            if cursor == 0:
+                return flushed
+
+    async def flush_games(self, dirty: dict, redis_db = None) -> int:
+        # dirty maps game keys to the seq they were marked with
+        redis_db = redis_db or self.redis
+        keys = list(dirty)
+        async with redis_db.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.hmget(key, codec.HASH_FIELDS)
+            states = await pipe.execute()
+
+        rows = []
+        for key, fields in zip(keys, states):
+            game_id = (key.decode("utf-8") if isinstance(key, bytes) else key)[len("GAME_"):]
+            # expired games have nothing left to flush
+            row = game_row(game_id, fields)
+            if row is not None:
+                rows.append(row)
+
+        if rows:
+            db = AsyncDB.get_instance()
+            async with db.SessionLocal() as session:
+                await session.execute(upsert_games(db.engine.dialect.name, rows))
+                await session.commit()
+            self.commits += 1
+            self.flushed_games += len(rows)
+
+        await scripts.CLEAN_DIRTY(redis_db, [DIRTY_GAMES], [value for item in dirty.items() for value in item])
+        return len(rows)
+
+    @staticmethod
+    def get_instance():
+        if GameFlusher.instance is None:
+            GameFlusher.instance = GameFlusher(
+                float(os.getenv("FLUSH_INTERVAL", "1.0")),
+                int(os.getenv("FLUSH_BATCH_SIZE", "500")),
+            )
+        return GameFlusher.instance
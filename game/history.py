@@ -0,0 +1,87 @@
+from sqlalchemy import select, or_, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime
+from typing import AsyncIterator, Optional
+from database import AsyncDB
+from .schema import GameSchema
+import csv
+import io
+import orjson
+
+# Past games are read from SQL, which the flusher keeps a second or so
+# behind Redis. Pages are keyset paginated on id, newest first: a page asks
+# for ids below the last one it saw, so deep pages cost the same as the
+# first. Exports walk the matching rows oldest first on a server side cursor
+# and are streamed in batches, memory stays flat whatever the size.
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+COLUMNS = tuple(GameSchema.__table__.columns.keys())
+
+def stored_time(moment: datetime) -> str:
+    # created_at is stored as str(datetime.now()), local time
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return moment.__str__()
+
+def games_query(player: Optional[str] = None, status: Optional[str] = None,
+                created_after: Optional[datetime] = None, created_before: Optional[datetime] = None):
+    table = GameSchema.__table__
+    query = select(table)
+    if player is not None:
+        query = query.where(or_(table.c.player1 == player, table.c.player2 == player))
+    if status is not None:
+        query = query.where(table.c.status == status)
+    if created_after is not None:
+        query = query.where(table.c.created_at >= stored_time(created_after))
+    if created_before is not None:
+        query = query.where(table.c.created_at < stored_time(created_before))
+    return query
+
+def _page(query, after: Optional[int], limit: int):
+    table = GameSchema.__table__
+    if after is not None:
+        query = query.where(table.c.id < after)
+    return query.order_by(table.c.id.desc()).limit(limit)
+
+async def list_games(db: AsyncSession, after: Optional[int] = None, limit: int = 50, player: Optional[str] = None, **filters) -> dict:
+    table = GameSchema.__table__
+    # one row more tells whether there is a next page
+    if player is None:
+        query = _page(games_query(**filters), after, limit + 1)
+    else:
+        # a page per seat, each read in order off its (player, id) index, merged,
+        # instead of sorting every game the player has below the cursor
+        seats = (
+            games_query(**filters).where(table.c.player1 == player),
+            games_query(**filters).where(table.c.player2 == player, or_(table.c.player1 != player, table.c.player1.is_(None))),
+        )
+        merged = union_all(*(select(_page(seat, after, limit + 1).subquery()) for seat in seats)).subquery()
+        query = select(merged).order_by(merged.c.id.desc()).limit(limit + 1)
+    rows = (await db.execute(query)).mappings().all()
+    games = [dict(row) for row in rows[:limit]]
+    return {"games": games, "next_cursor": games[-1]["id"] if len(rows) > limit else None}
+
+def _ndjson(rows: list) -> bytes:
+    return b"".join(orjson.dumps(dict(row)) + b"\n" for row in rows)
+
+def _csv(rows: list) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(orjson.dumps(value).decode("utf-8") if column == "board" else value
+                        for column, value in row.items())
+    return buffer.getvalue().encode("utf-8")
+
+async def export_games(format: str = "ndjson", batch_size: int = 1000, **filters) -> AsyncIterator[bytes]:
+    # runs after the request returned, so it holds a session of its own
+    encode = _csv if format == "csv" else _ndjson
+    if format == "csv":
+        yield (",".join(COLUMNS) + "\r\n").encode("utf-8")
+    async with AsyncDB.get_instance().SessionLocal() as db:
+        query = games_query(**filters).order_by(GameSchema.__table__.c.id).execution_options(yield_per=batch_size)
+        result = await db.stream(query)
+        async for rows in result.mappings().partitions():
+            yield encode(rows)
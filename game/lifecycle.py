@@ -0,0 +1,124 @@
+from typing import Optional
+from redis_database import AsyncRedisDB
+from websocket_connection_manager import WSConnectionManager
+from .flusher import DIRTY_GAMES, GameFlusher
+from .events import EVENTS_SUFFIX
+from . import codec, scripts
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger("uvicorn")
+
+# Every game in Redis has a deadline (ms) in this sorted set, GAME_EXPIRE_TIME
+# after its last move or FINISHED_GAME_EXPIRE_TIME once it is over. The reaper
+# deletes games past their deadline in batches, only after SQL has their last
+# move, and closes their websocket channels. SQL keeps the game afterwards.
+# A tournament game settles its match as it goes (game.tournament.game_expired).
+GAME_EXPIRY = "GAME_EXPIRY"
+BACKFILL_DONE = "GAME_EXPIRY_BACKFILLED"
+
+class GameReaper:
+    instance = None
+    def __init__(self, idle_ttl: float = 60.0, finished_ttl: float = 10.0, interval: float = 1.0,
+                 batch_size: int = 500, redis_db = None):
+        self.idle_ttl = idle_ttl
+        self.finished_ttl = finished_ttl
+        self.interval = interval
+        self.batch_size = batch_size
+        self.redis = redis_db
+        self.task: Optional[asyncio.Task] = None
+        self.reaped_games = 0
+
+    def deadline(self, is_over: bool = False) -> int:
+        return int((time.time() + (self.finished_ttl if is_over else self.idle_ttl)) * 1000)
+
+    def move_deadlines(self) -> list:
+        # APPLY_MOVE picks one once it knows whether the move ended the game
+        now = time.time()
+        return [int((now + self.idle_ttl) * 1000), int((now + self.finished_ttl) * 1000)]
+
+    async def start(self, redis_db = None):
+        self.redis = redis_db or self.redis or AsyncRedisDB.get_db()
+        backfilled = await self.backfill()
+        if backfilled:
+            logger.info(f"Scheduled expiry of {backfilled} existing games")
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reap()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Failed to reap games: {e}")
+
+    async def reap(self, redis_db = None, now: Optional[float] = None) -> int:
+        # safe to run on every worker, the script hands each game to one of them
+        redis_db = redis_db or self.redis
+        now_ms = int((time.time() if now is None else now) * 1000)
+        reaped_games = 0
+        while True:
+            reaped, dirty, tournament_games = await scripts.REAP_GAMES(redis_db, [GAME_EXPIRY, DIRTY_GAMES, gameTournament.TOURNAMENT_GAMES],
+                                                                       [now_ms, self.batch_size, EVENTS_SUFFIX, *codec.HASH_FIELDS])
+            if reaped:
+                reaped_games += len(reaped)
+                channel_ids = [key.decode("utf-8")[len("GAME_"):] for key in reaped]
+                await WSConnectionManager.get_instance().close_channels(channel_ids, "Game has expired")
+            for key, values in tournament_games:
+                game_id = key.decode("utf-8")[len("GAME_"):]
+                try:
+                    await gameTournament.game_expired(game_id, dict(zip(codec.HASH_FIELDS, values)), redis_db)
+                except Exception as e:
+                    logger.warning(f"Failed to settle expired tournament game {game_id}: {e}")
+            if dirty:
+                # written to SQL now, deleted by the next pass
+                await GameFlusher.get_instance().flush_games(dict(zip(dirty[::2], dirty[1::2])), redis_db)
+            if len(reaped) + len(dirty) // 2 < self.batch_size:
+                break
+        self.reaped_games += reaped_games
+        return reaped_games
+
+    async def backfill(self, redis_db = None) -> int:
+        # games created before deadlines existed, done once per Redis
+        redis_db = redis_db or self.redis
+        if not await redis_db.set(BACKFILL_DONE, 1, nx=True):
+            return 0
+        deadline = self.deadline()
+        scheduled = 0
+        batch = {}
+        async for key in redis_db.scan_iter(match="GAME_*", count=self.batch_size, _type="hash"):
+            batch[key] = deadline
+            if len(batch) >= self.batch_size:
+                scheduled += await redis_db.zadd(GAME_EXPIRY, batch, nx=True)
+                batch = {}
+        if batch:
+            scheduled += await redis_db.zadd(GAME_EXPIRY, batch, nx=True)
+        return scheduled
+
+    @staticmethod
+    def get_instance():
+        if GameReaper.instance is None:
+            GameReaper.instance = GameReaper(
+                float(os.getenv("GAME_EXPIRE_TIME", "60")),
+                float(os.getenv("FINISHED_GAME_EXPIRE_TIME", "10")),
+                float(os.getenv("REAP_INTERVAL", "1.0")),
+                int(os.getenv("REAP_BATCH_SIZE", "500")),
+            )
+        return GameReaper.instance
+
+# last: game.tournament reaches GameReaper through game.service
+import game.tournament as gameTournament
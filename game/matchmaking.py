@@ -0,0 +1,106 @@
+from fastapi import HTTPException
+from typing import Optional
+from redis_database import AsyncRedisDB
+from . import scripts
+import game.service as gameService
+import asyncio
+import json
+import logging
+import os
+import uuid
+
+logger = logging.getLogger("uvicorn")
+
+# Waiting players are tickets in a Redis list, paired atomically by
+# scripts.MATCHMAKE. The player who completes a pair creates the game and
+# pushes it to the waiting player's worker on that worker's channel, where it
+# resolves the pending request. Nothing touches SQL until the flusher runs.
+QUEUE = "MATCHMAKING_QUEUE"
+TICKET_PREFIX = "MATCH_TICKET_"
+CHANNEL_PREFIX = "MATCH_"
+
+class Matchmaker:
+    instance = None
+    def __init__(self, timeout: float = 30.0, redis_db = None):
+        self.timeout = timeout
+        self.redis = redis_db
+        self.worker_id = uuid.uuid4().hex
+        self.pubsub = None
+        self.listener: Optional[asyncio.Task] = None
+        self.waiting: dict[str, asyncio.Future] = {}
+        self.pairings = 0
+
+    async def start(self, redis_db = None):
+        self.redis = redis_db or self.redis or AsyncRedisDB.get_db()
+        if self.pubsub is None:
+            self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            await self.pubsub.subscribe(CHANNEL_PREFIX + self.worker_id)
+            self.listener = asyncio.get_running_loop().create_task(self.listen())
+
+    async def stop(self):
+        if self.listener is not None:
+            self.listener.cancel()
+            try:
+                await self.listener
+            except asyncio.CancelledError:
+                pass
+            self.listener = None
+        if self.pubsub is not None:
+            await self.pubsub.aclose()
+            self.pubsub = None
+
+    async def listen(self):
+        while True:
+            try:
+                event = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if event is None or event["type"] != "message":
+                    continue
+                assignment = json.loads(event["data"])
+                waiter = self.waiting.pop(assignment["ticket"], None)
+                if waiter is not None and not waiter.done():
+                    waiter.set_result(assignment["game"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Matchmaking listener error: {e}")
+                await asyncio.sleep(1)
+
+    async def matchmake(self, player: str, redis_db = None) -> dict:
+        redis_db = redis_db or self.redis
+        ticket = uuid.uuid4().hex
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiting[ticket] = waiter
+        try:
+            args = [ticket, player, self.worker_id, int(self.timeout) + 5, TICKET_PREFIX]
+            result = await scripts.MATCHMAKE(redis_db, [QUEUE, gameService.GAME_ID], args)
+            if result[0] == b"PAIRED":
+                # the waiting player moves first
+                _, opponent_ticket, opponent, opponent_worker, game_id = (value.decode("utf-8") for value in result)
+                game = await gameService.create_matched(int(game_id), opponent, player, redis_db)
+                await redis_db.publish(CHANNEL_PREFIX + opponent_worker, json.dumps({"ticket": opponent_ticket, "game": game}))
+                self.pairings += 1
+                return game
+
+            try:
+                return await asyncio.wait_for(asyncio.shield(waiter), self.timeout)
+            except asyncio.TimeoutError:
+                if await self.cancel(ticket, redis_db):
+                    raise HTTPException(status_code=408, detail="No opponent found")
+                # paired while timing out, the game is on its way
+                return await asyncio.wait_for(waiter, 5)
+            except asyncio.CancelledError:
+                await self.cancel(ticket, redis_db)
+                raise
+        finally:
+            self.waiting.pop(ticket, None)
+
+    async def cancel(self, ticket: str, redis_db = None) -> bool:
+        # False when the ticket was already taken by a pairing
+        redis_db = redis_db or self.redis
+        return bool(await redis_db.delete(TICKET_PREFIX + ticket))
+
+    @staticmethod
+    def get_instance():
+        if Matchmaker.instance is None:
+            Matchmaker.instance = Matchmaker(float(os.getenv("MATCHMAKING_TIMEOUT", "30")))
+        return Matchmaker.instance
@@ -0,0 +1,23 @@
+# Rewrites games still stored as a JSON "data" blob with the compact codec.
+# Games are also migrated lazily on their next read or move.
+#
+#   python -m game.migrate
+import asyncio
+from redis_database import AsyncRedisDB
+from .service import migrate_game
+
+async def migrate_all(redis_db, batch_size: int = 1000) -> int:
+    migrated = 0
+    async for key in redis_db.scan_iter(match="GAME_*", count=batch_size):
+        game_id = key.decode("utf-8")[len("GAME_"):]
+        if game_id.isdigit() and await migrate_game(game_id, redis_db):
+            migrated += 1
+    return migrated
+
+async def main():
+    redis_db = AsyncRedisDB.get_db()
+    print(f"Migrated {await migrate_all(redis_db)} games")
+    await redis_db.aclose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional, List
+from pydantic import BaseModel, Field
+from typing import Optional, List, Literal
 
 class GameModel(BaseModel):
     id: int
@@ -18,16 +18,107 @@ class GameModel(BaseModel):
     updated_by: Optional[str] = None
     created_at: str
     updated_at: Optional[str] = None
+    mode: Optional[str] = None
+    difficulty: Optional[str] = None
+    # bumped by every change of the Redis state
+    seq: Optional[int] = None
+    board_size: Optional[int] = 3
+    win_length: Optional[int] = 3
 
     class Config:
         from_attributes = True
 
+GameStatus = Literal["CREATE", "INIT", "IN_PROGRESS", "FINISH"]
+
+class GameListModel(BaseModel):
+    games: List[GameModel]
+    # pass as after= for the next page, None on the last one
+    next_cursor: Optional[int] = None
+
 class CreateGameModel(BaseModel):
     player: Optional[str] = None
+    # AI games are played against game.ai, difficulty only applies to them
+    mode: Literal["PVP", "AI"] = "PVP"
+    difficulty: Literal["EASY", "MEDIUM", "HARD"] = "HARD"
+    # k-in-a-row on a larger board, e.g. 15 and 5 for Gomoku. The win length
+    # defaults to the board size up to 5. AI games are 3x3 only
+    board_size: int = Field(3, ge=3, le=19)
+    win_length: Optional[int] = Field(None, ge=3, le=19)
+
+class MatchmakeModel(BaseModel):
+    player: str
+
+class PlayerStatsModel(BaseModel):
+    name: str
+    rank: Optional[int] = None
+    wins: int = 0
+    losses: int = 0
+    draws: int = 0
+    games: int = 0
+
+class LeaderboardModel(BaseModel):
+    total: int
+    offset: int
+    limit: int
+    players: List[PlayerStatsModel]
+
+TournamentFormat = Literal["SINGLE_ELIMINATION", "ROUND_ROBIN"]
+
+class CreateTournamentModel(BaseModel):
+    # in seed order, the first players get the byes of a knockout bracket
+    players: List[str] = Field(min_length=2, max_length=4096)
+    format: TournamentFormat = "SINGLE_ELIMINATION"
+    board_size: int = Field(3, ge=3, le=19)
+    win_length: Optional[int] = Field(None, ge=3, le=19)
+
+class TournamentMatchModel(BaseModel):
+    # "{round}:{match}", a bye has no game and one player
+    match: str
+    round: int
+    game_id: Optional[int] = None
+    player1: Optional[str] = None
+    player2: Optional[str] = None
+    winner: Optional[str] = None
+    is_draw: bool = False
+
+class TournamentStandingModel(BaseModel):
+    player: str
+    points: float
+
+class TournamentModel(BaseModel):
+    id: int
+    format: TournamentFormat
+    status: str
+    round: int
+    rounds: int
+    players: List[str]
+    board_size: int
+    win_length: int
+    winner: Optional[str] = None
+    seq: int
+    created_at: str
+    matches: List[TournamentMatchModel]
+    # round robin only
+    standings: List[TournamentStandingModel]
 
 class UpdateGameModel(BaseModel):
     turn: str
     move: List
 
+class BatchMoveModel(UpdateGameModel):
+    game_id: int
+
+class BatchMovesModel(BaseModel):
+    # played in order, moves on the same game one after another
+    moves: List[BatchMoveModel] = Field(min_length=1, max_length=1000)
 
+class BatchMoveResultModel(BaseModel):
+    game_id: int
+    # the game after the move, or the status and detail it was refused with
+    status_code: int = 200
+    game: Optional[GameModel] = None
+    detail: Optional[str] = None
 
+class BatchMovesResultModel(BaseModel):
+    # one per move, in order
+    results: List[BatchMoveResultModel]
@@ -1,40 +1,223 @@
-from fastapi import APIRouter, status, Depends, WebSocketDisconnect, WebSocket, HTTPException
-from typing import Optional
-from game.model import CreateGameModel, GameModel
+from fastapi import APIRouter, status, Depends, WebSocketDisconnect, WebSocket, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.websockets import WebSocketState
+from typing import Literal, Optional
+from datetime import datetime
+from game.model import CreateGameModel, GameModel, GameListModel, GameStatus, MatchmakeModel, PlayerStatsModel, LeaderboardModel, CreateTournamentModel, TournamentModel, BatchMovesModel, BatchMovesResultModel
+from game.matchmaking import Matchmaker
+from game.shards import GameShards
+from pydantic import ValidationError
 import game.service as gameService
-from redis_database import RedisDB
-from database import DB
+import game.stats as gameStats
+import game.events as gameEvents
+import game.history as gameHistory
+import game.tournament as gameTournament
+import game.wire as gameWire
+from redis_database import AsyncRedisDB
+from database import AsyncDB
 from websocket_connection_manager import WSConnectionManager
+from metrics import Metrics
+import asyncio
+import orjson
 
 router = APIRouter(prefix='/games', tags=['Game'])
+player_router = APIRouter(tags=['Player'])
+tournament_router = APIRouter(prefix='/tournaments', tags=['Tournament'])
+
+@player_router.get('/players/{name}/stats', response_model= PlayerStatsModel, summary="Wins, losses, draws and rank of a player")
+async def player_stats(name: str, redis_db = Depends(AsyncRedisDB.get_db)):
+    return await gameStats.get_player_stats(name, redis_db)
+
+@player_router.get('/leaderboard', response_model= LeaderboardModel, summary="Players ranked by wins")
+async def leaderboard(offset: int = Query(0, ge=0), limit: int = Query(20, ge=1, le=100), redis_db = Depends(AsyncRedisDB.get_db)):
+    return await gameStats.get_leaderboard(offset, limit, redis_db)
+
+@tournament_router.post('', status_code=status.HTTP_201_CREATED, response_model= TournamentModel, summary="Start a round robin or knockout tournament, its first round is created right away")
+async def create_tournament(data: CreateTournamentModel, redis_db = Depends(AsyncRedisDB.get_db)):
+    return await gameTournament.create_tournament(data, redis_db)
+
+@tournament_router.get('/{tournament_id}', response_model= TournamentModel, summary="Bracket, results and standings of a tournament")
+async def get_tournament(tournament_id: int, redis_db = Depends(AsyncRedisDB.get_db)):
+    return await gameTournament.get_tournament(tournament_id, redis_db)
+
+@tournament_router.websocket("/ws/{tournament_id}", name="Follow Tournament")
+async def follow_tournament(websocket: WebSocket, tournament_id: int, redis_db = Depends(AsyncRedisDB.get_db)):
+    # a snapshot, then a frame per new round, result and the end
+    connectionManger = WSConnectionManager.get_instance()
+    channel_id = gameTournament.channel_id(tournament_id)
+    if not await connectionManger.connect(websocket, channel_id, resume=True):
+        return
+    try:
+        snapshot = await gameTournament.get_tournament(tournament_id, redis_db)
+        connectionManger.replay(websocket, [{"type": "snapshot", **snapshot}])
+        while True:
+            await websocket.receive_text()
+    except HTTPException as httpex:
+        await connectionManger.send_personal_message({"error": httpex.detail}, websocket)
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        connectionManger.disconnect(websocket, channel_id)
+
+@router.get('', response_model= GameListModel, summary="Past games, newest first, paged with next_cursor")
+async def list_games(player: Optional[str] = None, status: Optional[GameStatus] = None,
+                     created_after: Optional[datetime] = None, created_before: Optional[datetime] = None,
+                     after: Optional[int] = None, limit: int = Query(50, ge=1, le=500), db = Depends(AsyncDB.get_db)):
+    return await gameHistory.list_games(db, after, limit, player=player, status=status,
+                                        created_after=created_after, created_before=created_before)
+
+@router.get('/export', summary="Every matching game as NDJSON or CSV, streamed")
+async def export_games(format: Literal["ndjson", "csv"] = "ndjson", player: Optional[str] = None, status: Optional[GameStatus] = None,
+                       created_after: Optional[datetime] = None, created_before: Optional[datetime] = None):
+    rows = gameHistory.export_games(format, player=player, status=status, created_after=created_after, created_before=created_before)
+    return StreamingResponse(rows, media_type=gameHistory.EXPORT_FORMATS[format],
+                             headers={"Content-Disposition": f"attachment; filename=games.{format}"})
+
+@router.get('/{game_id}', response_model= GameModel, summary="Current state of a game, revalidate with If-None-Match")
+async def read_game(game_id: int, request: Request, redis_db = Depends(AsyncRedisDB.get_db)):
+    await GameShards.get_instance().settle(game_id)
+    etag, body = await gameService.read_game(game_id, redis_db, request.headers.get("if-none-match"))
+    # no-cache: pollers always revalidate, a 304 costs them no body
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if body is None:
+        Metrics.get_instance().count("read_game", "not_modified")
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    Metrics.get_instance().count("read_game")
+    return Response(body, media_type="application/json", headers=headers)
 
 @router.post('', status_code=status.HTTP_201_CREATED, response_model= GameModel, summary="Create new game")
-async def create(data: CreateGameModel, db = Depends(DB.get_db), redis_db = Depends(RedisDB.get_db)):
-    return gameService.create(data, db, redis_db)
+async def create(data: CreateGameModel, db = Depends(AsyncDB.get_db), redis_db = Depends(AsyncRedisDB.get_db)):
+    return await gameService.create(data, db, redis_db)
+
+@router.post('/matchmake', status_code=status.HTTP_201_CREATED, response_model= GameModel, summary="Wait for an opponent, returns the game both players were paired into")
+async def matchmake(data: MatchmakeModel, redis_db = Depends(AsyncRedisDB.get_db)):
+    return await Matchmaker.get_instance().matchmake(data.player, redis_db)
+
+@router.post('/moves', response_model= BatchMovesResultModel, summary="Play moves on many games at once, every move gets its own result")
+async def batch_moves(data: BatchMovesModel, db = Depends(AsyncDB.get_db), redis_db = Depends(AsyncRedisDB.get_db)):
+    # for bots playing many games: one pipelined Redis exchange for the batch
+    # instead of a socket and a round trip per game
+    connectionManger = WSConnectionManager.get_instance()
+    metrics = Metrics.get_instance()
+    with metrics.time("batch_move", "update"):
+        replies = await GameShards.get_instance().move_many(data.moves, db, redis_db)
+    results = []
+    broadcasts = []
+    for move, reply in zip(data.moves, replies):
+        if isinstance(reply, HTTPException):
+            metrics.count("batch_move", str(reply.status_code))
+            results.append({"game_id": move.game_id, "status_code": reply.status_code, "detail": reply.detail})
+            continue
+        # players and spectators see the move as if it came over the socket
+        broadcasts.append((str(move.game_id), reply, gameService.spectator_delta(reply)))
+        metrics.count("batch_move")
+        results.append({"game_id": move.game_id, "status_code": status.HTTP_200_OK, "game": reply})
+    with metrics.time("batch_move", "broadcast"):
+        await connectionManger.broadcast_many(broadcasts)
+    return Response(orjson.dumps({"results": results}), media_type="application/json")
 
 @router.post('/{game_id}', status_code=status.HTTP_201_CREATED, response_model= GameModel, summary="New player can join the game using game_id")
-async def join(data: CreateGameModel, game_id: Optional[str], db = Depends(DB.get_db), redis_db = Depends(RedisDB.get_db)) -> dict:
-    return gameService.create(data, db, redis_db, game_id)
+async def join(data: CreateGameModel, game_id: Optional[str], db = Depends(AsyncDB.get_db), redis_db = Depends(AsyncRedisDB.get_db)) -> dict:
+    return await gameService.create(data, db, redis_db, game_id)
 
 
+@router.websocket("/ws/matchmake", name="Matchmake")
+async def matchmake_ws(websocket: WebSocket, redis_db = Depends(AsyncRedisDB.get_db)):
+    await websocket.accept()
+    try:
+        data = MatchmakeModel.model_validate(await websocket.receive_json())
+        pairing = asyncio.create_task(Matchmaker.get_instance().matchmake(data.player, redis_db))
+        # leaving the queue by closing the socket
+        closed = asyncio.create_task(websocket.receive())
+        await asyncio.wait((pairing, closed), return_when=asyncio.FIRST_COMPLETED)
+        closed.cancel()
+        if not pairing.done():
+            pairing.cancel()
+            return
+        await websocket.send_json(pairing.result())
+    except HTTPException as httpex:
+        await websocket.send_json({"error": httpex.detail})
+    except (ValidationError, ValueError) as e:
+        await websocket.send_json({"error": e.__str__()})
+    except WebSocketDisconnect:
+        return
+    await websocket.close()
+
+@router.websocket("/ws/{game_id}/spectate", name="Spectate Game")
+async def spectate_game(websocket: WebSocket, game_id: str, redis_db = Depends(AsyncRedisDB.get_db)):
+    # a snapshot of the game, then a compact delta per move
+    connectionManger = WSConnectionManager.get_instance()
+    if not await connectionManger.spectate(websocket, game_id, lambda: gameService.spectator_snapshot(game_id, redis_db)):
+        # still open when the game is missing, closed when turned away
+        if websocket.application_state == WebSocketState.CONNECTED:
+            await websocket.send_json({"error": "Game not found"})
+            await websocket.close()
+        return
+    try:
+        # spectators cannot move, whatever they send is ignored
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        connectionManger.unspectate(websocket, game_id)
+
 @router.websocket("/ws/{game_id}", name="Play Game")
-async def update_game(websocket: WebSocket, game_id: str, db = Depends(DB.get_db), redis_db = Depends(RedisDB.get_db)):
+async def update_game(websocket: WebSocket, game_id: str, last_seq: Optional[int] = None, redis_db = Depends(AsyncRedisDB.get_db)):
     connectionManger = WSConnectionManager.get_instance()
-    await connectionManger.connect(websocket, game_id)
-    await connectionManger.broadcast({"message": "New Player joined game..."}, game_id, exclude = [websocket]);
-    while True:
-        try:
-            data = await websocket.receive_json()
-            response = gameService.update(data, game_id, db, redis_db)
-            await connectionManger.broadcast(response, game_id, exclude = [])
-        except WebSocketDisconnect:
-            await connectionManger.disconnect(websocket, game_id)
-            await connectionManger.broadcast(f"Player disconnected from game {game_id}", game_id, exclude = [websocket])
-        except HTTPException as httpex:
-            message = httpex.detail
-            await connectionManger.send_personal_message({"error": message}, websocket)
-            break
-        except Exception as e:
-            if websocket.client_state.name not in ( "DISCONNECTED", "CONNECTING"): 
-                 await connectionManger.send_personal_message({"error": e.__str__()}, websocket)
-            else: break
\ No newline at end of file
+    metrics = Metrics.get_instance()
+    # binary clients offer the subprotocol, everyone else speaks JSON
+    protocol = gameWire.negotiate(websocket)
+    seats = {}
+    if not await connectionManger.connect(websocket, game_id, resume=last_seq is not None, protocol=protocol):
+        metrics.count("ws_connect", "rejected")
+        return
+    try:
+        if last_seq is not None:
+            # reconnecting, the moves missed since last_seq or the current game
+            await GameShards.get_instance().settle(game_id)
+            connectionManger.replay(websocket, await gameEvents.missed_events(game_id, last_seq, redis_db))
+        await connectionManger.broadcast({"message": "New Player joined game..."}, game_id, exclude = [websocket]);
+        while True:
+            try:
+                if protocol is None:
+                    data = await websocket.receive_json()
+                    ping = isinstance(data, dict) and data.get("type") == "ping"
+                else:
+                    frame = await websocket.receive_bytes()
+                    ping = frame == gameWire.PING_FRAME
+                connectionManger.touch(websocket)
+                if ping:
+                    await connectionManger.send_personal_message({"type": "pong"}, websocket)
+                    continue
+                if protocol is not None:
+                    if seats.get("player2") is None:
+                        # names and board size, read again until both seats are taken
+                        seats = await gameService.get_game(game_id, redis_db) or {}
+                    data = protocol.decode_move(frame, seats)
+                # a session per move, the socket must not hold a pooled connection
+                async with AsyncDB.get_instance().SessionLocal() as db:
+                    with metrics.time("ws_move", "update"):
+                        # played here or by the worker that owns the game
+                        response = await GameShards.get_instance().move(data, game_id, db, redis_db)
+                with metrics.time("ws_move", "broadcast"):
+                    await connectionManger.broadcast(response, game_id, exclude = [], spectator_message = gameService.spectator_delta(response))
+                metrics.count("ws_move")
+            except WebSocketDisconnect:
+                connectionManger.disconnect(websocket, game_id)
+                await connectionManger.broadcast(f"Player disconnected from game {game_id}", game_id, exclude = [websocket])
+                break
+            except HTTPException as httpex:
+                metrics.count("ws_move", str(httpex.status_code))
+                message = httpex.detail
+                await connectionManger.send_personal_message({"error": message}, websocket)
+                break
+            except Exception as e:
+                metrics.count("ws_move", "error")
+                if websocket.client_state.name not in ( "DISCONNECTED", "CONNECTING"): 
+                     await connectionManger.send_personal_message({"error": e.__str__()}, websocket)
+                else: break
+    finally:
+        # however the loop ended, the registry lets go of the socket
+        connectionManger.disconnect(websocket, game_id)
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ARRAY
+from sqlalchemy import Column, Integer, String, Boolean, ARRAY, JSON, Index
 from datetime import datetime
 from database import DB
 
@@ -19,6 +19,32 @@ class GameSchema(Base):
     turn = Column(String(50), nullable=True)
     created_by = Column(String(50), nullable=False)
     updated_by = Column(String(50), nullable=True)
-    created_at = Column(String(50), nullable=False, default=datetime.now().__str__())
+    # a callable, evaluated per insert rather than once at import
+    created_at = Column(String(50), nullable=False, default=lambda: datetime.now().__str__())
     updated_at = Column(String(50), nullable=True)
+    board = Column(JSON, nullable=True)
+    mode = Column(String(10), nullable=True, default="PVP")
+    difficulty = Column(String(10), nullable=True)
+    # codec seq of the Redis state this row was flushed from
+    seq = Column(Integer, nullable=True, default=0)
+    board_size = Column(Integer, nullable=True, default=3)
+    win_length = Column(Integer, nullable=True, default=3)
 
+    # game history filters, with id last for the keyset order (game.history)
+    __table_args__ = (
+        Index("ix_games_player1_id", "player1", "id"),
+        Index("ix_games_player2_id", "player2", "id"),
+        Index("ix_games_status_id", "status", "id"),
+        Index("ix_games_created_at", "created_at"),
+    )
+
+
+class PlayerSchema(Base):
+    __tablename__ = "players"
+
+    name = Column(String(50), primary_key=True)
+    wins = Column(Integer, nullable=False, default=0)
+    losses = Column(Integer, nullable=False, default=0)
+    draws = Column(Integer, nullable=False, default=0)
+    # finished games, only ever grows so it versions the row like games.seq
+    games = Column(Integer, nullable=False, default=0)
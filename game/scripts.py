@@ -0,0 +1,306 @@
+from redis.exceptions import NoScriptError
+from . import codec, engine
+import hashlib
+
+# Server side scripts run atomically inside Redis. They avoid the bit and
+# struct libraries (bytes are packed arithmetically) so they also run on fakeredis.
+
+def _lua_win_lines() -> str:
+    lines = []
+    for line in engine.WIN_LINES:
+        cells = [str(index) for index in range(9) if line & (1 << index)]
+        lines.append("{" + ", ".join(cells) + "}")
+    return "{" + ", ".join(lines) + "}"
+
+class LuaScript:
+    def __init__(self, source: str):
+        self.source = source
+        self.sha = hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+    async def load(self, redis_db):
+        await redis_db.script_load(self.source)
+
+    async def __call__(self, redis_db, keys: list, args: list):
+        try:
+            return await redis_db.evalsha(self.sha, len(keys), *keys, *args)
+        except NoScriptError:
+            return await redis_db.eval(self.source, len(keys), *keys, *args)
+
+# KEYS[1] game hash, KEYS[2] dirty games hash (game.flusher.DIRTY_GAMES),
+# KEYS[3] expiry deadlines (game.lifecycle.GAME_EXPIRY), KEYS[4] leaderboard,
+# KEYS[5] dirty players hash (game.stats), KEYS[6] event log (game.events)
+# ARGV turn, row, col, updated_at (codec.encode_timestamp), idle deadline,
+# finished deadline (ms), player stats key prefix, event log size
+# the move that finishes a PVP game also counts it for both players, larger
+# boards (codec.LARGE_STATE) check only the lines through the new stone
+# returns {'OK', state, cold fields...} or {error code}
+APPLY_MOVE = LuaScript("""
+local VERSION = """ + str(codec.VERSION) + """
+local LARGE_VERSION = """ + str(codec.LARGE_VERSION) + """
+local unpack = unpack or table.unpack
+local WIN_LINES = """ + _lua_win_lines() + """
+local fields = redis.call('HMGET', KEYS[1], 'state', """ + ", ".join(f"'{field}'" for field in codec.COLD_FIELDS) + """)
+local state = fields[1]
+local version = state and string.byte(state, 1)
+if version ~= VERSION and version ~= LARGE_VERSION then
+    if redis.call('HEXISTS', KEYS[1], 'data') == 1 then return {'MIGRATE'} end
+    if not state then return {'EXPIRED'} end
+    return {'MIGRATE'}
+end
+
+local function u16(offset) return string.byte(state, offset) * 256 + string.byte(state, offset + 1) end
+local function has(mask, cell) return math.floor(mask / 2 ^ cell) % 2 == 1 end
+local function pack(value, size)
+    local bytes = {}
+    for i = size, 1, -1 do
+        bytes[i] = string.char(value % 256)
+        value = math.floor(value / 256)
+    end
+    return table.concat(bytes)
+end
+
+local large = version == LARGE_VERSION
+local flags, is_over, seq, size
+if large then
+    flags = string.byte(state, 2)
+    is_over = string.byte(state, 3) % 2 == 1
+    seq = u16(6) * 65536 + u16(8)
+    size = string.byte(state, 18)
+else
+    flags = string.byte(state, 6)
+    is_over = string.byte(state, 7) % 2 == 1
+    seq = u16(9) * 65536 + u16(11)
+    size = 3
+end
+local names = {fields[2], fields[3]}
+local turn_index = math.floor(flags / 4) % 4
+local turn = ARGV[1]
+local row = tonumber(ARGV[2])
+local col = tonumber(ARGV[3])
+
+if names[turn_index] ~= turn then return {'NOT_YOUR_TURN'} end
+if is_over then return {'GAME_OVER'} end
+if row < 0 or row >= size or col < 0 or col >= size then return {'INVALID_MOVE'} end
+if names[1] ~= turn and names[2] ~= turn then return {'NOT_YOUR_TURN'} end
+
+local cell = row * size + col
+local mover = 2
+if names[1] == turn then mover = 1 end
+local won, full, body = false, false, nil
+
+if large then
+    -- bitsets of mask_bytes(size) bytes after the 21 byte header, bit i of byte j is cell 8j + i
+    local win_length = string.byte(state, 19)
+    local moves = u16(20) + 1
+    local length = math.floor((size * size + 7) / 8)
+    local starts = {22, 22 + length}
+    local function stone(player, r, c)
+        local index = r * size + c
+        return math.floor(string.byte(state, starts[player] + math.floor(index / 8)) / 2 ^ (index % 8)) % 2 == 1
+    end
+    if stone(1, row, col) or stone(2, row, col) then return {'INVALID_MOVE'} end
+    local offset = starts[mover] + math.floor(cell / 8)
+    state = string.sub(state, 1, offset - 1) .. string.char(string.byte(state, offset) + 2 ^ (cell % 8)) .. string.sub(state, offset + 1)
+    -- the stone is placed, so stone() sees it
+    for _, direction in ipairs({{0, 1}, {1, 0}, {1, 1}, {1, -1}}) do
+        local count = 1
+        for sign = -1, 1, 2 do
+            local r, c = row + sign * direction[1], col + sign * direction[2]
+            while count < win_length and r >= 0 and r < size and c >= 0 and c < size and stone(mover, r, c) do
+                count = count + 1
+                r, c = r + sign * direction[1], c + sign * direction[2]
+            end
+        end
+        if count >= win_length then
+            won = true
+            break
+        end
+    end
+    full = moves == size * size
+    body = string.char(size, win_length) .. pack(moves, 2) .. string.sub(state, 22)
+else
+    local masks = {u16(2), u16(4)}
+    if has(masks[1], cell) or has(masks[2], cell) then return {'INVALID_MOVE'} end
+    masks[mover] = masks[mover] + 2 ^ cell
+    for _, line in ipairs(WIN_LINES) do
+        if has(masks[mover], line[1]) and has(masks[mover], line[2]) and has(masks[mover], line[3]) then
+            won = true
+        end
+    end
+    full = masks[1] + masks[2] == 511
+    body = pack(masks[1], 2) .. pack(masks[2], 2)
+end
+
+local status, winner, bools = 2, 0, 0
+if won then
+    status, winner, bools = 3, mover, 1
+elseif full then
+    status, bools = 3, 3
+else
+    turn_index = 3 - mover
+end
+
+local outcome = string.char(status + turn_index * 4 + winner * 16 + mover * 64, bools)
+if large then
+    state = string.char(LARGE_VERSION) .. outcome .. pack(cell, 2) .. pack(seq + 1, 4) .. ARGV[4] .. body
+else
+    state = string.char(VERSION) .. body .. outcome .. string.char(cell) .. pack(seq + 1, 4) .. ARGV[4]
+end
+redis.call('HSET', KEYS[1], 'state', state)
+redis.call('HSET', KEYS[2], KEYS[1], string.format('%d', seq + 1))
+-- a log left behind by an older state must not fail the move
+redis.pcall('XADD', KEYS[6], 'MAXLEN', ARGV[8], string.format('%d-0', seq + 1), 'state', state)
+if status == 3 then
+    redis.call('ZADD', KEYS[3], ARGV[6], KEYS[1])
+    if fields[8] ~= 'AI' then
+        local results = {'draws', 'draws'}
+        if won then
+            results[mover], results[3 - mover] = 'wins', 'losses'
+        end
+        for i = 1, 2 do
+            local key = ARGV[7] .. names[i]
+            redis.call('HINCRBY', key, results[i], 1)
+            redis.call('HSET', KEYS[5], names[i], redis.call('HINCRBY', key, 'games', 1))
+            redis.call('ZADD', KEYS[4], 'NX', 0, names[i])
+        end
+        if won then redis.call('ZINCRBY', KEYS[4], 1, names[mover]) end
+    end
+else
+    redis.call('ZADD', KEYS[3], ARGV[5], KEYS[1])
+end
+fields[1] = state
+return {'OK', unpack(fields)}
+""")
+
+# KEYS[1] game hash, ARGV field/value pairs of codec.encode_game
+# only applies while the legacy JSON blob is still there
+MIGRATE_GAME = LuaScript("""
+local unpack = unpack or table.unpack
+if redis.call('HEXISTS', KEYS[1], 'data') == 0 then return 0 end
+redis.call('HSET', KEYS[1], unpack(ARGV))
+redis.call('HDEL', KEYS[1], 'data')
+return 1
+""")
+
+# KEYS[1] dirty games hash, ARGV game key/seq pairs that were flushed
+# entries marked again by a later move stay dirty
+CLEAN_DIRTY = LuaScript("""
+local cleaned = 0
+for i = 1, #ARGV, 2 do
+    if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+        cleaned = cleaned + redis.call('HDEL', KEYS[1], ARGV[i])
+    end
+end
+return cleaned
+""")
+
+# KEYS[1] counter, ARGV[1] lowest value it may have
+RAISE_COUNTER = LuaScript("""
+local value = tonumber(ARGV[1])
+if tonumber(redis.call('GET', KEYS[1]) or 0) < value then
+    redis.call('SET', KEYS[1], value)
+end
+return tonumber(redis.call('GET', KEYS[1]))
+""")
+
+# KEYS[1] matchmaking queue of tickets, KEYS[2] game id counter
+# ARGV ticket, player, worker id, ticket ttl (s), ticket key prefix
+# pairs with the oldest live ticket of another player or queues this one,
+# returns {'PAIRED', ticket, player, worker, game id} or {'QUEUED'}
+MATCHMAKE = LuaScript("""
+local prefix = ARGV[5]
+local skipped = {}
+local paired = nil
+while true do
+    local ticket = redis.call('LPOP', KEYS[1])
+    if not ticket then break end
+    local waiting = redis.call('HMGET', prefix .. ticket, 'player', 'worker')
+    -- tickets without a hash expired or were cancelled
+    if waiting[1] then
+        if waiting[1] == ARGV[2] then
+            table.insert(skipped, ticket)
+        else
+            redis.call('DEL', prefix .. ticket)
+            paired = {'PAIRED', ticket, waiting[1], waiting[2], tostring(redis.call('INCR', KEYS[2]))}
+            break
+        end
+    end
+end
+for i = #skipped, 1, -1 do
+    redis.call('LPUSH', KEYS[1], skipped[i])
+end
+if paired then return paired end
+
+redis.call('HSET', prefix .. ARGV[1], 'player', ARGV[2], 'worker', ARGV[3])
+redis.call('EXPIRE', prefix .. ARGV[1], ARGV[4])
+redis.call('RPUSH', KEYS[1], ARGV[1])
+return {'QUEUED'}
+""")
+
+# KEYS[1] expiry deadlines, KEYS[2] dirty games hash, KEYS[3] tournament of
+# every pending game (game.tournament.TOURNAMENT_GAMES)
+# ARGV now (ms), batch size, event log key suffix, codec.HASH_FIELDS
+# deletes games past their deadline that SQL already has, games with unflushed
+# moves are returned as key/seq pairs instead. Deleted tournament games come
+# back with their fields so their match can be settled, returns
+# {reaped keys, dirty pairs, {key, HASH_FIELDS values} per tournament game}
+REAP_GAMES = LuaScript("""
+local unpack = unpack or table.unpack
+local reaped, dirty, tournament_games = {}, {}, {}
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, key in ipairs(due) do
+    local seq = redis.call('HGET', KEYS[2], key)
+    if seq then
+        table.insert(dirty, key)
+        table.insert(dirty, seq)
+    else
+        if redis.call('HEXISTS', KEYS[3], key) == 1 then
+            table.insert(tournament_games, {key, redis.call('HMGET', key, unpack(ARGV, 4))})
+        end
+        redis.call('DEL', key, key .. ARGV[3])
+        redis.call('ZREM', KEYS[1], key)
+        table.insert(reaped, key)
+    end
+end
+return {reaped, dirty, tournament_games}
+""")
+
+# KEYS[1] tournament of every pending game (game.tournament.TOURNAMENT_GAMES)
+# ARGV game key, winner ('' for a draw), player1, player2, tournament key
+# prefix, replays of a drawn knockout game
+# records a finished game once. A drawn knockout game leaves its match open
+# to be replayed up to ARGV[6] times, the draw after that goes to the higher
+# seed. Returns {tournament id, match, winner, seq, games left in the round,
+# 1 if the match is replayed else 0} or nil
+RECORD_RESULT = LuaScript("""
+local entry = redis.call('HGET', KEYS[1], ARGV[1])
+if not entry then return false end
+redis.call('HDEL', KEYS[1], ARGV[1])
+local id, match = string.match(entry, '^(%d+):(.+)$')
+local key = ARGV[5] .. id
+local winner = ARGV[2]
+if redis.call('HGET', key, 'format') == 'ROUND_ROBIN' then
+    if winner == '' then
+        redis.call('ZINCRBY', key .. '_STANDINGS', 1, ARGV[3])
+        redis.call('ZINCRBY', key .. '_STANDINGS', 1, ARGV[4])
+    else
+        redis.call('ZINCRBY', key .. '_STANDINGS', 2, winner)
+    end
+elseif winner == '' then
+    if redis.call('HINCRBY', key .. '_REPLAYS', match, 1) <= tonumber(ARGV[6]) then
+        return {id, match, '', redis.call('HINCRBY', key, 'seq', 1), tonumber(redis.call('HGET', key, 'pending')), 1}
+    end
+    local seeds = redis.call('HMGET', key .. '_SEEDS', ARGV[3], ARGV[4])
+    if tonumber(seeds[1]) and tonumber(seeds[2]) and tonumber(seeds[1]) < tonumber(seeds[2]) then
+        winner = ARGV[3]
+    else
+        winner = ARGV[4]
+    end
+end
+redis.call('HSET', key .. '_RESULTS', match, winner)
+return {id, match, winner, redis.call('HINCRBY', key, 'seq', 1), redis.call('HINCRBY', key, 'pending', -1), 0}
+""")
+
+async def load_all(redis_db):
+    for script in (APPLY_MOVE, MIGRATE_GAME, CLEAN_DIRTY, RAISE_COUNTER, MATCHMAKE, REAP_GAMES, RECORD_RESULT):
+        await script.load(redis_db)
@@ -1,33 +1,88 @@
 from fastapi import HTTPException
-from sqlalchemy.orm import Session
-from redis import Redis
-from typing import Optional
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from redis.asyncio import Redis
+from redis.exceptions import NoScriptError, ResponseError
+from typing import Optional, Tuple
 from .model import CreateGameModel, GameModel, UpdateGameModel
 from .schema import GameSchema
+from . import ai, codec, engine, events, scripts, stats, tournament
+from .flusher import DIRTY_GAMES, GameFlusher
+from .cache import GameCache
+from .lifecycle import GAME_EXPIRY, GameReaper
+from metrics import Metrics
 from datetime import datetime
+import logging
 import os
-import json
+import orjson
 
-def create(data: CreateGameModel, db:Session, redis_db:Redis, game_id: Optional[str] = None) -> dict:
+logger = logging.getLogger("uvicorn")
+metrics = Metrics.get_instance()
+
+def game_key(game_id) -> int:
+    try:
+        return int(game_id)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=404, detail="Game not found")
+
+# game ids come from Redis so games can be created without a SQL round trip
+GAME_ID = "GAME_ID"
+
+async def next_game_id(redis_db: Redis) -> int:
+    return int(await redis_db.incr(GAME_ID))
+
+async def next_game_ids(count: int, redis_db: Redis) -> range:
+    # a block of ids in one round trip
+    last_id = int(await redis_db.incrby(GAME_ID, count))
+    return range(last_id - count + 1, last_id + 1)
+
+async def sync_game_ids(db: AsyncSession, redis_db: Redis) -> int:
+    # start above every id SQL already has
+    last_id = (await db.execute(select(func.max(GameSchema.id)))).scalar()
+    return await scripts.RAISE_COUNTER(redis_db, [GAME_ID], [last_id or 0])
+
+def win_length_for(board_size: int, win_length: Optional[int] = None) -> int:
+    win_length = win_length or min(board_size, 5)
+    if win_length > board_size:
+        raise HTTPException(status_code=400, detail="Win length is longer than the board")
+    return win_length
+
+async def create(data: CreateGameModel, db:AsyncSession, redis_db:Redis, game_id: Optional[str] = None) -> dict:
     game = None
+    seq = 0
+    previous_state = None
+    operation = "create" if game_id is None else "join"
     if game_id is not None:
-        game_exist = db.query(GameSchema).filter(GameSchema.id == game_id).limit(1)
+        with metrics.time(operation, "sql_get"):
+            game_exist = await db.get(GameSchema, game_key(game_id))
 
-        if game_exist.count() == 0:
+        if game_exist is None:
             raise HTTPException(status_code=404, detail="Game not found")
-        if game_exist.first().is_over:
+        if game_exist.is_over:
             raise HTTPException(status_code=400, detail="Game is over")
-        if game_exist.first().player1 is not None and game_exist.first().player2 is not None:
+        if game_exist.player1 is not None and game_exist.player2 is not None:
             raise HTTPException(status_code=400, detail="Game is full")
-        if redis_db.hexists(f"GAME_{game_id}", "data") == False:
+        with metrics.time(operation, "redis_get"):
+            previous_state = await redis_db.hget(f"GAME_{game_id}", "state")
+            expired = previous_state is None and await redis_db.hexists(f"GAME_{game_id}", "data") == False
+        if expired:
             raise HTTPException(status_code=404, detail="Game has expired")    
+        seq = codec.state_seq(previous_state) + 1 if previous_state is not None else 1
         
-        game = game_exist.first()
+        game = game_exist
         game.player2 = data.player
 
     if game is None:
-        game = GameSchema(**data.model_dump(exclude=['player']))
+        win_length = win_length_for(data.board_size, data.win_length)
+        if data.mode == "AI" and (data.board_size, win_length) != (engine.BOARD_SIZE, engine.BOARD_SIZE):
+            raise HTTPException(status_code=400, detail="AI games are played on a 3x3 board")
+        game = GameSchema(**data.model_dump(exclude=['player', 'difficulty', 'win_length']))
+        game.win_length = win_length
         game.player1 = data.player
+        if data.mode == "AI":
+            # the bot takes the second seat right away
+            game.player2 = ai.BOT_PLAYER
+            game.difficulty = data.difficulty
 
     game.player1_symbol = 'X'
     game.player2_symbol = 'O'
@@ -41,98 +96,319 @@ def create(data: CreateGameModel, db:Session, redis_db:Redis, game_id: Optional[
     game.updated_at = datetime.now().__str__()
     game.updated_by = data.player
     game.created_by = game.player1 or data.player
+    # games from before board sizes are 3x3
+    size = game.board_size = game.board_size or engine.BOARD_SIZE
+    game.win_length = game.win_length or engine.BOARD_SIZE
+    game.board = [[''] * size for _ in range(size)]
 
     if game.id == None:
+        with metrics.time(operation, "redis_id"):
+            game.id = await next_game_id(redis_db)
         db.add(game)
         
-    db.commit()
-    gameModel = GameModel.model_validate(game)
-    gameModel.board = ['', '', ''], ['', '', ''], ['', '', '']
+    with metrics.time(operation, "commit"):
+        await db.commit()
+    with metrics.time(operation, "validate"):
+        gameModel = GameModel.model_validate(game)
+    gameModel.board = tuple([''] * size for _ in range(size))
+    gameModel.seq = seq
 
     # add to redis
-    redis_db.hset(f"GAME_{game.id}", "data", json.dumps(gameModel.model_dump()))
-    # redis_db.expire(f"GAME_{game.id}", int(os.getenv("GAME_EXPIRE_TIME", "60")))
+    with metrics.time(operation, "redis_write"):
+        mapping = codec.encode_game(gameModel.model_dump(), seq)
+        await redis_db.hset(f"GAME_{game.id}", mapping=mapping)
+        if game_id is not None and previous_state is None:
+            await redis_db.hdel(f"GAME_{game.id}", "data")
+        if game_id is not None:
+            try:
+                await redis_db.xadd(events.events_key(game.id), {"state": mapping["state"]}, id=f"{seq}-0", maxlen=events.EVENT_LOG_SIZE)
+            except ResponseError as e:
+                # an older log can be ahead of this seq, as in APPLY_MOVE's
+                # pcall the join stands without its event
+                logger.warning(f"Failed to log the join of game {game.id}: {e}")
+        await redis_db.zadd(GAME_EXPIRY, {f"GAME_{game.id}": GameReaper.get_instance().deadline()})
+    if game_id is not None:
+        GameCache.get_instance().invalidate(game_id)
 
     return gameModel.model_dump()
 
-def update(update_data: UpdateGameModel, game_id: str, db:Session, redis_db:Redis):
-    data = UpdateGameModel.model_validate(update_data, from_attributes=True, strict=False)
-    if db.query(GameSchema).filter(GameSchema.id == game_id).first() == None:
-        raise HTTPException(status_code=404, detail="Game not found")
-    if redis_db.hexists(f"GAME_{game_id}", "data") == False:
-        raise HTTPException(status_code=404, detail="Game has expired")
-    
-    game_data = redis_db.hget(f"GAME_{game_id}", "data").decode('utf-8').replace("'", '"')
-    game = GameModel.model_validate(json.loads(game_data), from_attributes=True, strict=False)
+def new_game(game_id: int, player1: str, player2: str, board_size: int = engine.BOARD_SIZE, win_length: int = engine.BOARD_SIZE) -> dict:
+    # a game with both players seated, as create() leaves it once player2 joined
+    now = datetime.now().__str__()
+    return GameModel(id=game_id, board=tuple([''] * board_size for _ in range(board_size)),
+                     is_draw=False, is_over=False, player1=player1, player2=player2,
+                     player1_symbol='X', player2_symbol='O', turn=player1, status='INIT',
+                     created_by=player1, updated_by=player2, created_at=now, updated_at=now, mode="PVP", seq=0,
+                     board_size=board_size, win_length=win_length).model_dump(mode="json")
 
-    if game is None:
-        raise HTTPException(status_code=404, detail="Game not found")
-    if game.turn != data.turn:
-        raise HTTPException(status_code=400, detail="It's not your turn")
-    if game.is_over:
-        raise HTTPException(status_code=400, detail="Game is over")
-    if len(data.move) != 2: 
-        raise HTTPException(status_code=400, detail="Invalid move")
-    if 0 > data.move[0]  or data.move[0] >  2 or 0 > data.move[1] or data.move[1]  >  2:
-        raise HTTPException(status_code=400, detail="Invalid move") 
-    if game.player1 != data.turn and game.player2 != data.turn:
-        raise HTTPException(status_code=400, detail="It's not your turn")
-    
-    board = game.board
-    
-    if board[data.move[0]][data.move[1]] != '':
-        raise HTTPException(status_code=400, detail="Invalid move")
+def queue_new_game(pipe, game: dict, deadline: int):
+    # games made in Redis only, the flusher inserts their SQL row
+    pipe.hset(f"GAME_{game['id']}", mapping=codec.encode_game(game))
+    pipe.hset(DIRTY_GAMES, f"GAME_{game['id']}", 0)
+    pipe.zadd(GAME_EXPIRY, {f"GAME_{game['id']}": deadline})
 
-    symbol = ''
-    if data.turn == game.player1:
-        symbol = game.player1_symbol
-    else:
-        symbol = game.player2_symbol
-
-    board[data.move[0]][data.move[1]] = symbol
-
-    game.move = data.move
-
-    isOver = False
-    if board[data.move[0]][0] == symbol and board[data.move[0]][1] == symbol and board[data.move[0]][2] == symbol:
-        isOver = True
-    if board[0][data.move[1]] == symbol and board[1][data.move[1]] == symbol and board[2][data.move[1]] == symbol:
-        isOver = True
-    if board[0][0] == symbol and board[1][1] == symbol and board[2][2] == symbol:
-        isOver = True
-    if board[0][2] == symbol and board[1][1] == symbol and board[2][0] == symbol:
-        isOver = True
-
-    if isOver:
-        game.is_over = True
-        game.winner = data.turn
-        game.updated_at = datetime.now().__str__()
-        game.updated_by = data.turn
-        game.board = board
-        game.status = 'FINISH'
-        game.is_draw = False
-    elif board[0][0] != '' and board[0][1] != '' and board[0][2] != '' and board[1][0] != '' and board[1][1] != '' and board[1][2] != '' and board[2][0] != '' and board[2][1] != '' and board[2][2] != '':
-        game.is_draw = True
-        game.is_over = True
-        game.status = 'FINISH'
-        game.winner = None
-    else:
-        game.is_over = False
-        game.is_draw = False
-        game.status = 'IN_PROGRESS'
-        game.turn = game.player2 if data.turn == game.player1 else game.player1
-    
-    game.updated_at = datetime.now().__str__()
-    game.updated_by = data.turn
-    game.board = board
+async def create_matched(game_id: int, player1: str, player2: str, redis_db: Redis) -> dict:
+    game = new_game(game_id, player1, player2)
+    async with redis_db.pipeline(transaction=True) as pipe:
+        queue_new_game(pipe, game, GameReaper.get_instance().deadline())
+        await pipe.execute()
+    GameFlusher.get_instance().notify()
+    return game
+
+# script error codes -> responses
+MOVE_ERRORS = {
+    "NOT_YOUR_TURN": (400, "It's not your turn"),
+    "GAME_OVER": (400, "Game is over"),
+    "INVALID_MOVE": (400, "Invalid move"),
+    # still unreadable after migrate_game: a codec version this worker does not know
+    "MIGRATE": (500, "Game state could not be read"),
+}
+
+def move_script_args(game_id, turn: str, row: int, col: int, updated_at: int, deadlines: list) -> Tuple[list, list]:
+    # KEYS and ARGV of APPLY_MOVE
+    move_keys = [f"GAME_{game_id}", DIRTY_GAMES, GAME_EXPIRY, stats.LEADERBOARD, stats.DIRTY_PLAYERS, events.events_key(game_id)]
+    move_args = [turn, row, col, updated_at, *deadlines, stats.PLAYER_STATS_PREFIX, events.EVENT_LOG_SIZE]
+    return move_keys, move_args
 
-    game_record = db.query(GameSchema).filter_by(id=game.id).first()
-    for key, value in game.model_dump().items():
-        setattr(game_record, key, value)
+async def apply_move(game_id: str, turn: str, row: int, col: int, db: AsyncSession, redis_db: Redis) -> list:
+    # turn ownership, empty cell, outcome and state write in one round trip
+    move_keys, move_args = move_script_args(game_id, turn, row, col, codec.encode_timestamp(datetime.now().__str__()),
+                                            GameReaper.get_instance().move_deadlines())
+    result = await scripts.APPLY_MOVE(redis_db, move_keys, move_args)
+    code = result[0].decode('utf-8')
+    if code == "MIGRATE":
+        await migrate_game(game_id, redis_db)
+        result = await scripts.APPLY_MOVE(redis_db, move_keys, move_args)
+        code = result[0].decode('utf-8')
 
-    db.commit()
+    if code != "OK":
+        raise await move_error(code, game_id, db)
+    return result
 
-    redis_db.hset(f"GAME_{game_id}","data", json.dumps(game.model_dump()))
-    # redis_db.expire(f"GAME_{game.id}", int(os.getenv("GAME_EXPIRE_TIME", "60")))
+async def move_error(code: str, game_id, db: AsyncSession) -> HTTPException:
+    # the response to an APPLY_MOVE error code
+    if code == "EXPIRED":
+        if await db.get(GameSchema, game_key(game_id)) == None:
+            return HTTPException(status_code=404, detail="Game not found")
+        return HTTPException(status_code=404, detail="Game has expired")
+    if code == "MIGRATE":
+        logger.warning(f"Game {game_id} has a state this worker cannot read")
+    status_code, detail = MOVE_ERRORS[code]
+    return HTTPException(status_code=status_code, detail=detail)
+
+async def update(update_data: UpdateGameModel, game_id: str, db:AsyncSession, redis_db:Redis):
+    with metrics.time("update", "validate"):
+        data = UpdateGameModel.model_validate(update_data, from_attributes=True, strict=False)
+        try:
+            row, col = (int(value) for value in data.move) if len(data.move) == 2 else (-1, -1)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid move")
+
+    with metrics.time("update", "apply_move"):
+        result = await apply_move(game_id, data.turn, row, col, db, redis_db)
+    with metrics.time("update", "decode"):
+        game = codec.decode_game(game_id, dict(zip(codec.HASH_FIELDS, result[1:])))
+
+    if game["mode"] == "AI" and game["turn"] == ai.BOT_PLAYER and not game["is_over"]:
+        # the bot answers within the same turn
+        with metrics.time("update", "bot_move"):
+            row, col = ai.Solver.get_instance().choose_move(*codec.state_masks(result[1]), game["difficulty"])
+            result = await apply_move(game_id, ai.BOT_PLAYER, row, col, db, redis_db)
+            game = codec.decode_game(game_id, dict(zip(codec.HASH_FIELDS, result[1:])))
+
+    await moved(game_id, game, redis_db)
+    return game
+
+async def apply_moves(moves: list, db: AsyncSession, redis_db: Redis) -> list:
+    # apply_move for (game_id, turn, row, col) on different games in one
+    # pipeline, the APPLY_MOVE reply or the HTTPException of each move
+    updated_at = codec.encode_timestamp(datetime.now().__str__())
+    deadlines = GameReaper.get_instance().move_deadlines()
+    calls = [move_script_args(game_id, turn, row, col, updated_at, deadlines) for game_id, turn, row, col in moves]
+    async with redis_db.pipeline(transaction=False) as pipe:
+        for move_keys, move_args in calls:
+            pipe.evalsha(scripts.APPLY_MOVE.sha, len(move_keys), *move_keys, *move_args)
+        try:
+            results = await pipe.execute(raise_on_error=False)
+        except Exception as e:
+            results = [e] * len(calls)
+
+    replies = []
+    expired = []
+    for index, ((game_id, turn, row, col), (move_keys, move_args), result) in enumerate(zip(moves, calls, results)):
+        if isinstance(result, NoScriptError):
+            # Redis lost its scripts, the rest of the pipeline failed the same way
+            try:
+                result = await scripts.APPLY_MOVE(redis_db, move_keys, move_args)
+            except Exception as e:
+                result = e
+        if isinstance(result, Exception):
+            # the moves before it are applied, only this one failed
+            logger.warning(f"Failed to apply a move to game {game_id}: {result}")
+            replies.append(HTTPException(status_code=503, detail="Move could not be saved"))
+            continue
+        code = result[0].decode('utf-8')
+        if code == "MIGRATE":
+            try:
+                result = await apply_move(game_id, turn, row, col, db, redis_db)
+            except HTTPException as httpex:
+                result = httpex
+        elif code == "EXPIRED":
+            expired.append(index)
+        elif code != "OK":
+            status_code, detail = MOVE_ERRORS[code]
+            result = HTTPException(status_code=status_code, detail=detail)
+        replies.append(result)
+
+    if expired:
+        # one query tells the expired games from the ones that never existed
+        game_ids = {game_key(moves[index][0]) for index in expired}
+        known = set(await db.scalars(select(GameSchema.id).where(GameSchema.id.in_(game_ids))))
+        for index in expired:
+            replies[index] = HTTPException(status_code=404, detail="Game has expired" if game_key(moves[index][0]) in known else "Game not found")
+    return replies
+
+async def update_many(moves: list, db: AsyncSession, redis_db: Redis) -> list:
+    # update for a list of BatchMoveModel, the games after each move or the
+    # HTTPException it was refused with, in order. A round plays the next
+    # move of every game in the batch in one pipeline, then the bot answers
+    # of the AI games in another
+    replies = [None] * len(moves)
+    rounds = []
+    played = {}
+    with metrics.time("update_many", "validate"):
+        for index, data in enumerate(moves):
+            try:
+                row, col = (int(value) for value in data.move) if len(data.move) == 2 else (-1, -1)
+            except (TypeError, ValueError):
+                replies[index] = HTTPException(status_code=400, detail="Invalid move")
+                continue
+            nth = played.get(data.game_id, 0)
+            played[data.game_id] = nth + 1
+            if nth == len(rounds):
+                rounds.append([])
+            rounds[nth].append((index, (str(data.game_id), data.turn, row, col)))
+
+    games = {}
+    for moves_round in rounds:
+        with metrics.time("update_many", "apply_moves"):
+            results = await apply_moves([move for _, move in moves_round], db, redis_db)
+        bot_moves = []
+        for (index, (game_id, _, _, _)), result in zip(moves_round, results):
+            if isinstance(result, HTTPException):
+                replies[index] = result
+                continue
+            game = codec.decode_game(game_id, dict(zip(codec.HASH_FIELDS, result[1:])))
+            if game["mode"] == "AI" and game["turn"] == ai.BOT_PLAYER and not game["is_over"]:
+                with metrics.time("update_many", "bot_move"):
+                    row, col = ai.Solver.get_instance().choose_move(*codec.state_masks(result[1]), game["difficulty"])
+                bot_moves.append((index, (game_id, ai.BOT_PLAYER, row, col)))
+            replies[index] = games[game_id] = game
+        if bot_moves:
+            with metrics.time("update_many", "apply_moves"):
+                results = await apply_moves([move for _, move in bot_moves], db, redis_db)
+            for (index, (game_id, _, _, _)), result in zip(bot_moves, results):
+                # like update, the player's move stays played when the bot's fails
+                if isinstance(result, HTTPException):
+                    replies[index] = result
+                else:
+                    replies[index] = games[game_id] = codec.decode_game(game_id, dict(zip(codec.HASH_FIELDS, result[1:])))
+
+    await moved_many(games, redis_db)
+    return replies
+
+async def moved(game_id, game: dict, redis_db: Redis):
+    await moved_many({game_id: game}, redis_db)
+
+async def moved_many(games: dict, redis_db: Redis):
+    # game id -> the game after its last move
+    for game_id in games:
+        GameCache.get_instance().invalidate(game_id)
+    # SQL is written behind the move, finished games reach it before the reply,
+    # all in one commit
+    flusher = GameFlusher.get_instance()
+    finished = {game_id: game for game_id, game in games.items() if game["is_over"]}
+    if finished:
+        try:
+            with metrics.time("update", "persist"):
+                await flusher.flush_finished({f"GAME_{game_id}": game["seq"] for game_id, game in finished.items()}, redis_db)
+        except Exception as e:
+            logger.warning(f"Failed to persist finished games {', '.join(map(str, finished))}, left for the flusher: {e}")
+        for game_id, game in finished.items():
+            try:
+                with metrics.time("update", "tournament"):
+                    await tournament.game_finished(game_id, game, redis_db)
+            except Exception as e:
+                logger.warning(f"Failed to record game {game_id} in its tournament: {e}")
+    if len(finished) < len(games):
+        flusher.notify()
+
+def spectator_delta(game: dict) -> dict:
+    # only what a move changes, with the board as one string ("X.O......")
+    return {
+        "type": "move",
+        "seq": game["seq"],
+        "board": "".join(cell or "." for row in game["board"] for cell in row),
+        "move": game["move"],
+        "turn": game["turn"],
+        "status": game["status"],
+        "winner": game["winner"],
+        "is_draw": game["is_draw"],
+        "is_over": game["is_over"],
+        "updated_by": game["updated_by"],
+        "updated_at": game["updated_at"],
+    }
+
+async def spectator_snapshot(game_id, redis_db: Redis) -> Optional[str]:
+    game = await get_game(game_id, redis_db) if str(game_id).isdigit() else None
+    return None if game is None else orjson.dumps({"type": "snapshot", **game}).decode("utf-8")
+
+async def get_game(game_id, redis_db: Redis) -> Optional[dict]:
+    fields = await redis_db.hgetall(f"GAME_{game_id}")
+    if b"state" not in fields:
+        if b"data" not in fields:
+            return None
+        await migrate_game(game_id, redis_db)
+        fields = await redis_db.hgetall(f"GAME_{game_id}")
+    return codec.decode_game(game_id, fields)
+
+def game_etag(game_id, seq: int) -> str:
+    # every write to a game bumps its seq
+    return f'"{game_id}.{seq}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    return any(tag.strip().removeprefix("W/") in (etag, "*") for tag in if_none_match.split(","))
+
+async def read_game(game_id, redis_db: Redis, if_none_match: Optional[str] = None) -> Tuple[str, Optional[bytes]]:
+    # (etag, JSON body), no body when the client's copy is current. Only the
+    # state is read to check the version, the game is decoded on a cache miss
+    cache = GameCache.get_instance()
+    state = await redis_db.hget(f"GAME_{game_id}", "state")
+    if state is not None and state[0] in (codec.VERSION, codec.LARGE_VERSION):
+        seq = codec.state_seq(state)
+        etag = game_etag(game_id, seq)
+        if etag_matches(if_none_match, etag):
+            return etag, None
+        body = cache.get(game_id, seq)
+        if body is not None:
+            return etag, body
+
+    game = await get_game(game_id, redis_db)
+    if game is None:
+        raise HTTPException(status_code=404, detail="Game not found")
+    body = orjson.dumps(game)
+    cache.put(game_id, game["seq"], body)
+    etag = game_etag(game_id, game["seq"])
+    return etag, None if etag_matches(if_none_match, etag) else body
 
-    return game.model_dump()
\ No newline at end of file
+async def migrate_game(game_id, redis_db: Redis) -> bool:
+    # rewrites a JSON "data" blob with the compact codec, the script makes sure
+    # the blob was not migrated (and moved on) in the meantime
+    data = await redis_db.hget(f"GAME_{game_id}", "data")
+    if data is None:
+        return False
+    mapping = codec.from_legacy(data)
+    args = [value for field_value in mapping.items() for value in field_value]
+    return bool(await scripts.MIGRATE_GAME(redis_db, [f"GAME_{game_id}"], args))
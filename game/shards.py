@@ -0,0 +1,176 @@
+from fastapi import HTTPException
+from typing import Optional
+from redis_database import AsyncRedisDB
+from database import AsyncDB
+from .model import UpdateGameModel
+from .actors import GameActors
+import game.service as gameService
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import os
+import uuid
+
+logger = logging.getLogger("uvicorn")
+
+# Every game belongs to one shard (a worker) picked by consistent hashing of
+# its id, so adding a shard only moves about 1/n of the games. The owner
+# plays the game's moves in memory with game.actors, moves that reach
+# another worker are forwarded to the owner on its channel and the reply
+# comes back on the sender's, like matchmaking assignments. Sharding is off
+# unless GAME_SHARDS lists the shards and GAME_SHARD names this worker's:
+# without it every worker plays moves through service.update.
+CHANNEL_PREFIX = "SHARD_"
+
+def shard_hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+class ShardRing:
+    def __init__(self, shards: list, replicas: int = 64):
+        # a few points per shard on the ring evens out the arcs
+        points = sorted((shard_hash(f"{shard}#{replica}"), shard) for shard in shards for replica in range(replicas))
+        self.hashes = [point for point, _ in points]
+        self.shards = [shard for _, shard in points]
+
+    def owner(self, game_id) -> str:
+        index = bisect.bisect(self.hashes, shard_hash(str(game_id)))
+        return self.shards[index % len(self.shards)]
+
+class GameShards:
+    instance = None
+    def __init__(self, shards: Optional[list] = None, shard: Optional[str] = None, timeout: float = 5.0, redis_db = None, actors: Optional[GameActors] = None):
+        self.ring = ShardRing(shards) if shards else None
+        self.shard = shard
+        self.timeout = timeout
+        self.redis = redis_db
+        self.actors = actors or GameActors()
+        # replies to forwarded moves come back on a channel of this process
+        self.worker_id = uuid.uuid4().hex
+        self.pubsub = None
+        self.listener: Optional[asyncio.Task] = None
+        self.waiting: dict[str, asyncio.Future] = {}
+        self.forwarded = 0
+        if self.ring is not None and shard not in shards:
+            raise ValueError(f"GAME_SHARD {shard!r} is not one of GAME_SHARDS")
+
+    async def start(self, redis_db = None):
+        self.redis = redis_db or self.redis or AsyncRedisDB.get_db()
+        if self.ring is None:
+            return
+        await self.actors.start(self.redis)
+        if self.pubsub is None:
+            self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            await self.pubsub.subscribe(CHANNEL_PREFIX + self.shard, CHANNEL_PREFIX + self.worker_id)
+            self.listener = asyncio.get_running_loop().create_task(self.listen())
+
+    async def stop(self):
+        if self.listener is not None:
+            self.listener.cancel()
+            try:
+                await self.listener
+            except asyncio.CancelledError:
+                pass
+            self.listener = None
+        if self.pubsub is not None:
+            await self.pubsub.aclose()
+            self.pubsub = None
+        await self.actors.stop()
+
+    async def listen(self):
+        while True:
+            try:
+                event = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if event is None or event["type"] != "message":
+                    continue
+                message = json.loads(event["data"])
+                if message["type"] == "move":
+                    asyncio.get_running_loop().create_task(self.play_forwarded(message))
+                    continue
+                waiter = self.waiting.pop(message["id"], None)
+                if waiter is not None and not waiter.done():
+                    waiter.set_result(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Game shard listener error: {e}")
+                await asyncio.sleep(1)
+
+    async def play_forwarded(self, message: dict):
+        reply = {"type": "reply", "id": message["id"]}
+        try:
+            async with AsyncDB.get_instance().SessionLocal() as db:
+                reply["game"] = await self.move(message["move"], message["game_id"], db, self.redis)
+            await self.actors.settle(message["game_id"])
+        except HTTPException as e:
+            reply["error"] = [e.status_code, e.detail]
+        except Exception as e:
+            reply["error"] = [500, str(e)]
+        await self.redis.publish(CHANNEL_PREFIX + message["reply_to"], json.dumps(reply, default=str))
+
+    def owns(self, game_id) -> bool:
+        return self.ring is None or self.ring.owner(game_id) == self.shard
+
+    async def settle(self, game_id):
+        # before a game is read from Redis: the moves its actor on this
+        # worker answered are replayed, forwarded moves are settled by the
+        # owner before their reply
+        if self.ring is not None:
+            await self.actors.settle(str(game_id))
+
+    async def move(self, update_data, game_id: str, db, redis_db) -> dict:
+        # the game after the move, wherever it is played
+        data = UpdateGameModel.model_validate(update_data, from_attributes=True, strict=False)
+        if self.ring is None:
+            return await gameService.update(data, game_id, db, redis_db)
+        owner = self.ring.owner(game_id)
+        if owner == self.shard:
+            return await self.actors.move(data, game_id, db, redis_db)
+
+        request_id = uuid.uuid4().hex
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiting[request_id] = waiter
+        try:
+            message = {"type": "move", "id": request_id, "reply_to": self.worker_id, "game_id": game_id, "move": data.model_dump()}
+            if not await (redis_db or self.redis).publish(CHANNEL_PREFIX + owner, json.dumps(message)):
+                raise HTTPException(status_code=503, detail="Game shard unavailable")
+            reply = await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Game shard unavailable")
+        finally:
+            self.waiting.pop(request_id, None)
+        self.forwarded += 1
+        if "error" in reply:
+            raise HTTPException(status_code=reply["error"][0], detail=reply["error"][1])
+        return reply["game"]
+
+    async def move_many(self, moves: list, db, redis_db) -> list:
+        # the games after a list of BatchMoveModel, or the HTTPException each
+        # move was refused with. Unsharded the batch is pipelined by
+        # service.update_many, sharded every move goes to its owner like
+        # move does: one game's moves in turn, the games side by side
+        if self.ring is None:
+            return await gameService.update_many(moves, db, redis_db)
+        replies = [None] * len(moves)
+        games = {}
+        for index, data in enumerate(moves):
+            games.setdefault(str(data.game_id), []).append(index)
+
+        async def play(game_id: str, indexes: list):
+            # a session per game, one session cannot be shared by concurrent moves
+            async with AsyncDB.get_instance().SessionLocal() as game_db:
+                for index in indexes:
+                    try:
+                        replies[index] = await self.move(moves[index], game_id, game_db, redis_db)
+                    except HTTPException as e:
+                        replies[index] = e
+        await asyncio.gather(*(play(game_id, indexes) for game_id, indexes in games.items()))
+        return replies
+
+    @staticmethod
+    def get_instance():
+        if GameShards.instance is None:
+            shards = [shard.strip() for shard in os.getenv("GAME_SHARDS", "").split(",") if shard.strip()]
+            GameShards.instance = GameShards(shards or None, os.getenv("GAME_SHARD"), float(os.getenv("SHARD_TIMEOUT", "5")))
+        return GameShards.instance
@@ -0,0 +1,127 @@
+# Self-play on the bitboard engine, for bot tuning and replay load tests.
+# Games are played in lockstep: every column below is a NumPy array with an
+# entry per game, and each ply moves all unfinished games at once through
+# the engine's outcome table (and the solver's score table for bots).
+# Chunks of games run on a process pool and are saved as one compressed
+# columnar .npz:
+#   moves    (games, 9) uint8, cells in play order, NO_MOVE after the end
+#   length   uint8, moves played
+#   outcome  uint8, engine.PLAYER1_WIN / PLAYER2_WIN / DRAW
+#
+#   python -m game.simulate --games 1000000 --player1 RANDOM --player2 MEDIUM --workers 4 --output games.npz
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from . import ai, engine
+import argparse
+import os
+import time
+import numpy as np
+
+POLICIES = ("RANDOM", *ai.DIFFICULTIES)
+NO_MOVE = 255
+CELLS = engine.BOARD_SIZE * engine.BOARD_SIZE
+CELL_BITS = (1 << np.arange(CELLS)).astype(np.uint16)
+OUTCOMES = np.frombuffer(engine.OUTCOMES, dtype=np.uint8)
+
+# score table of the worker process, set by _init_worker
+_scores: Optional[np.ndarray] = None
+
+def score_table() -> np.ndarray:
+    # (position, cell) scores for the player to move, ai.ILLEGAL where taken
+    return np.frombuffer(ai.Solver.get_instance().score_table(), dtype=np.int8).reshape(-1, CELLS)
+
+def _choose(policy: str, player1: np.ndarray, player2: np.ndarray, free: np.ndarray, rng, scores) -> np.ndarray:
+    keys = rng.random(free.shape)
+    if policy == "RANDOM":
+        keys[~free] = -1
+        return keys.argmax(axis=1)
+    # same rule as ai.Solver.choose_move: the best cell, or with the
+    # difficulty's chance a strictly worse one when there is one
+    scored = scores[player1.astype(np.int32) << 9 | player2]
+    best = scored.argmax(axis=1)
+    mistake = ai.DIFFICULTIES[policy]
+    if not mistake:
+        return best
+    worse = free & (scored < scored.max(axis=1, keepdims=True))
+    keys[~worse] = -1
+    blunder = (rng.random(len(free)) < mistake) & worse.any(axis=1)
+    return np.where(blunder, keys.argmax(axis=1), best)
+
+def simulate(games: int, player1: str = "RANDOM", player2: str = "RANDOM", seed = 0, scores: Optional[np.ndarray] = None) -> dict:
+    if scores is None and (player1 != "RANDOM" or player2 != "RANDOM"):
+        scores = score_table()
+    rng = np.random.default_rng(seed)
+    masks = np.zeros((2, games), dtype=np.uint16)
+    moves = np.full((games, CELLS), NO_MOVE, dtype=np.uint8)
+    length = np.zeros(games, dtype=np.uint8)
+    outcome = np.zeros(games, dtype=np.uint8)
+    policies = (player1, player2)
+    for ply in range(CELLS):
+        active = np.flatnonzero(outcome == engine.IN_PROGRESS)
+        if not active.size:
+            break
+        mover = ply % 2
+        player1_masks, player2_masks = masks[0, active], masks[1, active]
+        free = ((player1_masks | player2_masks)[:, None] & CELL_BITS) == 0
+        cells = _choose(policies[mover], player1_masks, player2_masks, free, rng, scores)
+        masks[mover, active] |= CELL_BITS[cells]
+        moves[active, ply] = cells
+        length[active] = ply + 1
+        outcome[active] = OUTCOMES[masks[0, active].astype(np.int32) << 9 | masks[1, active]]
+    return {"moves": moves, "length": length, "outcome": outcome}
+
+def _init_worker(scores: Optional[bytes]):
+    global _scores
+    _scores = None if scores is None else np.frombuffer(scores, dtype=np.int8).reshape(-1, CELLS)
+
+def _simulate_chunk(args: tuple) -> dict:
+    games, player1, player2, seed = args
+    return simulate(games, player1, player2, seed, _scores)
+
+def run(games: int, player1: str = "RANDOM", player2: str = "RANDOM", workers: int = 1, chunk_size: int = 100_000, seed: int = 0) -> dict:
+    # chunks get their own seeds from one SeedSequence, so a run is repeatable
+    # whatever the number of workers
+    sizes = [min(chunk_size, games - start) for start in range(0, games, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    scores = score_table() if (player1, player2) != ("RANDOM", "RANDOM") else None
+    if workers <= 1:
+        chunks = [simulate(size, player1, player2, chunk_seed, scores) for size, chunk_seed in zip(sizes, seeds)]
+    else:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(None if scores is None else scores.tobytes(),)) as pool:
+            chunks = list(pool.map(_simulate_chunk, [(size, player1, player2, chunk_seed) for size, chunk_seed in zip(sizes, seeds)]))
+    if not chunks:
+        return simulate(0)
+    return {column: np.concatenate([chunk[column] for chunk in chunks]) for column in chunks[0]}
+
+def save(path: str, columns: dict, **meta):
+    np.savez_compressed(path, **columns, **{key: np.asarray(value) for key, value in meta.items()})
+
+def load(path: str) -> dict:
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=1_000_000)
+    parser.add_argument('--player1', choices=POLICIES, default="RANDOM")
+    parser.add_argument('--player2', choices=POLICIES, default="RANDOM")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunk-size', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the games to this .npz")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    columns = run(args.games, args.player1, args.player2, args.workers, args.chunk_size, args.seed)
+    elapsed = time.perf_counter() - start
+    counts = np.bincount(columns["outcome"], minlength=4)
+    print(f"{args.games} games ({args.player1} vs {args.player2}) in {elapsed:.2f}s on {args.workers} workers: "
+          f"{args.games / elapsed:,.0f} games/s, {args.games / elapsed / args.workers:,.0f} games/s per core")
+    print(f"player1 wins {counts[engine.PLAYER1_WIN] / args.games:.1%}  player2 wins {counts[engine.PLAYER2_WIN] / args.games:.1%}  "
+          f"draws {counts[engine.DRAW] / args.games:.1%}  mean length {columns['length'].mean():.2f}")
+    if args.output:
+        save(args.output, columns, player1=args.player1, player2=args.player2, seed=args.seed)
+        print(f"wrote {os.path.getsize(args.output) / args.games:.2f} bytes per game to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from redis.asyncio import Redis
+from .schema import PlayerSchema
+
+# Win/loss/draw counters are kept in Redis by scripts.APPLY_MOVE when a PVP
+# game finishes: a PLAYER_STATS_{name} hash per player and the LEADERBOARD
+# sorted set scored by wins. Players counted since the last flush wait in
+# DIRTY_PLAYERS (name -> games) and the flusher copies them to SQL.
+LEADERBOARD = "LEADERBOARD"
+DIRTY_PLAYERS = "DIRTY_PLAYERS"
+PLAYER_STATS_PREFIX = "PLAYER_STATS_"
+STATS_LOADED = "PLAYER_STATS_LOADED"
+STAT_FIELDS = ("wins", "losses", "draws", "games")
+
+def player_stats(name: str, values: list, rank = None) -> dict:
+    stats = {field: int(value or 0) for field, value in zip(STAT_FIELDS, values)}
+    return {"name": name, "rank": None if rank is None else rank + 1, **stats}
+
+async def get_player_stats(name: str, redis_db: Redis) -> dict:
+    async with redis_db.pipeline(transaction=False) as pipe:
+        pipe.hmget(PLAYER_STATS_PREFIX + name, STAT_FIELDS)
+        pipe.zrevrank(LEADERBOARD, name)
+        values, rank = await pipe.execute()
+    if rank is None:
+        raise HTTPException(status_code=404, detail="Player not found")
+    return player_stats(name, values, rank)
+
+async def get_leaderboard(offset: int, limit: int, redis_db: Redis) -> dict:
+    async with redis_db.pipeline(transaction=False) as pipe:
+        pipe.zcard(LEADERBOARD)
+        pipe.zrevrange(LEADERBOARD, offset, offset + limit - 1)
+        total, names = await pipe.execute()
+    names = [name.decode("utf-8") for name in names]
+    async with redis_db.pipeline(transaction=False) as pipe:
+        for name in names:
+            pipe.hmget(PLAYER_STATS_PREFIX + name, STAT_FIELDS)
+        values = await pipe.execute() if names else []
+    players = [player_stats(name, stats, offset + index) for index, (name, stats) in enumerate(zip(names, values))]
+    return {"total": total, "offset": offset, "limit": limit, "players": players}
+
+async def sync_player_stats(db: AsyncSession, redis_db: Redis, batch_size: int = 1000) -> int:
+    # reloads the counters from SQL when Redis starts empty, once per Redis
+    if not await redis_db.set(STATS_LOADED, 1, nx=True):
+        return 0
+    loaded = 0
+    result = await db.stream(select(PlayerSchema).execution_options(yield_per=batch_size))
+    async for players in result.scalars().partitions():
+        async with redis_db.pipeline(transaction=False) as pipe:
+            for player in players:
+                pipe.hset(PLAYER_STATS_PREFIX + player.name, mapping={field: getattr(player, field) for field in STAT_FIELDS})
+                pipe.zadd(LEADERBOARD, {player.name: player.wins})
+            await pipe.execute()
+        loaded += len(players)
+    return loaded
@@ -0,0 +1,236 @@
+from fastapi import HTTPException
+from redis.asyncio import Redis
+from datetime import datetime
+from websocket_connection_manager import WSConnectionManager
+from .model import CreateTournamentModel
+from .flusher import GameFlusher
+from .lifecycle import GameReaper
+from . import codec, scripts
+import game.service as gameService
+import orjson
+import os
+
+# Tournaments live in Redis next to the games they schedule:
+#   TOURNAMENT_{id}            format, status, round, games pending in the round, seq, players...
+#   TOURNAMENT_{id}_MATCHES    "{round}:{match}" -> game id and players, byes have no game
+#   TOURNAMENT_{id}_RESULTS    "{round}:{match}" -> winner, '' for a drawn round robin game
+#   TOURNAMENT_{id}_STANDINGS  round robin points, 2 for a win and 1 for a draw
+#   TOURNAMENT_{id}_SEEDS      knockout player -> seed, 0 is the top seed
+#   TOURNAMENT_{id}_REPLAYS    "{round}:{match}" -> drawn knockout games
+#   TOURNAMENT_GAMES           GAME_{id} -> "{tournament id}:{round}:{match}" until it finishes
+# The games of a round are created at once: one block of ids, then every
+# write in one MULTI, SQL rows come from the flusher like matchmade games.
+# service.update records finished games with scripts.RECORD_RESULT and the
+# worker whose result ends a round schedules the next one. Every change is
+# pushed with the tournament seq on the tournament's channel, subscribers
+# get a snapshot first like resuming game sockets. A drawn knockout game is
+# replayed with the seats swapped, up to TOURNAMENT_REPLAYS times, then the
+# higher seed goes through. A game that expires unfinished is forfeited by
+# the player whose turn it was (the reaper settles it), so a no-show cannot
+# hold a round.
+TOURNAMENT_ID = "TOURNAMENT_ID"
+TOURNAMENT_PREFIX = "TOURNAMENT_"
+TOURNAMENT_GAMES = "TOURNAMENT_GAMES"
+TOURNAMENT_EXPIRE_TIME = int(os.getenv("FINISHED_TOURNAMENT_EXPIRE_TIME", "86400"))
+TOURNAMENT_REPLAYS = int(os.getenv("TOURNAMENT_REPLAYS", "2"))
+
+def tournament_key(tournament_id) -> str:
+    return f"{TOURNAMENT_PREFIX}{tournament_id}"
+
+def channel_id(tournament_id) -> str:
+    return f"tournament_{tournament_id}"
+
+def bracket_order(size: int) -> list:
+    # seeds by bracket position, 0 meets size - 1 in the first round and
+    # the top seeds can only meet in the last rounds
+    order = [0]
+    while len(order) < size:
+        order = [seed for top in order for seed in (top, len(order) * 2 - 1 - top)]
+    return order
+
+def total_rounds(format: str, players: int) -> int:
+    if format == "ROUND_ROBIN":
+        return players + players % 2 - 1
+    return (players - 1).bit_length()
+
+def pairings(format: str, round: int, players: list, results: dict) -> list:
+    # (player1, player2) per match of the round, None is a bye
+    if format == "ROUND_ROBIN":
+        # circle method: the first player stays, the others rotate a seat per round
+        entrants = players + [None] * (len(players) % 2)
+        rest = entrants[1:]
+        shift = (round - 1) % len(rest)
+        seats = entrants[:1] + rest[len(rest) - shift:] + rest[:len(rest) - shift]
+        pairs = [(seats[index], seats[-1 - index]) for index in range(len(seats) // 2)]
+        # the fixed player switches seats every round and the rotating seats
+        # alternate, so everyone moves first in about half their games
+        return [pair if (round if index == 0 else index) % 2 else pair[::-1] for index, pair in enumerate(pairs)]
+    if round == 1:
+        # top seeds get the byes of an uneven field
+        size = 1 << (len(players) - 1).bit_length()
+        slots = [players[seed] if seed < len(players) else None for seed in bracket_order(size)]
+    else:
+        slots = [results[f"{round - 1}:{match}"] for match in range(1 << (total_rounds(format, len(players)) - round + 1))]
+    return list(zip(slots[::2], slots[1::2]))
+
+async def publish(tournament_id, message: dict):
+    await WSConnectionManager.get_instance().broadcast(message, channel_id(tournament_id))
+
+async def create_tournament(data: CreateTournamentModel, redis_db: Redis) -> dict:
+    if len(set(data.players)) != len(data.players):
+        raise HTTPException(status_code=400, detail="Players must be unique")
+    win_length = gameService.win_length_for(data.board_size, data.win_length)
+    tournament_id = int(await redis_db.incr(TOURNAMENT_ID))
+    key = tournament_key(tournament_id)
+    async with redis_db.pipeline(transaction=True) as pipe:
+        pipe.hset(key, mapping={
+            "format": data.format, "status": "IN_PROGRESS", "round": 0, "rounds": total_rounds(data.format, len(data.players)),
+            "pending": 0, "seq": 0, "players": orjson.dumps(data.players), "board_size": data.board_size,
+            "win_length": win_length, "winner": "", "created_at": datetime.now().__str__(),
+        })
+        if data.format == "ROUND_ROBIN":
+            pipe.zadd(key + "_STANDINGS", {player: 0 for player in data.players})
+        else:
+            pipe.hset(key + "_SEEDS", mapping={player: seed for seed, player in enumerate(data.players)})
+        await pipe.execute()
+    await start_round(tournament_id, redis_db)
+    return await get_tournament(tournament_id, redis_db)
+
+async def start_round(tournament_id, redis_db: Redis):
+    # only ever run by the worker that finished the previous round
+    key = tournament_key(tournament_id)
+    async with redis_db.pipeline(transaction=False) as pipe:
+        pipe.hgetall(key)
+        pipe.hgetall(key + "_RESULTS")
+        tournament, results = await pipe.execute()
+    tournament = {field.decode("utf-8"): value.decode("utf-8") for field, value in tournament.items()}
+    results = {field.decode("utf-8"): value.decode("utf-8") for field, value in results.items()}
+    format, players = tournament["format"], orjson.loads(tournament["players"])
+    round = int(tournament["round"]) + 1
+    if round > int(tournament["rounds"]):
+        await finish(tournament_id, format, round - 1, results, redis_db)
+        return
+
+    pairs = pairings(format, round, players, results)
+    game_ids = iter(await gameService.next_game_ids(sum(None not in pair for pair in pairs), redis_db))
+    board_size, win_length = int(tournament["board_size"]), int(tournament["win_length"])
+    matches, games, byes = [], {}, {}
+    for index, (player1, player2) in enumerate(pairs):
+        match = {"match": f"{round}:{index}", "round": round, "game_id": None, "player1": player1, "player2": player2, "winner": None}
+        if player1 is None or player2 is None:
+            if format != "ROUND_ROBIN":
+                match["winner"] = byes[match["match"]] = player1 or player2
+        else:
+            game = gameService.new_game(next(game_ids), player1, player2, board_size, win_length)
+            match["game_id"] = game["id"]
+            games[match["match"]] = game
+        matches.append(match)
+
+    deadline = GameReaper.get_instance().deadline()
+    async with redis_db.pipeline(transaction=True) as pipe:
+        for game in games.values():
+            gameService.queue_new_game(pipe, game, deadline)
+        if games:
+            pipe.hset(TOURNAMENT_GAMES, mapping={f"GAME_{game['id']}": f"{tournament_id}:{match}" for match, game in games.items()})
+        pipe.hset(key + "_MATCHES", mapping={match["match"]: orjson.dumps([match["game_id"], match["player1"], match["player2"]]) for match in matches})
+        if byes:
+            pipe.hset(key + "_RESULTS", mapping=byes)
+        pipe.hset(key, mapping={"round": round, "pending": len(games)})
+        pipe.hincrby(key, "seq", 1)
+        seq = (await pipe.execute())[-1]
+    GameFlusher.get_instance().notify(len(games))
+    await publish(tournament_id, {"type": "round", "seq": seq, "round": round, "matches": matches})
+
+async def finish(tournament_id, format: str, last_round: int, results: dict, redis_db: Redis):
+    key = tournament_key(tournament_id)
+    if format == "ROUND_ROBIN":
+        # a shared first place has no winner
+        leaders = await redis_db.zrevrange(key + "_STANDINGS", 0, 1, withscores=True)
+        winner = leaders[0][0].decode("utf-8") if len(leaders) == 1 or leaders[0][1] > leaders[1][1] else ""
+    else:
+        winner = results[f"{last_round}:0"]
+    async with redis_db.pipeline(transaction=True) as pipe:
+        pipe.hset(key, mapping={"status": "FINISH", "winner": winner})
+        pipe.hincrby(key, "seq", 1)
+        for suffix in ("", "_MATCHES", "_RESULTS", "_STANDINGS", "_SEEDS", "_REPLAYS"):
+            pipe.expire(key + suffix, TOURNAMENT_EXPIRE_TIME)
+        seq = (await pipe.execute())[1]
+    await publish(tournament_id, {"type": "finish", "seq": seq, "winner": winner or None})
+
+async def game_finished(game_id, game: dict, redis_db: Redis, forfeit: bool = False):
+    # called for every finished game, one script call answers nil for games outside tournaments
+    result = await scripts.RECORD_RESULT(redis_db, [TOURNAMENT_GAMES], [
+        f"GAME_{game_id}", "" if game["is_draw"] else game["winner"] or "", game["player1"], game["player2"] or "", TOURNAMENT_PREFIX,
+        TOURNAMENT_REPLAYS,
+    ])
+    if result is None:
+        return
+    tournament_id, match, winner = (value.decode("utf-8") for value in result[:3])
+    seq, pending, replay = result[3:]
+    if replay:
+        await replay_match(tournament_id, match, game, seq, redis_db)
+        return
+    message = {"type": "result", "seq": seq, "match": match, "game_id": int(game_id), "winner": winner or None, "is_draw": game["is_draw"]}
+    if forfeit:
+        message["forfeit"] = True
+    await publish(tournament_id, message)
+    if pending == 0:
+        await start_round(tournament_id, redis_db)
+
+async def replay_match(tournament_id, match: str, game: dict, seq: int, redis_db: Redis):
+    # the drawn game again with the seats swapped, the match keeps its place
+    replay = gameService.new_game(await gameService.next_game_id(redis_db), game["player2"], game["player1"],
+                                  game["board_size"], game["win_length"])
+    async with redis_db.pipeline(transaction=True) as pipe:
+        gameService.queue_new_game(pipe, replay, GameReaper.get_instance().deadline())
+        pipe.hset(TOURNAMENT_GAMES, f"GAME_{replay['id']}", f"{tournament_id}:{match}")
+        pipe.hset(tournament_key(tournament_id) + "_MATCHES", match, orjson.dumps([replay["id"], replay["player1"], replay["player2"]]))
+        await pipe.execute()
+    GameFlusher.get_instance().notify()
+    await publish(tournament_id, {"type": "replay", "seq": seq, "match": match, "round": int(match.split(":")[0]),
+                                  "game_id": replay["id"], "player1": replay["player1"], "player2": replay["player2"]})
+
+async def game_expired(game_id, fields: dict, redis_db: Redis):
+    # a tournament game the reaper deleted, fields as codec.HASH_FIELDS
+    game = codec.decode_game(game_id, fields)
+    forfeit = not game["is_over"]
+    if forfeit:
+        # the player who did not move loses
+        winner = game["player2"] if game["turn"] == game["player1"] else game["player1"]
+        game = {**game, "winner": winner, "is_draw": False, "is_over": True}
+    await game_finished(game_id, game, redis_db, forfeit)
+
+async def get_tournament(tournament_id, redis_db: Redis) -> dict:
+    key = tournament_key(tournament_id)
+    async with redis_db.pipeline(transaction=False) as pipe:
+        pipe.hgetall(key)
+        pipe.hgetall(key + "_MATCHES")
+        pipe.hgetall(key + "_RESULTS")
+        pipe.zrevrange(key + "_STANDINGS", 0, -1, withscores=True)
+        tournament, matches, results, standings = await pipe.execute()
+    if not tournament:
+        raise HTTPException(status_code=404, detail="Tournament not found")
+    tournament = {field.decode("utf-8"): value.decode("utf-8") for field, value in tournament.items()}
+    bracket = []
+    for field, value in matches.items():
+        round, index = (int(part) for part in field.split(b":"))
+        game_id, player1, player2 = orjson.loads(value)
+        result = results.get(field) or b""
+        bracket.append((round, index, {"match": field.decode("utf-8"), "round": round, "game_id": game_id, "player1": player1,
+                                       "player2": player2, "winner": result.decode("utf-8") or None, "is_draw": field in results and not result}))
+    bracket.sort(key=lambda match: match[:2])
+    return {
+        "id": int(tournament_id),
+        "format": tournament["format"],
+        "status": tournament["status"],
+        "round": int(tournament["round"]),
+        "rounds": int(tournament["rounds"]),
+        "players": orjson.loads(tournament["players"]),
+        "board_size": int(tournament["board_size"]),
+        "win_length": int(tournament["win_length"]),
+        "winner": tournament["winner"] or None,
+        "seq": int(tournament["seq"]),
+        "created_at": tournament["created_at"],
+        "matches": [match for _, _, match in bracket],
+        "standings": [{"player": player.decode("utf-8"), "points": score / 2} for player, score in standings],
+    }
@@ -0,0 +1,84 @@
+from fastapi import HTTPException, WebSocket
+from typing import Optional
+from . import codec, engine
+import orjson
+import struct
+
+# Opt-in binary protocol for /games/ws/{game_id}, picked when the client
+# offers SUBPROTOCOL in Sec-WebSocket-Protocol. JSON stays the default.
+# Seats are 1 (player1) and 2 (player2), cells are row * board size + col,
+# flags and bools are packed like the codec state (status | turn | winner |
+# updated_by, is_over | is_draw). Players learn names and the board size
+# from the game they joined or GET /games/{game_id}.
+#
+# client -> server
+#   move   seat, cell                                      >BH, 3 bytes
+# server -> client, first byte is the frame kind
+#   MOVE   kind, seq, cell, flags, bools                   >BIHBB, 9 bytes
+#   STATE  kind, seq, flags, bools, board size, win length >BIBBBB, then the
+#          player1 and player2 bitsets, codec.mask_bytes(size) little endian
+#          bytes each (13 bytes at 3x3). Sent on resume and for AI games,
+#          where one reply carries two moves
+#   ERROR  kind, utf-8 detail
+#   NOTICE kind, any other message as JSON
+#   PONG   kind, the answer to a PING
+# either way
+#   PING   kind, keeps an otherwise quiet socket from being reaped as idle
+SUBPROTOCOL = "tictactoe.binary.v1"
+
+MOVE, STATE, ERROR, NOTICE, PING, PONG = 1, 2, 3, 4, 5, 6
+PING_FRAME = bytes((PING,))
+PONG_FRAME = bytes((PONG,))
+CLIENT_MOVE = struct.Struct(">BH")
+MOVE_FRAME = struct.Struct(">BIHBB")
+STATE_FRAME = struct.Struct(">BIBBBB")
+NO_MOVE = 0xFFFF
+
+class BinaryProtocol:
+    name = SUBPROTOCOL
+
+    def encode(self, message) -> bytes:
+        if isinstance(message, dict) and "board" in message:
+            if message["move"] is None or message.get("mode") == "AI":
+                return self.encode_state(message)
+            return self.encode_move(message)
+        if message == {"type": "pong"}:
+            return PONG_FRAME
+        if isinstance(message, dict) and message.keys() == {"error"}:
+            return bytes((ERROR,)) + str(message["error"]).encode("utf-8")
+        return bytes((NOTICE,)) + orjson.dumps(message)
+
+    def encode_move(self, game: dict) -> bytes:
+        size = game.get("board_size") or engine.BOARD_SIZE
+        cell = engine.cell_index(game["move"][0], game["move"][1], size) if game["move"] else NO_MOVE
+        return MOVE_FRAME.pack(MOVE, game["seq"] or 0, cell, *codec.encode_flags(game))
+
+    def encode_state(self, game: dict) -> bytes:
+        size = game.get("board_size") or engine.BOARD_SIZE
+        length = codec.mask_bytes(size)
+        player1_mask, player2_mask = engine.board_to_masks(game["board"], game["player1_symbol"], game["player2_symbol"])
+        return (STATE_FRAME.pack(STATE, game["seq"] or 0, *codec.encode_flags(game), size, game.get("win_length") or engine.BOARD_SIZE)
+                + player1_mask.to_bytes(length, "little") + player2_mask.to_bytes(length, "little"))
+
+    def replay_frames(self, events: list) -> list:
+        # the board after the missed moves is all a binary client needs
+        return [self.encode_state(events[-1])] if events else []
+
+    def decode_move(self, frame: bytes, game: dict) -> dict:
+        # the UpdateGameModel fields of a move frame, game gives names and size
+        if len(frame) != CLIENT_MOVE.size:
+            raise HTTPException(status_code=400, detail="Invalid move")
+        seat, cell = CLIENT_MOVE.unpack(frame)
+        if seat not in (1, 2):
+            raise HTTPException(status_code=400, detail="Invalid move")
+        turn = game.get(f"player{seat}")
+        if turn is None:
+            # the seat is not taken yet
+            raise HTTPException(status_code=400, detail="It's not your turn")
+        row, col = divmod(cell, game.get("board_size") or engine.BOARD_SIZE)
+        return {"turn": turn, "move": [row, col]}
+
+BINARY = BinaryProtocol()
+
+def negotiate(websocket: WebSocket) -> Optional[BinaryProtocol]:
+    return BINARY if SUBPROTOCOL in websocket.scope.get("subprotocols", ()) else None
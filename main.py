@@ -3,9 +3,21 @@ from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 from dotenv import load_dotenv
-from game.router import router as game_router
-from database import DB
-from redis_database import RedisDB
+from game.router import router as game_router, player_router, tournament_router
+import game.scripts as gameScripts
+from game.flusher import GameFlusher
+from game.lifecycle import GameReaper
+from game.ai import Solver
+from game.matchmaking import Matchmaker
+from game.shards import GameShards
+import game.service as gameService
+import game.stats as gameStats
+from game.schema import GameSchema
+from database import DB, AsyncDB
+from redis_database import AsyncRedisDB
+from websocket_connection_manager import WSConnectionManager
+from metrics import Metrics, router as metrics_router
+from contextlib import asynccontextmanager
 import logging
 import uvicorn
 import os
@@ -14,32 +26,76 @@ load_dotenv()
 
 logger = logging.getLogger("uvicorn")
 
-def lifespan(app: FastAPI):
+@asynccontextmanager
+async def lifespan(app: FastAPI):
     # before app start
 
     # check database connection & create tables if necessary
     db = DB.get_instance()
     db.engine.connect()
     db.Base.metadata.create_all(bind=db.engine)
+    # tables created before an index was added do not get it from create_all
+    for index in GameSchema.__table__.indexes:
+        index.create(bind=db.engine, checkfirst=True)
+    async with AsyncDB.get_instance().engine.connect():
+        pass
     logger.info("Database connection established")
 
     # check redis connection
-    redis_db = RedisDB.get_db()
-    redis_db.ping()
+    redis_db = AsyncRedisDB.get_db()
+    await redis_db.ping()
+    await gameScripts.load_all(redis_db)
     logger.info("Redis connection established")
+
+    # solve the AI table once, before the first bot move needs it
+    Solver.get_instance()
+
+    # replay games a previous run left unflushed, then keep SQL in sync
+    flusher = GameFlusher.get_instance()
+    recovered = await flusher.flush(redis_db)
+    logger.info(f"Recovered {recovered} unflushed games")
+    await flusher.start(redis_db)
+
+    # idle and finished games leave Redis once SQL has them
+    reaper = GameReaper.get_instance()
+    await reaper.start(redis_db)
+
+    # game ids are handed out by Redis, keep them ahead of SQL
+    async with AsyncDB.get_instance().SessionLocal() as session:
+        await gameService.sync_game_ids(session, redis_db)
+        # player counters live in Redis, SQL has them if Redis was emptied
+        await gameStats.sync_player_stats(session, redis_db)
+    matchmaker = Matchmaker.get_instance()
+    await matchmaker.start(redis_db)
+    # games this worker owns are played in memory
+    shards = GameShards.get_instance()
+    await shards.start(redis_db)
+
+    # start websocket broadcast backend
+    connection_manager = WSConnectionManager.get_instance()
+    await connection_manager.start()
     yield
 
     # after app stop
+    await connection_manager.stop()
+    await matchmaker.stop()
+    # replays the moves still held in memory before the flusher's last run
+    await shards.stop()
+    await reaper.stop()
+    await flusher.stop()
 
     # close database connection
     DB.close_db_connection()
-    redis_db.close()
+    await AsyncDB.close_db_connection()
+    await AsyncRedisDB.close_db_connection()
 
 
 app = FastAPI(lifespan=lifespan)
 
 # Route dependencies
-routers = [game_router]
+routers = [game_router, player_router, tournament_router]
+if Metrics.get_instance().enabled:
+    routers.append(metrics_router)
 
 for router in routers:
     app.include_router(router)
@@ -51,6 +107,8 @@ app.add_middleware(GZipMiddleware, minimum_size=1000)
 
 # start app
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=int(os.getenv('PORT', 5000)), reload=True)
+    # protocol level pings, a socket that misses its pong is closed and reaped
+    uvicorn.run("main:app", host="0.0.0.0", port=int(os.getenv('PORT', 5000)), reload=True,
+                ws_ping_interval=float(os.getenv("WS_PING_INTERVAL", "20")), ws_ping_timeout=float(os.getenv("WS_PING_TIMEOUT", "20")))
 
 
@@ -0,0 +1,97 @@
+from fastapi import APIRouter, Response
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from contextlib import nullcontext
+from typing import Callable
+from dotenv import load_dotenv
+import os
+import time
+
+load_dotenv()
+
+# Hot path timings, exposed in Prometheus text format on /metrics. With
+# METRICS_ENABLED=false nothing is created and every call is a no-op.
+
+STAGE_BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0)
+FANOUT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+NOOP = nullcontext()
+
+class StageTimer:
+    __slots__ = ("histogram", "started")
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+class Metrics:
+    instance = None
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.stages = {}
+        self.results = {}
+        if not enabled:
+            return
+        self.registry = CollectorRegistry()
+        self.stage_seconds = Histogram("game_stage_seconds", "Time spent in each stage of a game operation",
+                                       ["operation", "stage"], registry=self.registry, buckets=STAGE_BUCKETS)
+        self.operations = Counter("game_operations", "Game operations by result",
+                                  ["operation", "result"], registry=self.registry)
+        self.fanout = Histogram("websocket_broadcast_fanout", "Sockets a broadcast is delivered to on this worker",
+                                registry=self.registry, buckets=FANOUT_BUCKETS)
+        self.gauges = {
+            "active_games": Gauge("game_active_games", "Games with a connected socket on this worker", registry=self.registry),
+            "websocket_connections": Gauge("websocket_connections", "Open sockets on this worker", registry=self.registry),
+            "websocket_queue_depth": Gauge("websocket_queue_depth", "Frames waiting in send queues on this worker", registry=self.registry),
+            "db_pool_in_use": Gauge("db_pool_connections_in_use", "SQL connections checked out of the pool", registry=self.registry),
+            "db_pool_limit": Gauge("db_pool_connections_limit", "SQL pool size plus overflow", registry=self.registry),
+            "redis_pool_in_use": Gauge("redis_pool_connections_in_use", "Redis connections checked out of the shared pool", registry=self.registry),
+            "redis_pool_limit": Gauge("redis_pool_connections_limit", "Size of the shared Redis pool", registry=self.registry),
+            "game_actors": Gauge("game_actors", "Games held in memory by this worker's shard", registry=self.registry),
+        }
+
+    def time(self, operation: str, stage: str):
+        # with metrics.time("update", "apply_move"): ...
+        if not self.enabled:
+            return NOOP
+        histogram = self.stages.get((operation, stage))
+        if histogram is None:
+            histogram = self.stages[(operation, stage)] = self.stage_seconds.labels(operation, stage)
+        return StageTimer(histogram)
+
+    def count(self, operation: str, result: str = "ok"):
+        if not self.enabled:
+            return
+        counter = self.results.get((operation, result))
+        if counter is None:
+            counter = self.results[(operation, result)] = self.operations.labels(operation, result)
+        counter.inc()
+
+    def observe_fanout(self, sockets: int):
+        if self.enabled:
+            self.fanout.observe(sockets)
+
+    def watch(self, gauge: str, function: Callable[[], float]):
+        # gauges are read at scrape time, nothing is updated on the hot path
+        if self.enabled:
+            self.gauges[gauge].set_function(function)
+
+    def render(self) -> bytes:
+        return generate_latest(self.registry)
+
+    @staticmethod
+    def get_instance():
+        if Metrics.instance is None:
+            Metrics.instance = Metrics(os.getenv("METRICS_ENABLED", "true").lower() not in ("0", "false", "no", "off"))
+        return Metrics.instance
+
+router = APIRouter(tags=['Metrics'])
+
+@router.get('/metrics', summary="Prometheus metrics of this worker")
+async def metrics():
+    return Response(Metrics.get_instance().render(), media_type=CONTENT_TYPE_LATEST)
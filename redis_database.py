@@ -1,13 +1,27 @@
 import redis
+import redis.asyncio
 from dotenv import load_dotenv
+from metrics import Metrics
 import os
 
 load_dotenv()
 
+# One explicitly sized pool per process, shared by every caller. Long lived
+# pub/sub listeners (broadcast backend, matchmaker) each hold one connection.
+# When all are busy callers wait up to REDIS_POOL_TIMEOUT instead of failing.
+def pool_options() -> dict:
+    return {
+        "host": os.getenv('REDIS_URL', 'localhost'),
+        "port": int(os.getenv('REDIS_PORT', '6379')),
+        "max_connections": int(os.getenv('REDIS_MAX_CONNECTIONS', '50')),
+        "timeout": float(os.getenv('REDIS_POOL_TIMEOUT', '5')),
+    }
+
 class RedisDB:
     instance = None
     def __init__(self):
-        self.redis  = redis.Redis(host = os.getenv('REDIS_URL', 'localhost'))
+        self.pool = redis.BlockingConnectionPool(**pool_options())
+        self.redis = redis.Redis(connection_pool=self.pool)
 
     @staticmethod
     def get_db():
@@ -17,4 +31,31 @@ class RedisDB:
     def get_instance():
         if RedisDB.instance is None:
             RedisDB.instance = RedisDB()
-        return RedisDB.instance
\ No newline at end of file
+        return RedisDB.instance
+
+class AsyncRedisDB:
+    instance = None
+    def __init__(self):
+        # redis-py picks the hiredis parser automatically when it is installed
+        self.pool = redis.asyncio.BlockingConnectionPool(**pool_options())
+        self.redis = redis.asyncio.Redis(connection_pool=self.pool)
+        metrics = Metrics.get_instance()
+        metrics.watch("redis_pool_in_use", lambda: len(self.pool._in_use_connections))
+        metrics.watch("redis_pool_limit", lambda: self.pool.max_connections)
+
+    @staticmethod
+    def get_db():
+        return AsyncRedisDB.get_instance().redis
+
+    @staticmethod
+    def get_instance():
+        if AsyncRedisDB.instance is None:
+            AsyncRedisDB.instance = AsyncRedisDB()
+        return AsyncRedisDB.instance
+
+    @staticmethod
+    async def close_db_connection():
+        # the client does not own the pool, its connections are closed here
+        if AsyncRedisDB.instance is not None:
+            await AsyncRedisDB.instance.redis.aclose()
+            await AsyncRedisDB.instance.pool.disconnect()
@@ -1,27 +1,590 @@
-from collections import defaultdict
+from collections import deque
 from fastapi import WebSocket
+from typing import Awaitable, Callable, Iterable, Optional
+from redis_database import AsyncRedisDB
+from metrics import Metrics
+import asyncio
+import logging
+import orjson
+import os
+import time
+import uuid
+
+logger = logging.getLogger("uvicorn")
+
+class LocalBroadcastBackend:
+    # single worker: publishing is delivering
+    def __init__(self, manager: "WSConnectionManager"):
+        self.manager = manager
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def subscribe(self, channel_id: str):
+        pass
+
+    def unsubscribe(self, channel_id: str):
+        pass
+
+    async def publish(self, channel_id: str, message, exclude_ids: Iterable[int] = (), spectator_message = None):
+        self.manager.deliver(channel_id, message, exclude_ids, spectator_message)
+
+    async def publish_many(self, broadcasts: list):
+        for channel_id, message, spectator_message in broadcasts:
+            self.manager.deliver(channel_id, message, (), spectator_message)
+
+    async def close(self, channel_ids: list, reason: str):
+        for channel_id in channel_ids:
+            self.manager.close_channel(channel_id, reason)
+
+class RedisBroadcastBackend:
+    # Publishes every channel event on a Redis channel and delivers whatever
+    # arrives to the local sockets. Each worker holds one pub/sub connection,
+    # subscribed only to the channels that have a socket on this worker.
+    CHANNEL_PREFIX = "WS_"
+
+    def __init__(self, manager: "WSConnectionManager", redis_db = None):
+        self.manager = manager
+        self.redis = redis_db
+        self.worker_id = uuid.uuid4().hex
+        self.pubsub = None
+        self.listener: Optional[asyncio.Task] = None
+        self.pending_unsubscribe = set()
+        self.subscription_lock = asyncio.Lock()
+
+    async def start(self):
+        if self.redis is None:
+            self.redis = AsyncRedisDB.get_db()
+        if self.pubsub is None:
+            self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+
+    async def stop(self):
+        if self.listener is not None:
+            self.listener.cancel()
+            try:
+                await self.listener
+            except asyncio.CancelledError:
+                pass
+            self.listener = None
+        if self.pubsub is not None:
+            await self.pubsub.aclose()
+            self.pubsub = None
+
+    async def subscribe(self, channel_id: str):
+        await self.start()
+        async with self.subscription_lock:
+            self.pending_unsubscribe.discard(channel_id)
+            await self.pubsub.subscribe(self.CHANNEL_PREFIX + channel_id)
+        # the pub/sub connection only exists after the first subscribe
+        if self.listener is None:
+            self.listener = asyncio.get_running_loop().create_task(self.listen())
+
+    def unsubscribe(self, channel_id: str):
+        # applied by the listener so the pub/sub connection has a single reader
+        self.pending_unsubscribe.add(channel_id)
+
+    async def publish(self, channel_id: str, message, exclude_ids: Iterable[int] = (), spectator_message = None):
+        if self.redis is None:
+            await self.start()
+        envelope = {"origin": self.worker_id, "exclude": list(exclude_ids), "message": message, "spectate": spectator_message}
+        await self.redis.publish(self.CHANNEL_PREFIX + channel_id, orjson.dumps(envelope))
+
+    async def publish_many(self, broadcasts: list):
+        # one pipeline for (channel_id, message, spectator_message) in order
+        if self.redis is None:
+            await self.start()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for channel_id, message, spectator_message in broadcasts:
+                envelope = {"origin": self.worker_id, "exclude": [], "message": message, "spectate": spectator_message}
+                pipe.publish(self.CHANNEL_PREFIX + channel_id, orjson.dumps(envelope))
+            await pipe.execute()
+
+    async def close(self, channel_ids: list, reason: str):
+        # reaches the workers that still hold sockets of these channels
+        if self.redis is None:
+            await self.start()
+        envelope = orjson.dumps({"origin": self.worker_id, "close": reason})
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for channel_id in channel_ids:
+                pipe.publish(self.CHANNEL_PREFIX + channel_id, envelope)
+            await pipe.execute()
+
+    async def listen(self):
+        prefix_length = len(self.CHANNEL_PREFIX)
+        while True:
+            try:
+                if self.pending_unsubscribe:
+                    async with self.subscription_lock:
+                        while self.pending_unsubscribe:
+                            channel_id = self.pending_unsubscribe.pop()
+                            if not self.manager.watched(channel_id):
+                                await self.pubsub.unsubscribe(self.CHANNEL_PREFIX + channel_id)
+                event = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if event is None or event["type"] != "message":
+                    continue
+                channel_id = event["channel"].decode("utf-8")[prefix_length:]
+                envelope = orjson.loads(event["data"])
+                if "close" in envelope:
+                    self.manager.close_channel(channel_id, envelope["close"])
+                    continue
+                exclude_ids = envelope["exclude"] if envelope["origin"] == self.worker_id else ()
+                self.manager.deliver(channel_id, envelope["message"], exclude_ids, envelope.get("spectate"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Broadcast listener error: {e}")
+                await asyncio.sleep(1)
+
+def release(sent: Optional[asyncio.Future]):
+    if sent is not None and not sent.done():
+        sent.set_result(None)
+
+class ConnectionWriter:
+    # Bounded outgoing queue for one socket, drained by its own task so a slow
+    # client only delays itself. When the queue is full the "coalesce" policy
+    # discards the oldest (stale) frame, "drop" disconnects the consumer.
+    # Sockets with a protocol (a negotiated subprotocol) get its bytes frames
+    # instead of JSON text. Those apply MOVE deltas, so dropping one would
+    # leave the client's board wrong: when such a queue is full, everything
+    # in it gives way to one STATE frame of the latest game. Personal frames
+    # (pongs, errors) are queued too, so the socket has a single sender and
+    # keeps its frame order.
+    def __init__(self, websocket: WebSocket, manager: "WSConnectionManager", holding: bool = False, protocol = None):
+        self.websocket = websocket
+        self.manager = manager
+        self.protocol = protocol
+        self.channels = set()
+        self.queue = deque()
+        self.ready = asyncio.Event()
+        self.closed = False
+        # a resuming socket queues live frames until its replay is in,
+        # then skips the ones up to the seq the replay went through
+        self.holding = holding
+        self.replayed_through = -1
+        # the last game sent to a protocol socket, its STATE frame replaces a full queue
+        self.latest = None
+        # last frame either way, see WSConnectionManager.reap
+        self.last_active = time.monotonic()
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def enqueue(self, frame, seq: Optional[int] = None, game: Optional[dict] = None, sent: Optional[asyncio.Future] = None):
+        # sent, when given, resolves once the frame went out or never will
+        if self.closed:
+            release(sent)
+            return
+        if game is not None and self.protocol is not None:
+            self.latest = game
+        if len(self.queue) >= self.manager.send_queue_size:
+            if self.manager.slow_consumer_policy == "drop":
+                self.manager.dropped_frames += len(self.queue) + 1
+                self.manager.dropped_connections += 1
+                self.manager.drop(self.websocket)
+                release(sent)
+                return
+            if self.latest is not None:
+                self.manager.dropped_frames += len(self.queue)
+                self.clear()
+                state = self.protocol.encode_state(self.latest)
+                if game is not None:
+                    frame = state
+                else:
+                    self.queue.append((self.latest.get("seq"), state, None))
+            else:
+                release(self.queue.popleft()[2])
+                self.manager.dropped_frames += 1
+        self.queue.append((seq, frame, sent))
+        self.manager.max_queue_depth = max(self.manager.max_queue_depth, len(self.queue))
+        self.ready.set()
+
+    async def run(self):
+        while True:
+            if not self.queue or self.holding:
+                self.ready.clear()
+                await self.ready.wait()
+                continue
+            seq, frame, sent = self.queue.popleft()
+            if seq is not None and seq <= self.replayed_through:
+                release(sent)
+                continue
+            try:
+                if isinstance(frame, bytes):
+                    await self.websocket.send_bytes(frame)
+                else:
+                    await self.websocket.send_text(frame)
+                self.last_active = time.monotonic()
+            except Exception:
+                # a dead socket, reaped by the manager
+                self.closed = True
+                self.clear()
+                return
+            finally:
+                release(sent)
+
+    async def send(self, frame):
+        # behind the frames already queued, returns once it went out or could not
+        sent = asyncio.get_running_loop().create_future()
+        self.enqueue(frame, sent=sent)
+        await sent
+
+    def clear(self):
+        for _, _, sent in self.queue:
+            release(sent)
+        self.queue.clear()
+
+    def replay(self, frames: list, through: int):
+        # missed events go out before anything queued, live frames they cover are skipped
+        self.replayed_through = max(self.replayed_through, through)
+        self.queue.extendleft((None, frame, None) for frame in reversed(frames))
+        self.holding = False
+        self.ready.set()
+
+    def close(self):
+        self.closed = True
+        self.clear()
+        self.task.cancel()
+
+class SpectatorFeed:
+    # Spectators of one game share the latest encoded frame instead of a
+    # queue each. Every spectator frame carries the whole mutable state, so
+    # one that falls behind skips to the newest frame and a publish costs one
+    # encode however many are watching. Idle spectators are woken
+    # WAKE_BATCH at a time, one batch per loop iteration, so thousands of
+    # them do not stall every other socket on the worker.
+    WAKE_BATCH = 256
+
+    def __init__(self):
+        self.frame = None
+        self.version = 0
+        self.waiters: list[asyncio.Future] = []
+        # id(websocket) -> (websocket, watch task once the snapshot is out)
+        self.spectators: dict[int, tuple] = {}
+
+    def publish(self, frame: str):
+        self.frame = frame
+        self.version += 1
+        waiters, self.waiters = self.waiters, []
+        self.wake(waiters, 0)
+
+    def wake(self, waiters: list, start: int):
+        for waiter in waiters[start:start + self.WAKE_BATCH]:
+            if not waiter.done():
+                waiter.set_result(None)
+        if start + self.WAKE_BATCH < len(waiters):
+            asyncio.get_running_loop().call_soon(self.wake, waiters, start + self.WAKE_BATCH)
+
+    async def watch(self, websocket: WebSocket, version: int):
+        while True:
+            if version == self.version:
+                waiter = asyncio.get_running_loop().create_future()
+                self.waiters.append(waiter)
+                await waiter
+                continue
+            version = self.version
+            try:
+                await websocket.send_text(self.frame)
+            except Exception:
+                return
+
+BROADCAST_BACKENDS = {
+    "local": LocalBroadcastBackend,
+    "redis": RedisBroadcastBackend,
+}
+
 class WSConnectionManager:
+    # Registry of this worker's sockets: channel -> player sockets, a writer
+    # per socket and the spectator feeds. Channels are dropped with their
+    # last socket. start() runs a reaper that closes sockets with no frame
+    # either way for idle_timeout and removes dead ones (a failed send),
+    # clients stay alive by sending {"type": "ping"}. Transport pings are
+    # uvicorn's (main.py). connect and spectate turn sockets away past
+    # max_connections on the worker or max_channel_connections players
+    # on a channel.
     instance = None
-    def __init__(self):
-        self.active_connections = defaultdict(list)
+    def __init__(self, backend: str = "local", send_queue_size: int = 64, slow_consumer_policy: str = "coalesce",
+                 idle_timeout: float = 300.0, reap_interval: float = 5.0, max_connections: int = 10000, max_channel_connections: int = 16):
+        self.active_connections: dict[str, list] = {}
+        self.writers: dict[int, ConnectionWriter] = {}
+        self.feeds: dict[str, SpectatorFeed] = {}
+        self.backend = BROADCAST_BACKENDS[backend](self)
+        self.send_queue_size = send_queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.dropped_frames = 0
+        self.dropped_connections = 0
+        self.max_queue_depth = 0
+        self.idle_timeout = idle_timeout
+        self.reap_interval = reap_interval
+        self.max_connections = max_connections
+        self.max_channel_connections = max_channel_connections
+        self.reaper: Optional[asyncio.Task] = None
+        self.reaped_connections = 0
+        self.rejected_connections = 0
+        self.metrics = Metrics.get_instance()
+        self.metrics.watch("active_games", lambda: sum(1 for connections in self.active_connections.values() if connections))
+        self.metrics.watch("websocket_connections", lambda: len(self.writers) + self.spectator_count())
+        self.metrics.watch("websocket_queue_depth", self.queue_depth)
 
-    async def connect(self, websocket: WebSocket, channel_id: str):
-        await websocket.accept()
-        self.active_connections[channel_id].append(websocket)
+    async def start(self):
+        await self.backend.start()
+        if self.reaper is None and self.idle_timeout > 0:
+            self.reaper = asyncio.get_running_loop().create_task(self.run_reaper())
+
+    async def stop(self):
+        if self.reaper is not None:
+            self.reaper.cancel()
+            try:
+                await self.reaper
+            except asyncio.CancelledError:
+                pass
+            self.reaper = None
+        await self.backend.stop()
+
+    async def run_reaper(self):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            try:
+                self.reap()
+            except Exception as e:
+                logger.warning(f"Connection reaper error: {e}")
+
+    def reap(self, now: Optional[float] = None) -> int:
+        # closes idle sockets, forgets dead ones, returns how many went
+        now = time.monotonic() if now is None else now
+        reaped = 0
+        for writer in list(self.writers.values()):
+            if not writer.closed and now - writer.last_active <= self.idle_timeout:
+                continue
+            websocket, idle = writer.websocket, not writer.closed
+            for channel_id in list(writer.channels):
+                self.disconnect(websocket, channel_id)
+            if idle:
+                asyncio.get_running_loop().create_task(self._close(websocket, 1001, "Idle timeout"))
+            reaped += 1
+        for channel_id, feed in list(self.feeds.items()):
+            for websocket, task in list(feed.spectators.values()):
+                # watch returns when a send fails
+                if task is not None and task.done():
+                    self.unspectate(websocket, channel_id)
+                    reaped += 1
+        self.reaped_connections += reaped
+        return reaped
+
+    def touch(self, websocket: WebSocket):
+        # a frame came in, the socket is not idle
+        writer = self.writers.get(id(websocket))
+        if writer is not None:
+            writer.last_active = time.monotonic()
+
+    async def admit(self, websocket: WebSocket, channel_id: Optional[str] = None, protocol = None) -> bool:
+        # accepts and closes sockets past the limits so clients get the reason
+        reason = None
+        if id(websocket) not in self.writers and len(self.writers) + self.spectator_count() >= self.max_connections:
+            code, reason = 1013, "Too many connections"
+        elif channel_id is not None and len(self.active_connections.get(channel_id, ())) >= self.max_channel_connections:
+            code, reason = 1008, "Too many connections to this game"
+        if reason is None:
+            return True
+        self.rejected_connections += 1
+        if id(websocket) in self.writers:
+            # still open on its other channels
+            return False
+        if protocol is None:
+            await websocket.accept()
+        else:
+            await websocket.accept(subprotocol=protocol.name)
+        await self._close(websocket, code, reason)
+        return False
+
+    def watched(self, channel_id: str) -> bool:
+        return bool(self.active_connections.get(channel_id) or channel_id in self.feeds)
+
+    async def connect(self, websocket: WebSocket, channel_id: str, resume: bool = False, protocol = None) -> bool:
+        # resume=True holds the socket's frames until replay() is called,
+        # protocol (see game.wire) is accepted as the socket's subprotocol.
+        # False when the socket was turned away
+        if not await self.admit(websocket, channel_id, protocol):
+            return False
+        if protocol is None:
+            await websocket.accept()
+        else:
+            await websocket.accept(subprotocol=protocol.name)
+        if not self.watched(channel_id):
+            await self.backend.subscribe(channel_id)
+        self.active_connections.setdefault(channel_id, []).append(websocket)
+        writer = self.writers.get(id(websocket))
+        if writer is None:
+            writer = self.writers[id(websocket)] = ConnectionWriter(websocket, self, resume, protocol)
+        writer.channels.add(channel_id)
+        return True
 
     def disconnect(self, websocket, channel_id: str):
-        self.active_connections[channel_id].remove(websocket)
+        connections = self.active_connections.get(channel_id)
+        if connections and websocket in connections:
+            connections.remove(websocket)
+        if not connections:
+            # empty channels are dropped so finished games do not pile up here
+            self.active_connections.pop(channel_id, None)
+            if channel_id not in self.feeds:
+                self.backend.unsubscribe(channel_id)
+        writer = self.writers.get(id(websocket))
+        if writer is not None:
+            writer.channels.discard(channel_id)
+            if not writer.channels:
+                writer.close()
+                del self.writers[id(websocket)]
+
+    async def spectate(self, websocket: WebSocket, channel_id: str, load_snapshot: Callable[[], Awaitable[Optional[str]]]) -> bool:
+        # registers before the snapshot is read so no event can fall in between,
+        # an event older than the snapshot is told apart by its seq. False when
+        # there is no game or the socket was turned away (and closed)
+        if not await self.admit(websocket):
+            return False
+        await websocket.accept()
+        feed = self.feeds.get(channel_id)
+        if feed is None:
+            subscribe = not self.watched(channel_id)
+            feed = self.feeds[channel_id] = SpectatorFeed()
+            if subscribe:
+                await self.backend.subscribe(channel_id)
+        version = feed.version
+        feed.spectators[id(websocket)] = (websocket, None)
+        try:
+            snapshot = await load_snapshot()
+            if snapshot is not None:
+                await websocket.send_text(snapshot)
+        except BaseException:
+            # the caller's unspectate is not reached, reap only sees finished tasks
+            self.unspectate(websocket, channel_id)
+            raise
+        if snapshot is None:
+            self.unspectate(websocket, channel_id)
+            return False
+        if id(websocket) in feed.spectators:
+            feed.spectators[id(websocket)] = (websocket, asyncio.get_running_loop().create_task(feed.watch(websocket, version)))
+        return True
+
+    def unspectate(self, websocket: WebSocket, channel_id: str):
+        feed = self.feeds.get(channel_id)
+        if feed is None:
+            return
+        _, task = feed.spectators.pop(id(websocket), (None, None))
+        if task is not None:
+            task.cancel()
+        if not feed.spectators:
+            del self.feeds[channel_id]
+            if not self.active_connections.get(channel_id):
+                self.backend.unsubscribe(channel_id)
+
+    def replay(self, websocket: WebSocket, events: list):
+        # missed events of a socket connected with resume=True, may be empty
+        writer = self.writers.get(id(websocket))
+        if writer is not None:
+            if writer.protocol is None:
+                frames = [orjson.dumps(event).decode("utf-8") for event in events]
+            else:
+                frames = writer.protocol.replay_frames(events)
+            writer.replay(frames, max((event["seq"] for event in events), default=-1))
+
+    def spectator_count(self) -> int:
+        return sum(len(feed.spectators) for feed in self.feeds.values())
+
+    def drop(self, websocket: WebSocket):
+        # slow consumer: stop queueing for it and close it without waiting
+        writer = self.writers.get(id(websocket))
+        for channel_id in list(writer.channels if writer else []):
+            self.disconnect(websocket, channel_id)
+        asyncio.get_running_loop().create_task(self._close(websocket))
+
+    async def close_channels(self, channel_ids: list, reason: str):
+        # on every worker, e.g. when games expire
+        if channel_ids:
+            await self.backend.close(channel_ids, reason)
+
+    def close_channel(self, channel_id: str, reason: str):
+        for websocket in list(self.active_connections.get(channel_id, [])):
+            self.disconnect(websocket, channel_id)
+            asyncio.get_running_loop().create_task(self._close(websocket, 1001, reason))
+        feed = self.feeds.get(channel_id)
+        for websocket, _ in list(feed.spectators.values() if feed else ()):
+            self.unspectate(websocket, channel_id)
+            asyncio.get_running_loop().create_task(self._close(websocket, 1001, reason))
+
+    async def _close(self, websocket: WebSocket, code: int = 1013, reason: Optional[str] = None):
+        try:
+            await websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
 
     async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_json(message)
+        # through the socket's writer, never past or alongside its queued frames
+        writer = self.writers.get(id(websocket))
+        if writer is None:
+            await websocket.send_json(message)
+        elif writer.protocol is None:
+            await writer.send(orjson.dumps(message).decode("utf-8"))
+        else:
+            await writer.send(writer.protocol.encode(message))
+
+    async def broadcast(self, message: str, channel_id: str, exclude: list[WebSocket] = [], spectator_message = None):
+        # spectators only get spectator_message, players never see it
+        await self.backend.publish(channel_id, message, [id(connection) for connection in exclude], spectator_message)
+
+    async def broadcast_many(self, broadcasts: list):
+        # broadcast for many (channel_id, message, spectator_message), one Redis round trip
+        if broadcasts:
+            await self.backend.publish_many(broadcasts)
+
+    def deliver(self, channel_id: str, message, exclude_ids: Iterable[int] = (), spectator_message = None):
+        # encoded once per protocol, every socket gets the same frame
+        delivered = 0
+        connections = self.active_connections.get(channel_id)
+        if connections:
+            frames = {}
+            seq = message.get("seq") if isinstance(message, dict) else None
+            game = message if isinstance(message, dict) and "board" in message else None
+            for connection in list(connections):
+                if id(connection) in exclude_ids: continue
+                writer = self.writers.get(id(connection))
+                if writer is not None:
+                    frame = frames.get(writer.protocol)
+                    if frame is None:
+                        frame = frames[writer.protocol] = (orjson.dumps(message).decode("utf-8") if writer.protocol is None
+                                                           else writer.protocol.encode(message))
+                    writer.enqueue(frame, seq, game)
+                    delivered += 1
+        feed = self.feeds.get(channel_id)
+        if feed is not None and spectator_message is not None:
+            # after the player writers woken above
+            asyncio.get_running_loop().call_soon(feed.publish, orjson.dumps(spectator_message).decode("utf-8"))
+            delivered += len(feed.spectators)
+        self.metrics.observe_fanout(delivered)
+
+    def queue_depth(self) -> int:
+        return sum(len(writer.queue) for writer in self.writers.values())
+
+    def stats(self) -> dict:
+        return {
+            "connections": len(self.writers),
+            "queue_depth": self.queue_depth(),
+            "max_queue_depth": self.max_queue_depth,
+            "dropped_frames": self.dropped_frames,
+            "dropped_connections": self.dropped_connections,
+            "reaped_connections": self.reaped_connections,
+            "rejected_connections": self.rejected_connections,
+        }
 
-    async def broadcast(self, message: str, channel_id: str, exclude: list[WebSocket] = []):
-        for connection in self.active_connections[channel_id]:
-            if connection in exclude: continue
-            await connection.send_json(message)
-    
     @staticmethod
     def get_instance():
         if WSConnectionManager.instance is None:
-            WSConnectionManager.instance = WSConnectionManager()
-        return WSConnectionManager.instance
\ No newline at end of file
+            WSConnectionManager.instance = WSConnectionManager(
+                os.getenv("BROADCAST_BACKEND", "local"),
+                int(os.getenv("WS_SEND_QUEUE_SIZE", "64")),
+                os.getenv("WS_SLOW_CONSUMER_POLICY", "coalesce"),
+                float(os.getenv("WS_IDLE_TIMEOUT", "300")),
+                float(os.getenv("WS_REAP_INTERVAL", "5")),
+                int(os.getenv("WS_MAX_CONNECTIONS", "10000")),
+                int(os.getenv("WS_MAX_GAME_CONNECTIONS", "16")),
+            )
+        return WSConnectionManager.instance